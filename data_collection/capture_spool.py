@@ -0,0 +1,194 @@
+##########################################
+# Append-only on-disk spool for captures
+##########################################
+#
+# Every capture is written to disk as soon as it is taken, so memory use
+# doesn't grow with the number of waypoints and a crash mid-flight loses at
+# most the capture being written.
+#
+#   <dir>/captures.bin   records: RECORD header, ir payload, rgb payload
+#   <dir>/captures.idx   one INDEX entry (offset, length) per record
+#
+# The index is appended after its record is on disk. When a spool is opened
+# again any complete records past the last index entry (crash between the
+# two writes) are recovered by checking their CRC.
+
+import os
+import struct
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+MAGIC = b"CAPT"
+# magic, crc32 of payloads, time, lat, lon, ir rows/cols, rgb h/w/c,
+# rgb format, ir bytes, rgb bytes
+RECORD = struct.Struct("<4sIdddHHHHBBxxII")
+INDEX = struct.Struct("<QI")
+
+# rgb payloads are stored raw, or already encoded by an image codec
+RGB_FORMATS = {"raw": 0, "png": 1, "jpeg": 2}
+RGB_FORMAT_NAMES = {v: k for k, v in RGB_FORMATS.items()}
+
+# same layout as the tuples collectPhotos used to keep in memory
+Capture = namedtuple("Capture", ["ir_data", "img_data", "coord", "time"])
+
+
+class CaptureSpool:
+    def __init__(self, directory, fsync=True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+
+        self.data_path = self.directory / "captures.bin"
+        self.index_path = self.directory / "captures.idx"
+        self.data = open(self.data_path, "a+b")
+        self.index_file = open(self.index_path, "a+b")
+        self.entries = self._loadIndex()
+
+    def _loadIndex(self):
+        self.index_file.seek(0)
+        raw = self.index_file.read()
+        entries = [INDEX.unpack_from(raw, i) for i in range(0, len(raw) - len(raw) % INDEX.size, INDEX.size)]
+
+        # drop entries pointing past the end of the data, then pick up any
+        # records that made it to disk without their index entry
+        size = os.path.getsize(self.data_path)
+        entries = [(offset, length) for offset, length in entries if offset + length <= size]
+        offset = entries[-1][0] + entries[-1][1] if entries else 0
+        recovered = []
+        while offset + RECORD.size <= size:
+            length = self._recordLength(offset, size)
+            if length is None:
+                break
+            recovered.append((offset, length))
+            offset += length
+        if offset < size:
+            # a record torn by the crash; later appends start where it did
+            self.data.truncate(offset)
+            self._sync(self.data)
+
+        if recovered or len(entries) * INDEX.size != len(raw):
+            entries += recovered
+            self.index_file.seek(0)
+            self.index_file.truncate()
+            self.index_file.write(b"".join(INDEX.pack(*e) for e in entries))
+            self._sync(self.index_file)
+        return entries
+
+    def _recordLength(self, offset, size):
+        self.data.seek(offset)
+        header = self.data.read(RECORD.size)
+        magic, crc, *_, ir_nbytes, rgb_nbytes = RECORD.unpack(header)
+        length = RECORD.size + ir_nbytes + rgb_nbytes
+        if magic != MAGIC or offset + length > size:
+            return None
+        if zlib.crc32(self.data.read(ir_nbytes + rgb_nbytes)) != crc:
+            return None
+        return length
+
+    def _sync(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, ir_data, img_data, coord, when, rgb_format="raw"):
+        """Write one capture; img_data is an array, or bytes already in rgb_format.
+
+        Returns the capture's index in the spool.
+        """
+        ir = np.ascontiguousarray(ir_data, dtype="<f4")
+        if rgb_format == "raw":
+            rgb = np.ascontiguousarray(img_data, dtype=np.uint8)
+            rgb_shape = rgb.shape
+            rgb_bytes = memoryview(rgb.reshape(-1))
+        else:
+            rgb_shape = (0, 0, 0)
+            rgb_bytes = memoryview(img_data)
+
+        when = np.asarray(when).reshape(-1)[0]
+        timestamp = when.timestamp() if isinstance(when, datetime) else float(when)
+        lat, lon = (float(v) for v in coord)
+
+        crc = zlib.crc32(rgb_bytes, zlib.crc32(memoryview(ir.reshape(-1)).cast("B")))
+        header = RECORD.pack(
+            MAGIC, crc, timestamp, lat, lon, *ir.shape, *rgb_shape,
+            RGB_FORMATS[rgb_format], ir.nbytes, rgb_bytes.nbytes,
+        )
+
+        self.data.seek(0, os.SEEK_END)
+        offset = self.data.tell()
+        self.data.write(header)
+        self.data.write(ir)
+        self.data.write(rgb_bytes)
+        self._sync(self.data)
+
+        entry = (offset, RECORD.size + ir.nbytes + rgb_bytes.nbytes)
+        self.index_file.seek(0, os.SEEK_END)
+        self.index_file.write(INDEX.pack(*entry))
+        self._sync(self.index_file)
+        self.entries.append(entry)
+        return len(self.entries) - 1
+
+    def readRaw(self, i):
+        """(Capture, rgb_format) with img_data left as stored (array or encoded bytes)."""
+        offset, length = self.entries[i]
+        self.data.seek(offset)
+        raw = self.data.read(length)
+        _, _, timestamp, lat, lon, ir_rows, ir_cols, h, w, c, rgb_format, ir_nbytes, _ = RECORD.unpack_from(raw)
+
+        ir = np.frombuffer(raw, dtype="<f4", count=ir_rows * ir_cols, offset=RECORD.size).reshape(ir_rows, ir_cols)
+        rgb_start = RECORD.size + ir_nbytes
+        if RGB_FORMAT_NAMES[rgb_format] == "raw":
+            rgb = np.frombuffer(raw, dtype=np.uint8, offset=rgb_start).reshape(h, w, c)
+        else:
+            rgb = raw[rgb_start:]
+
+        when = np.array([datetime.fromtimestamp(timestamp)])
+        return Capture(ir.astype(np.float64), rgb, [lat, lon], when), RGB_FORMAT_NAMES[rgb_format]
+
+    def readMeta(self, i):
+        """(coord, time) of capture i without reading its images."""
+        offset, _ = self.entries[i]
+        self.data.seek(offset)
+        _, _, timestamp, lat, lon, *_ = RECORD.unpack(self.data.read(RECORD.size))
+        return [lat, lon], np.array([datetime.fromtimestamp(timestamp)])
+
+    def readIR(self, i):
+        """IR frame of capture i without reading its rgb image."""
+        offset, _ = self.entries[i]
+        self.data.seek(offset)
+        header = self.data.read(RECORD.size)
+        _, _, _, _, _, ir_rows, ir_cols, *_, ir_nbytes, _ = RECORD.unpack(header)
+        ir = np.frombuffer(self.data.read(ir_nbytes), dtype="<f4").reshape(ir_rows, ir_cols)
+        return ir.astype(np.float64)
+
+    def read(self, i):
+        """Capture i, with img_data decoded to an (h, w, 3) uint8 array."""
+        capture, rgb_format = self.readRaw(i)
+        if rgb_format != "raw":
+            img = np.asarray(Image.open(BytesIO(capture.img_data)).convert("RGB"))
+            capture = capture._replace(img_data=img)
+        return capture
+
+    def __iter__(self):
+        # lazily, one capture in memory at a time
+        for i in range(len(self)):
+            yield self.read(i)
+
+    def close(self):
+        self.data.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
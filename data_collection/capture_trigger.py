@@ -0,0 +1,153 @@
+##########################################
+# Waypoint triggers from the Pixhawk
+##########################################
+#
+# The Pixhawk raises a GPIO pin at every waypoint. Two ways to wait for it:
+#
+#   TriggerQueue   edge detection: the GPIO library calls back on the rising
+#                  edge, the trigger is stamped with time.monotonic() (and
+#                  the GPS fix) right there and queued for the capture loop,
+#                  so triggers during a capture are kept, not missed.
+#   PolledTrigger  the original loop: spin on GPIO.input until the pin is
+#                  high, and after each capture until it has been low for a
+#                  second.
+#
+# Both take the GPIO module as an argument so fake_hardware.FakeGPIO can
+# stand in for RPi.GPIO, and both record trigger-to-capture latency and
+# dropped triggers in a TriggerStats.
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# seq: trigger number, t: time.monotonic() at the edge, stamp: stamp() result
+Trigger = namedtuple("Trigger", ["seq", "t", "stamp"])
+
+
+class TriggerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.triggers = 0
+        self.dropped = 0
+        self.latencies = []  # trigger -> capture started
+        self.durations = []  # capture started -> finished
+
+    def summary(self):
+        with self.lock:
+            latency = np.array(self.latencies) * 1000
+            duration = np.array(self.durations) * 1000
+            summary = {"triggers": self.triggers, "captured": len(self.latencies), "dropped": self.dropped}
+        for name, values in (("latency_ms", latency), ("capture_ms", duration)):
+            if len(values):
+                summary[name] = {
+                    "p50": float(np.percentile(values, 50)),
+                    "p95": float(np.percentile(values, 95)),
+                    "max": float(values.max()),
+                }
+        return summary
+
+    def report(self):
+        s = self.summary()
+        line = f"{s['triggers']} triggers, {s['captured']} captured, {s['dropped']} dropped"
+        if "latency_ms" in s:
+            line += (f", trigger to capture p50 {s['latency_ms']['p50']:.1f} ms"
+                     f" p95 {s['latency_ms']['p95']:.1f} ms max {s['latency_ms']['max']:.1f} ms")
+        print(line)
+
+
+class TriggerQueue:
+    """Rising edges on `pin`, queued as Triggers for next()."""
+
+    def __init__(self, gpio, pin, bouncetime_ms=1000, stamp=None, max_pending=16):
+        self.gpio = gpio
+        self.pin = pin
+        self.stamp = stamp
+        self.stats = TriggerStats()
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.current = None
+        gpio.setup(pin, gpio.IN)
+        # bouncetime keeps one long pulse from triggering twice, like the
+        # polling loop's wait for a second of low
+        gpio.add_event_detect(pin, gpio.RISING, callback=self._onEdge, bouncetime=bouncetime_ms)
+
+    def _onEdge(self, channel):
+        # runs on the GPIO library's callback thread, keep it short
+        t = time.monotonic()
+        with self.stats.lock:
+            self.stats.triggers += 1
+            seq = self.stats.triggers
+        try:
+            self.pending.put_nowait(Trigger(seq, t, self.stamp() if self.stamp else None))
+        except queue.Full:
+            with self.stats.lock:
+                self.stats.dropped += 1
+
+    def next(self, timeout=None):
+        """Block for the next trigger; None on timeout."""
+        try:
+            self.current = self.pending.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.started = time.monotonic()
+        with self.stats.lock:
+            self.stats.latencies.append(self.started - self.current.t)
+        return self.current
+
+    def done(self):
+        """Mark the capture for the last trigger finished."""
+        with self.stats.lock:
+            self.stats.durations.append(time.monotonic() - self.started)
+
+    def close(self):
+        self.gpio.remove_event_detect(self.pin)
+
+
+class PolledTrigger:
+    """The original busy-wait on the pin, same interface as TriggerQueue."""
+
+    def __init__(self, gpio, pin, low_time=1.0, stamp=None):
+        self.gpio = gpio
+        self.pin = pin
+        self.low_time = low_time
+        self.stamp = stamp
+        self.stats = TriggerStats()
+        self.waitLow = False
+        gpio.setup(pin, gpio.IN)
+
+    def next(self, timeout=None):
+        if self.waitLow:
+            # if still high wait for it to go low again
+            startTime = time.monotonic()
+            while True:
+                time.sleep(0.05)
+                if self.gpio.input(self.pin):
+                    startTime = time.monotonic()
+                elif time.monotonic() - startTime > self.low_time:
+                    break
+            self.waitLow = False
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.gpio.input(self.pin):
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            # let the encoder thread have the CPU
+            time.sleep(0.001)
+        # the edge happened somewhere in the last poll interval, this is
+        # the best timestamp the loop has
+        self.started = time.monotonic()
+        with self.stats.lock:
+            self.stats.triggers += 1
+            self.stats.latencies.append(0.0)
+            seq = self.stats.triggers
+        self.waitLow = True
+        return Trigger(seq, self.started, self.stamp() if self.stamp else None)
+
+    def done(self):
+        with self.stats.lock:
+            self.stats.durations.append(time.monotonic() - self.started)
+
+    def close(self):
+        pass
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# the tests import drone modules directly rather than through
+# rpi_data_collection, which puts the shared code in ../server on the path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+# testing/ holds scripts run by hand against real hardware or servers
+collect_ignore = ["testing"]
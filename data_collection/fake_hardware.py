@@ -0,0 +1,114 @@
+##########################################
+# Stand-ins for the Pi's GPIO, camera and MLX90640
+##########################################
+#
+# Enough of the RPi.GPIO, picamera.PiCamera and adafruit_mlx90640 APIs for
+# collectPhotos to run on a normal Linux box (DEBUG, or off the Pi) and
+# for testing/measure_triggers.py to time trigger handling. FakeGPIO keeps
+# the monotonic time of every rising edge it generates so latency and
+# missed triggers can be measured against the truth.
+
+import threading
+import time
+
+import numpy as np
+
+
+class FakeGPIO:
+    BCM = "BCM"
+    IN = "IN"
+    RISING = "RISING"
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        self.edges = []
+        self.lock = threading.Lock()
+        self.pulser = None
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction):
+        self.levels.setdefault(pin, 0)
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=0):
+        self.callbacks[pin] = (callback, bouncetime / 1000, [None])
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self.callbacks.clear()
+        self.stopPulses()
+
+    def pulse(self, pin, width=0.2):
+        """Raise pin for `width` seconds; callbacks run on this thread like RPi.GPIO's."""
+        t = time.monotonic()
+        with self.lock:
+            self.edges.append(t)
+        self.levels[pin] = 1
+        if pin in self.callbacks:
+            callback, bounce, last = self.callbacks[pin]
+            if last[0] is None or t - last[0] >= bounce:
+                last[0] = t
+                callback(pin)
+        time.sleep(width)
+        self.levels[pin] = 0
+
+    def startPulses(self, pin, interval, count, width=0.2, jitter=0.0, seed=0):
+        """Pulse pin `count` times, `interval` (+- jitter) seconds apart, on a thread."""
+        rng = np.random.default_rng(seed)
+        self.stopping = threading.Event()
+
+        def run():
+            for _ in range(count):
+                start = time.monotonic()
+                self.pulse(pin, width)
+                wait = interval + rng.uniform(-jitter, jitter) - (time.monotonic() - start)
+                if self.stopping.wait(max(0.0, wait)):
+                    return
+
+        self.pulser = threading.Thread(target=run, daemon=True)
+        self.pulser.start()
+        return self.pulser
+
+    def stopPulses(self):
+        if self.pulser is not None:
+            self.stopping.set()
+            self.pulser.join()
+            self.pulser = None
+
+
+class FakeCamera:
+    """PiCamera.capture into a numpy buffer, taking `delay` seconds."""
+
+    def __init__(self, delay=0.15):
+        self.delay = delay
+        self.resolution = (1280, 720)
+
+    def start_preview(self):
+        pass
+
+    def stop_preview(self):
+        pass
+
+    def capture(self, output, format="rgb"):
+        time.sleep(self.delay)
+        output[:] = np.random.randint(0, 256, output.shape, dtype=np.uint8)
+
+
+class FakeMLX:
+    """MLX90640.getFrame, taking `delay` seconds (about 0.5 at 2 Hz)."""
+
+    def __init__(self, delay=0.05, ambient=25.0):
+        self.delay = delay
+        self.ambient = ambient
+        self.refresh_rate = None
+
+    def getFrame(self, frame):
+        time.sleep(self.delay)
+        frame[:] = np.random.normal(self.ambient, 1.0, len(frame))
@@ -0,0 +1,107 @@
+##########################################
+# Encode captures during flight
+##########################################
+#
+# collectPhotos hands every capture to a BackgroundEncoder right after it
+# is spooled. The rescaling and image encoding run on a worker thread while
+# the drone flies to the next waypoint, and the finished upload files are
+# kept in a PayloadStore next to the spool:
+#
+#   <spool>/encoded/<index>/image_ir.png, image_rgb.jpg, ...
+#
+# so after landing sendData only has to send them. Captures the encoder
+# hasn't reached (or skipped because it fell behind) are encoded at send
+# time as before.
+
+import os
+import queue
+import shutil
+import threading
+import traceback
+
+from image_codecs import CodecStats
+
+
+class PayloadStore:
+    """Upload files per spool index, each record's directory renamed into place once complete."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, index):
+        return os.path.join(self.directory, str(index))
+
+    def __contains__(self, index):
+        return os.path.isdir(self._path(index))
+
+    def save(self, index, files):
+        """files: {field: (filename, bytes)}, the field being the filename's stem."""
+        tmp = self._path(index) + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for filename, content in files.values():
+            with open(os.path.join(tmp, filename), "wb") as f:
+                f.write(content)
+        # a capture encoded again (after a restart) replaces its old files,
+        # which rename won't do over a non-empty directory
+        shutil.rmtree(self._path(index), ignore_errors=True)
+        os.replace(tmp, self._path(index))
+
+    def load(self, index, fields=None):
+        """{field: (filename, bytes)} for a saved record (only fields, if given), or None."""
+        path = self._path(index)
+        if not os.path.isdir(path):
+            return None
+        files = {}
+        for filename in os.listdir(path):
+            field = os.path.splitext(filename)[0]
+            if fields is not None and field not in fields:
+                continue
+            with open(os.path.join(path, filename), "rb") as f:
+                files[field] = (filename, f.read())
+        return files
+
+
+class BackgroundEncoder:
+    """One worker thread running encode(capture, stats) -> files into a PayloadStore.
+
+    submit() never blocks the capture loop: once max_pending captures are
+    waiting, new ones are left to be encoded at send time.
+    """
+
+    def __init__(self, store, encode, max_pending=8):
+        self.store = store
+        self.encode = encode
+        self.stats = CodecStats()
+        self.skipped = 0
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.worker = threading.Thread(target=self._encodeLoop, daemon=True)
+        self.worker.start()
+
+    def submit(self, index, capture):
+        try:
+            self.pending.put_nowait((index, capture))
+        except queue.Full:
+            self.skipped += 1
+
+    def _encodeLoop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            index, capture = item
+            try:
+                self.store.save(index, self.encode(capture, self.stats))
+            except Exception as err:
+                # sendData encodes it from the spool instead
+                print(f"Error: failed to pre-encode capture {index}: '{err}'")
+                traceback.print_exc()
+
+    def close(self):
+        """Finish the captures already queued."""
+        self.pending.put(None)
+        self.worker.join()
+        self.stats.report()
+        if self.skipped:
+            print(f"{self.skipped} captures left to encode at upload time")
@@ -0,0 +1,55 @@
+##########################################
+# Many add_record payloads in one request
+##########################################
+#
+# A batch is a zip archive posted as the single "batch" file of a multipart
+# request to /api/server/add_records/:
+#
+#   manifest.json   [{"lon", "lat", "path_id", "date", "files": {field: member}}]
+#   <i>_<field>     image bytes of record i, e.g. 0_image_ir.png
+#
+# The manifest is deflated. Images are usually PNG/JPEG already, so by
+# default they are stored as is rather than compressed twice. The server
+# answers {"ids": [...]} with one record ID per manifest entry, in order.
+
+import io
+import json
+import os
+import zipfile
+
+MANIFEST = "manifest.json"
+BATCH_FIELD = "batch"
+
+
+def pack_batch(payloads, compress_images=False):
+    """Zip (data, files) add_record payloads; returns the archive bytes."""
+    buffer = io.BytesIO()
+    image_compression = zipfile.ZIP_DEFLATED if compress_images else zipfile.ZIP_STORED
+    manifest = []
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i, (data, files) in enumerate(payloads):
+            members = {}
+            for field, (filename, content) in files.items():
+                member = f"{i}_{field}{os.path.splitext(filename)[1]}"
+                archive.writestr(member, content, compress_type=image_compression)
+                members[field] = member
+            manifest.append(dict(data, files=members))
+        archive.writestr(MANIFEST, json.dumps(manifest), compress_type=zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def unpack_batch(blob):
+    """Inverse of pack_batch: [(data, {field: (filename, bytes)})]."""
+    with zipfile.ZipFile(io.BytesIO(blob)) as archive:
+        manifest = json.loads(archive.read(MANIFEST))
+        payloads = []
+        for entry in manifest:
+            members = entry.pop("files")
+            files = {field: (member, archive.read(member)) for field, member in members.items()}
+            payloads.append((entry, files))
+    return payloads
+
+
+def batch_files(payloads, compress_images=False):
+    """`files` argument for requests.post carrying a packed batch."""
+    return {BATCH_FIELD: ("records.zip", pack_batch(payloads, compress_images), "application/zip")}
@@ -0,0 +1,139 @@
+##########################################
+# Hotspot regions of interest in the RGB picture
+##########################################
+#
+# For a capture with fire in it, the hotspots' bounding boxes on the 24x32
+# IR grid are mapped into the camera picture, so sendData can upload
+# full-resolution crops of just those regions (with a small preview of the
+# whole picture for context) and send the full picture later.
+#
+# The IR sensor and camera see the scene differently, which a Registration
+# describes in fractions of the frame:
+#
+#   u_rgb = (u_ir - 0.5) * scale_x + 0.5 + shift_x      (u: column / width)
+#   v_rgb = (v_ir - 0.5) * scale_y + 0.5 + shift_y      (v: row / height)
+#
+# scale > 1 when the IR field of view is wider than the camera's. The IR
+# frame is upside down relative to the picture (threshold_detect flips it
+# for display), hence flip_rows. Spec strings are "sx,sy,dx,dy[,flip]".
+
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from thermal_preprocess import MLX_SHAPE
+from threshold_detect import TEMPERATURE_THRESHOLD, extract_hotspots
+
+ROI_MARGIN = 0.5  # of the box's size, added on every side
+ROI_MIN_SIDE = 96  # px
+ROI_MAX = 6  # crops per capture, largest first
+# crops covering more than this much of the picture aren't worth it
+ROI_MAX_COVERAGE = 0.3
+
+# (x0, y0, x1, y1) in picture pixels, x1/y1 exclusive
+Box = namedtuple("Box", ["x0", "y0", "x1", "y1"])
+
+
+class Registration:
+    def __init__(self, scale=(1.0, 1.0), shift=(0.0, 0.0), flip_rows=True):
+        self.scale = tuple(float(s) for s in scale)
+        self.shift = tuple(float(s) for s in shift)
+        self.flip_rows = flip_rows
+
+    @classmethod
+    def from_spec(cls, spec):
+        values = [float(v) for v in spec.split(",")]
+        if len(values) not in (4, 5):
+            raise ValueError(f"registration {spec!r} should be sx,sy,dx,dy[,flip]")
+        flip = bool(values[4]) if len(values) == 5 else True
+        return cls(values[:2], values[2:4], flip)
+
+    def toRGB(self, row_min, row_max, col_min, col_max, rgb_shape):
+        """Box in the picture for the inclusive IR cell ranges, before clipping."""
+        height, width = rgb_shape[:2]
+        v0, v1 = row_min / MLX_SHAPE[0], (row_max + 1) / MLX_SHAPE[0]
+        if self.flip_rows:
+            v0, v1 = 1 - v1, 1 - v0
+        u0, u1 = col_min / MLX_SHAPE[1], (col_max + 1) / MLX_SHAPE[1]
+        u0, u1 = ((u - 0.5) * self.scale[0] + 0.5 + self.shift[0] for u in (u0, u1))
+        v0, v1 = ((v - 0.5) * self.scale[1] + 0.5 + self.shift[1] for v in (v0, v1))
+        return u0 * width, v0 * height, u1 * width, v1 * height
+
+
+def _grow(box, rgb_shape, margin, min_side):
+    x0, y0, x1, y1 = box
+    height, width = rgb_shape[:2]
+    dx = max((x1 - x0) * margin, (min_side - (x1 - x0)) / 2, 0)
+    dy = max((y1 - y0) * margin, (min_side - (y1 - y0)) / 2, 0)
+    return Box(
+        int(max(0, np.floor(x0 - dx))),
+        int(max(0, np.floor(y0 - dy))),
+        int(min(width, np.ceil(x1 + dx))),
+        int(min(height, np.ceil(y1 + dy))),
+    )
+
+
+def _merge(boxes):
+    # union overlapping boxes until none overlap
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a.x0 < b.x1 and b.x0 < a.x1 and a.y0 < b.y1 and b.y0 < a.y1:
+                    boxes[i] = Box(min(a.x0, b.x0), min(a.y0, b.y0), max(a.x1, b.x1), max(a.y1, b.y1))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def roi_boxes(ir_frames, rgb_shape, registration=None, temperature_threshold=TEMPERATURE_THRESHOLD,
+              calibration=None, margin=ROI_MARGIN, min_side=ROI_MIN_SIDE, max_rois=ROI_MAX,
+              max_coverage=ROI_MAX_COVERAGE):
+    """Crop boxes in the picture for each of a stack of IR frames.
+
+    None for a frame with no hotspots, or whose crops would cover more than
+    max_coverage of the picture (the full picture is as good).
+    """
+    registration = registration or Registration()
+    frames = np.asarray(ir_frames, dtype=np.float64).reshape((-1,) + MLX_SHAPE)
+    if len(frames) == 0:
+        return []
+    hotspots = extract_hotspots(frames, temperature_threshold, calibration=calibration)
+    area = rgb_shape[0] * rgb_shape[1]
+
+    result = [None] * len(frames)
+    for f in np.unique(hotspots["frame"]):
+        spots = hotspots[hotspots["frame"] == f]
+        boxes = [
+            _grow(registration.toRGB(h["row_min"], h["row_max"], h["col_min"], h["col_max"], rgb_shape),
+                  rgb_shape, margin, min_side)
+            for h in spots
+        ]
+        boxes = [b for b in _merge(boxes) if b.x1 > b.x0 and b.y1 > b.y0]
+        boxes.sort(key=lambda b: -(b.x1 - b.x0) * (b.y1 - b.y0))
+        boxes = boxes[:max_rois]
+        covered = sum((b.x1 - b.x0) * (b.y1 - b.y0) for b in boxes)
+        if boxes and covered <= max_coverage * area:
+            result[int(f)] = boxes
+    return result
+
+
+def crop_files(rgb, boxes, codec, stats=None):
+    """({"rois": json}, {"roi_<k>": (filename, bytes)}) of the picture's crops."""
+    files = {}
+    rois = []
+    for k, b in enumerate(boxes):
+        img = codec.encode(np.ascontiguousarray(rgb[b.y0:b.y1, b.x0:b.x1]))
+        if stats is not None:
+            stats.add("rgb_roi", codec, img)
+        field = f"roi_{k}"
+        files[field] = (f"{field}.{img.ext}", img.data)
+        rois.append({"field": field, "box": list(b)})
+    return {"rois": json.dumps(rois)}, files
@@ -4,12 +4,29 @@
 
 from datetime import datetime
 import numpy as np
-import io
 import time
 import requests
-from PIL import Image
-import pickle
+import os
 import socket
+import sys
+
+# code the drone shares with the server (detection and its thermal
+# preprocessing, image_codecs, metrics, waypoints) lives in ../server; this is the
+# entry point, so it puts that on the path for every module it imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from capture_spool import CaptureSpool
+from upload_engine import UploadEngine, UploadJournal
+from image_codecs import CodecStats, get_codec
+from preencoder import BackgroundEncoder, PayloadStore
+from capture_trigger import PolledTrigger, TriggerQueue
+from fake_hardware import FakeCamera, FakeGPIO, FakeMLX
+from triage import PRIORITY_COLD, PRIORITY_FIRE, PRIORITY_NAMES, triage_spool, upload_order
+from roi import Registration, crop_files, roi_boxes
+import metrics
+from metrics import FlightProfiler
+from thermal_preprocess import Calibration, rescale_to_uint8
+from waypoints import load_gps
 
 DEBUG = False
 
@@ -21,16 +38,77 @@ REGISTER_PATH_URL_PROD = SERVER_URL+'/api/server/paths/'
 ADD_RECORD_URL_LOCALHOST = 'http://127.0.0.1:8000/api/server/add_record/'
 ADD_RECORD_URL_PROD = SERVER_URL+'/api/server/add_record/'
 
+# many records per request, see record_batch
+ADD_RECORDS_URL_LOCALHOST = 'http://127.0.0.1:8000/api/server/add_records/'
+ADD_RECORDS_URL_PROD = SERVER_URL+'/api/server/add_records/'
+
+# full images for records first sent with a preview, see sendData
+RECORD_IMAGES_URL_LOCALHOST = 'http://127.0.0.1:8000/api/server/record_images/'
+RECORD_IMAGES_URL_PROD = SERVER_URL+'/api/server/record_images/'
+
 PATHNAME = 'field'
 
+# every flight's captures are spooled to disk under here as they are taken
+SPOOL_DIR = 'spool'
+
+# uploads: concurrent keep-alive senders, progress journaled in the spool dir
+UPLOAD_WORKERS = 3
+UPLOAD_BATCH_SIZE = 8  # 1 sends every record on its own
+UPLOAD_JOURNAL = 'uploaded.log'
+PATH_ID_FILE = 'path_id'
+UPLOAD_DONE_FILE = 'uploaded'  # written once every record is journaled
+ENCODED_DIR = 'encoded'  # payloads encoded during the flight
+# per-stage timings (see metrics) are written next to each flight's spool;
+# PROFILE_DIR=<dir> also dumps a cProfile of each flight there
+METRICS_FILES = ('metrics.json', 'metrics.prom')
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+# upload encoding per stream, see image_codecs for the tiers
+# e.g. RGB_CODEC=jpeg:80 or RGB_CODEC=preview:640
+IR_CODEC = os.environ.get('IR_CODEC', 'png')
+RGB_CODEC = os.environ.get('RGB_CODEC', 'png')
+
+# this MLX90640's calibration (see thermal_preprocess.Calibration), used for
+# both the uploaded ir images and triage; MLX_CALIBRATION=<file>.npz
+MLX_CALIBRATION = os.environ.get('MLX_CALIBRATION')
+
+# COLD_UPLOAD=preview sends captures triage found nothing hot in with a
+# PREVIEW_CODEC rgb image first, and their full rgb after everything else
+COLD_UPLOAD = os.environ.get('COLD_UPLOAD', 'full')
+PREVIEW_CODEC = 'preview:320'
+
+# ROI_UPLOAD=on sends captures with fire as full resolution crops around
+# the hotspots plus a PREVIEW_CODEC picture, and their full rgb after
+# everything else (see roi). ROI_REGISTRATION=sx,sy,dx,dy[,flip] lines the
+# ir grid up with the picture
+ROI_UPLOAD = os.environ.get('ROI_UPLOAD', 'off')
+ROI_CODEC = os.environ.get('ROI_CODEC', 'jpeg:90')
+ROI_REGISTRATION = os.environ.get('ROI_REGISTRATION', '1,1,0,0,1')
+
+# waypoint trigger from the Pixhawk, see capture_trigger
+# TRIGGER_MODE=edge queues rising edges, TRIGGER_MODE=poll is the old loop
+TRIGGER_PIN = 4
+TRIGGER_MODE = os.environ.get('TRIGGER_MODE', 'edge')
+TRIGGER_BOUNCE_MS = 1000
+STOP_POLL_S = 0.2
+
 # imports for raspberry pi
+# off the pi (benchmarks, tooling) the module still imports so the pure
+# helpers can be used, but the sensors are unavailable
+PI_HARDWARE = False
 if not DEBUG:
-    import busio
-    import adafruit_mlx90640
-    from picamera import PiCamera
-    import board
-    from dronekit import connect, VehicleMode
-    import RPi.GPIO as GPIO
+    try:
+        import busio
+        import adafruit_mlx90640
+        from picamera import PiCamera
+        import board
+        from dronekit import connect, VehicleMode
+        import RPi.GPIO as GPIO
+
+        PI_HARDWARE = True
+    except ImportError:
+        pass
+
 
 class DataCollector:
 
@@ -47,17 +125,21 @@ class DataCollector:
         
         self.gps_coordinates = self.load_gps(self.gps_path)
         self.num_pics = len(self.gps_coordinates)
+        self.irCodec = get_codec(IR_CODEC)
+        self.rgbCodec = get_codec(RGB_CODEC)
+        self.calibration = Calibration.load(MLX_CALIBRATION) if MLX_CALIBRATION else None
 
         self.setupSensors()
         self.flightDataCollection()
-        GPIO.cleanup()
+        self.gpio.cleanup()
 
     def setupSensors(self):
         # Instantiate sensor modules & communication protocol
         if not DEBUG:
             #Trigger from Pixhawk on GPIO 4
+            self.gpio = GPIO
             GPIO.setmode(GPIO.BCM)
-            GPIO.setup(4, GPIO.IN)
+            GPIO.setup(TRIGGER_PIN, GPIO.IN)
 
             i2c = busio.I2C(board.SCL, board.SDA, frequency=400000) # setup I2C
             self.mlx = adafruit_mlx90640.MLX90640(i2c) # begin MLX90640 with I2C comm
@@ -65,43 +147,22 @@ class DataCollector:
             self.camera = PiCamera()
             self.camera.resolution = (1280,720)
             self.camera.start_preview()
-            
+        else:
+            # no pi, collectPhotos pulses the fake pin itself
+            self.gpio = FakeGPIO()
+            self.gpio.setmode(self.gpio.BCM)
+            self.mlx = FakeMLX()
+            self.camera = FakeCamera()
+
         self.mlx_shape = (24,32)
         self.camera_shape = (720,1280,3)
 
     def temps_to_rescaled_uints(self, raw_np_image):
         #Function to convert temperatures to pixels on image
-        # Fix dead pixel
-        raw_np_image[6][0] = int((raw_np_image[6][1] + raw_np_image[5][0] + raw_np_image[7][0]) / 3)
-
-        # Just in case there are any NaNs
-        raw_np_image = np.nan_to_num(raw_np_image)
-
-        _temp_min = np.min(raw_np_image)
-        _temp_max = np.max(raw_np_image)
-        norm = np.uint8((raw_np_image - _temp_min)*255/(_temp_max-_temp_min))
-
-        norm.shape = self.mlx_shape
-        return norm
+        return rescale_to_uint8(raw_np_image, self.calibration)[0]
 
     def load_gps(self, path):
-        ''' Waypoint file format for parsing
-            QGC WPL <VERSION>
-            <INDEX> <CURRENT WP> <COORD FRAME> <COMMAND> <PARAM1> <PARAM2> <PARAM3> <PARAM4> <PARAM5/X/LATITUDE> <PARAM6/Y/LONGITUDE> <PARAM7/Z/ALTITUDE> <AUTOCONTINUE>
-        '''
-        file = open(path, "r")
-        file.readline() # Read QGC, WPL <Version>
-        file.readline() # Read home location information (not a waypoint)
-        path_data = file.readlines() # path_data contains all the waypoints
-        gps_coord = []
-        
-        # Parse GPS coordinates for all the waypoints, skipping any 0.0 (non coordinate instructions)
-        for wayPoint in path_data:
-            wayPoint = wayPoint.split('\t')
-            if float(wayPoint[8]) != 0 or float(wayPoint[9]) != 0:
-                gps_coord.append((wayPoint[8], wayPoint[9]))
-
-        return gps_coord
+        return load_gps(path)
 
     def get_curr_gps(self):
         if DEBUG:
@@ -112,12 +173,14 @@ class DataCollector:
     
     def flightDataCollection(self):
         while(True):
-            sensor_data = self.collectPhotos()
-
-            #Save the data as pickle file in case of upload fail
-            #May not be the best option for large datasets
-            with open('data.pickle', 'wb') as file:
-                pickle.dump(sensor_data, file)
+            # Captures go straight to disk as they are taken, so they survive
+            # an upload failure or a crash mid-flight
+            spool = CaptureSpool(os.path.join(SPOOL_DIR, datetime.now().strftime('%Y%m%d-%H%M%S')))
+            profiler = FlightProfiler(PROFILE_DIR)
+            profiler.start()
+            # and are encoded for upload between waypoints
+            encoder = BackgroundEncoder(PayloadStore(os.path.join(spool.directory, ENCODED_DIR)), self.encodeImages)
+            self.collectPhotos(spool, encoder)
 
             while(True):
                 print("trying to connect")
@@ -130,110 +193,238 @@ class DataCollector:
                 time.sleep(3)
 
             print("connected")
-            
-            res = requests.post(REGISTER_PATH_URL_PROD, {'name':PATHNAME})
-            path_id = res.json()['id']
+            encoder.close()
 
-            self.sendData(sensor_data, path_id)
+            path_id = self.registerPath(spool)
+            self.sendData(spool, path_id)
+            profiler.stop(spool.directory.name)
+            for name in METRICS_FILES:
+                metrics.REGISTRY.write(os.path.join(spool.directory, name))
+            spool.close()
+            self.resumeUploads()
 
             # ONE FLIGHT
             break
 
-        
-    def collectPhotos(self):
-        sensor_data = []
-        gps_id = 0
+    def registerPath(self, spool):
+        # a resumed upload keeps posting to the path it started on
+        id_path = os.path.join(spool.directory, PATH_ID_FILE)
+        if os.path.exists(id_path):
+            with open(id_path) as f:
+                return int(f.read())
+
+        res = requests.post(REGISTER_PATH_URL_PROD, {'name':PATHNAME})
+        path_id = res.json()['id']
+        with open(id_path, "w") as f:
+            f.write(str(path_id))
+        return path_id
+
+    def resumeUploads(self):
+        # finish sending earlier flights whose upload was cut short,
+        # registering a path for those cut short before they had one
+        if not os.path.isdir(SPOOL_DIR):
+            return
+        for name in sorted(os.listdir(SPOOL_DIR)):
+            directory = os.path.join(SPOOL_DIR, name)
+            if not os.path.isdir(directory) or os.path.exists(os.path.join(directory, UPLOAD_DONE_FILE)):
+                continue
+            with CaptureSpool(directory) as spool:
+                self.sendData(spool, self.registerPath(spool))
+
+    def collectPhotos(self, spool, encoder=None, triggers=None, stop=None):
+        # tooling (testing/measure_triggers) passes its own trigger source,
+        # and stop(), asked whenever no trigger came for STOP_POLL_S, to end
+        # the flight before num_pics
+        num_pics = self.num_pics if not DEBUG else 3
+        if triggers is None:
+            if TRIGGER_MODE == 'poll':
+                triggers = PolledTrigger(self.gpio, TRIGGER_PIN, stamp=self.get_curr_gps)
+            else:
+                triggers = TriggerQueue(self.gpio, TRIGGER_PIN, bouncetime_ms=TRIGGER_BOUNCE_MS,
+                                        stamp=self.get_curr_gps)
+            if DEBUG:
+                # stand in for the Pixhawk reaching waypoints
+                self.gpio.startPulses(TRIGGER_PIN, interval=2.0, count=num_pics)
 
         # Collect data
-        while(len(sensor_data) < self.num_pics if not DEBUG else 3):
-           
-            if DEBUG:
-                target_coord = [0,0]
-            else:
-                target_coord = self.gps_coordinates[gps_id]
-            
-            # If receive trigger from Pixhawk, coordinate reached
-            if GPIO.input(4):
-                curr_coord = self.get_curr_gps() # Current GPS position recieved over telemetary port from drone
+        try:
+            while(len(spool) < num_pics):
+                # Wait for the trigger from Pixhawk, coordinate reached
+                trigger = triggers.next(timeout=None if stop is None else STOP_POLL_S)
+                if trigger is None:
+                    if stop():
+                        break
+                    continue
+                # GPS position when the pin went high, recieved over telemetary port from drone
+                curr_coord = trigger.stamp
                 try:
                     curr_time = np.array([datetime.now()])
-                    
-                    if DEBUG:
-                        frame = np.random.uniform(-20.0, 200.0, 32*24)
-                    else:
+
+                    with metrics.timed("capture"):
                         frame = np.zeros((24*32))
-                        self.mlx.getFrame(frame)                    
+                        self.mlx.getFrame(frame)
 
-                    if DEBUG:
-                        img_data = np.random.uniform(-20.0, 200.0, 320*240*3)
-                    else:
                         img_data = np.empty((720*1280*3), dtype=np.uint8)
                         self.camera.capture(img_data, 'rgb')
-                    
+
                     img_data = np.reshape(img_data, self.camera_shape)
                     ir_data = np.reshape(frame, self.mlx_shape)
-                    sensor_data.append((ir_data, img_data, curr_coord, curr_time))
-                    gps_id += 1
+                    with metrics.timed("disk_write"):
+                        index = spool.append(ir_data, img_data, curr_coord, curr_time)
+                    if encoder is not None:
+                        encoder.submit(index, (ir_data, img_data, curr_coord, curr_time))
 
                 except ValueError:
                     pass
-                
-                #if still high wait for it to go low again
-                startTime = time.time()
-                print("Signal is high")
-                while(1):
-                    time.sleep(0.05) 
-                    if GPIO.input(4):
-                        startTime = time.time()
-                    elif time.time() - startTime > 1:
-                        break
-                print("Signal is low")
+                triggers.done()
+                print(f"captured trigger {trigger.seq}")
+        finally:
+            triggers.close()
+            triggers.stats.report()
 
         self.camera.stop_preview()
-        return sensor_data
+        return spool
 
-    def sendData(self, sensor_data, path_id):
-        for frame in sensor_data:
-            
-            lat = frame[2][0]
-            lon = frame[2][1]
-            date = datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
+    def encodeImages(self, frame, stats=None, rgbCodec=None):
+        """{field: (filename, bytes)} of a capture's upload images."""
+        rgbStream = "rgb" if rgbCodec is None else "rgb_preview"
+        rgbCodec = rgbCodec or self.rgbCodec
 
-            # create the payload data with the image data
+        with metrics.timed("encode"):
             #first must normalize the ir data
             ir_norm = self.temps_to_rescaled_uints(frame[0])
-            img_ir = Image.fromarray(ir_norm, mode="L")
-            img_rgb = Image.fromarray(frame[1], mode="RGB")
-
-            buffer_ir = io.BytesIO()
-            buffer_rgb = io.BytesIO()
-            
-            img_ir.save(buffer_ir, format='PNG')
-            img_rgb.save(buffer_rgb, format='PNG')
-
-            ir_image_file = ("image_ir.png", buffer_ir.getvalue())
-            rgb_image_file = ("image_rgb.png", buffer_rgb.getvalue())
-
-            # create the payload data with the image data
-            data = {
-                "lon": lon,
-                "lat": lat,
-                "path_id": path_id,
-                "date": date,
-            }
-            files = {
-                "image_ir": ir_image_file,
-                "image_rgb": rgb_image_file,
-            }
-
-            # make the POST request with the payload
-            res = requests.post(ADD_RECORD_URL_PROD, data=data, files=files)
-            if res.status_code == 500:
-                with open("failed_images_log.txt", "a") as f:
-                    entry = str(res.json())
-                    f.write(entry + "\n")
-                    f.close()
-
+            img_ir = self.irCodec.encode(ir_norm)
+            img_rgb = rgbCodec.encode(frame[1])
+        if stats is not None:
+            stats.add("ir", self.irCodec, img_ir)
+            stats.add(rgbStream, rgbCodec, img_rgb)
+
+        return {
+            "image_ir": (f"image_ir.{img_ir.ext}", img_ir.data),
+            "image_rgb": (f"image_rgb.{img_rgb.ext}", img_rgb.data),
+        }
+
+    def recordData(self, coord, path_id):
+        return {
+            "lon": coord[1],
+            "lat": coord[0],
+            "path_id": path_id,
+            "date": datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+
+    def encodeRecord(self, frame, path_id, stats=None):
+        """(data, files) for one add_record POST."""
+        return self.recordData(frame[2], path_id), self.encodeImages(frame, stats)
+
+    def sendData(self, spool, path_id):
+        # Captures are encoded one step ahead of a few keep-alive senders.
+        # Sent records are journaled next to the spool, so calling this again
+        # after a dropped link only sends what's left.
+        # Captures with something hot are sent first (see triage)
+        journal_path = os.path.join(spool.directory, UPLOAD_JOURNAL)
+        payloads = PayloadStore(os.path.join(spool.directory, ENCODED_DIR))
+        codecStats = CodecStats()
+        with metrics.timed("detect"):
+            triages = triage_spool(spool, calibration=self.calibration)
+        preview = get_codec(PREVIEW_CODEC) if COLD_UPLOAD == 'preview' else None
+        deferred = [i for i, t in enumerate(triages) if preview and t.priority == PRIORITY_COLD]
+
+        rois = {}
+        # a flight without fire has nothing to crop
+        fire = [i for i, t in enumerate(triages) if t.priority == PRIORITY_FIRE] if ROI_UPLOAD == 'on' else []
+        if fire:
+            with metrics.timed("detect"):
+                boxes = roi_boxes([spool.readIR(i) for i in fire], self.camera_shape,
+                                  Registration.from_spec(ROI_REGISTRATION), calibration=self.calibration)
+            rois = {i: b for i, b in zip(fire, boxes) if b is not None}
+            deferred += sorted(rois)
+            roiCodec, context = get_codec(ROI_CODEC), get_codec(PREVIEW_CODEC)
+
+        def images(i):
+            # images encoded during the flight, or encode them now
+            files = payloads.load(i)
+            if files is None:
+                files = self.encodeImages(spool.read(i), codecStats)
+            return files
+
+        def fullRGB(i):
+            # for the deferred pass: the picture encoded during the flight,
+            # or only the picture encoded now
+            files = payloads.load(i, ("image_rgb",))
+            if files:
+                return files["image_rgb"]
+            with metrics.timed("encode"):
+                img_rgb = self.rgbCodec.encode(spool.read(i)[1])
+            codecStats.add("rgb", self.rgbCodec, img_rgb)
+            return (f"image_rgb.{img_rgb.ext}", img_rgb.data)
+
+        def withPreview(i, frame, rgbCodec):
+            # the ir encoded during the flight is sent as is, only the
+            # picture is encoded again (its full version goes out deferred)
+            files = payloads.load(i, ("image_ir",))
+            if not files:
+                return self.encodeImages(frame, codecStats, rgbCodec=rgbCodec)
+            with metrics.timed("encode"):
+                img_rgb = rgbCodec.encode(frame[1])
+            codecStats.add("rgb_preview", rgbCodec, img_rgb)
+            return {"image_ir": files["image_ir"], "image_rgb": (f"image_rgb.{img_rgb.ext}", img_rgb.data)}
+
+        def encode(i):
+            coord, _ = spool.readMeta(i)
+            data = self.recordData(coord, path_id)
+            if preview and triages[i].priority == PRIORITY_COLD:
+                data["rgb_preview"] = 1
+                return data, withPreview(i, spool.read(i), preview)
+            if i in rois:
+                frame = spool.read(i)
+                with metrics.timed("encode"):
+                    roiData, roiFiles = crop_files(frame[1], rois[i], roiCodec, codecStats)
+                data.update(roiData, rgb_preview=1)
+                return data, {**withPreview(i, frame, context), **roiFiles}
+            return data, images(i)
+
+        counts = {name: sum(t.priority == p for t in triages) for p, name in PRIORITY_NAMES.items()}
+        print("triage: " + ", ".join(f"{n} {name}" for name, n in counts.items()))
+        if rois:
+            print(f"{len(rois)} captures sent as {sum(len(b) for b in rois.values())} hotspot crops first")
+
+        engine = UploadEngine(ADD_RECORD_URL_PROD, journal_path, workers=UPLOAD_WORKERS,
+                              batch_url=ADD_RECORDS_URL_PROD, batch_size=UPLOAD_BATCH_SIZE)
+        try:
+            # records already sent are skipped before they are read back
+            records = ((i, i) for i in upload_order(triages))
+            stats = engine.run(records, encode)
+        finally:
+            engine.close()
+        stats["triage"] = counts
+
+        if deferred:
+            # full rgb for the records sent with a preview, by the id the server gave them
+            engine = UploadEngine(RECORD_IMAGES_URL_PROD, journal_path, workers=UPLOAD_WORKERS)
+            try:
+                records = ((f"{i}.full", i) for i in deferred if engine.journal.serverId(i) is not None)
+                stats["full_images"] = engine.run(
+                    records, lambda i: ({"id": engine.journal.serverId(i)}, {"image_rgb": fullRGB(i)})
+                )
+            finally:
+                engine.close()
+
+        # every record journaled, sent or rejected, along with the full
+        # rgb of those that got an id: resumeUploads can leave it be
+        journal = UploadJournal(journal_path)
+        try:
+            stats["complete"] = (all(i in journal for i in range(len(triages)))
+                                 and all(f"{i}.full" in journal for i in deferred if journal.serverId(i) is not None))
+        finally:
+            journal.close()
+        if stats["complete"]:
+            open(os.path.join(spool.directory, UPLOAD_DONE_FILE), "w").close()
+
+        codecStats.report()
+        stats["codecs"] = codecStats.summary()
+        print(f"sent {stats['sent']} in {stats['batches']} batches, skipped {stats['skipped']}, failed {stats['failed']} "
+              f"({stats['retries']} retries) in {stats['seconds']:.1f}s")
+        return stats
 
 if __name__ == "__main__":
     dc = DataCollector()
\ No newline at end of file
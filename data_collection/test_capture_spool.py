@@ -0,0 +1,53 @@
+import os
+import time
+
+import numpy as np
+
+from capture_spool import INDEX, CaptureSpool
+
+
+def _fill(directory, n=3):
+    rng = np.random.default_rng(0)
+    captures = [(rng.normal(22, 1, (24, 32)), rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)) for _ in range(n)]
+    with CaptureSpool(directory, fsync=False) as spool:
+        for i, (ir, rgb) in enumerate(captures):
+            spool.append(ir, rgb, [43.0 + i, -80.0], time.time())
+    return captures
+
+
+def _check(spool, captures):
+    assert len(spool) == len(captures)
+    for i, (ir, rgb) in enumerate(captures):
+        capture = spool.read(i)
+        np.testing.assert_allclose(capture.ir_data, ir, rtol=1e-6)
+        np.testing.assert_array_equal(capture.img_data, rgb)
+        assert capture.coord == [43.0 + i, -80.0]
+        np.testing.assert_array_equal(spool.readIR(i), capture.ir_data)
+
+
+def test_reopen(tmp_path):
+    captures = _fill(tmp_path)
+    with CaptureSpool(tmp_path) as spool:
+        _check(spool, captures)
+
+
+def test_record_without_index_entry_recovered(tmp_path):
+    captures = _fill(tmp_path)
+    # crash between writing the last record and its index entry
+    index = tmp_path / "captures.idx"
+    os.truncate(index, os.path.getsize(index) - INDEX.size)
+    with CaptureSpool(tmp_path) as spool:
+        _check(spool, captures)
+
+
+def test_torn_record_dropped(tmp_path):
+    captures = _fill(tmp_path)
+    # crash halfway through writing the last record
+    data = tmp_path / "captures.bin"
+    os.truncate(data, os.path.getsize(data) - 100)
+    with CaptureSpool(tmp_path) as spool:
+        _check(spool, captures[:2])
+        # later captures go where the torn one started
+        spool.append(*captures[2], [45.0, -80.0], time.time())
+    with CaptureSpool(tmp_path) as spool:
+        _check(spool, captures)
@@ -0,0 +1,99 @@
+import os
+import time
+
+import numpy as np
+
+import rpi_data_collection
+from capture_spool import CaptureSpool
+from image_codecs import get_codec
+from roi import roi_boxes
+from rpi_data_collection import DataCollector
+from testing.stand_in_server import serve
+
+
+def _collector():
+    # the parts of DataCollector sendData uses, without the sensors
+    dc = DataCollector.__new__(DataCollector)
+    dc.mlx_shape = (24, 32)
+    dc.camera_shape = (240, 320, 3)
+    dc.irCodec = get_codec("png")
+    dc.rgbCodec = get_codec("png")
+    dc.calibration = None
+    return dc
+
+
+def _standIn(monkeypatch):
+    server, store = serve(0)
+    url = f"http://127.0.0.1:{server.server_port}/api/server/"
+    monkeypatch.setattr(rpi_data_collection, "REGISTER_PATH_URL_PROD", url + "paths/")
+    monkeypatch.setattr(rpi_data_collection, "ADD_RECORD_URL_PROD", url + "add_record/")
+    monkeypatch.setattr(rpi_data_collection, "ADD_RECORDS_URL_PROD", url + "add_records/")
+    monkeypatch.setattr(rpi_data_collection, "RECORD_IMAGES_URL_PROD", url + "record_images/")
+    return server, store
+
+
+def _spool(directory, hot=()):
+    # a cool flight, with a fire in the captures listed in hot
+    rng = np.random.default_rng(0)
+    spool = CaptureSpool(directory, fsync=False)
+    for i in range(4):
+        ir = rng.normal(22, 1, (24, 32))
+        if i in hot:
+            ir[3:6, 8:11] = 120
+        rgb = rng.integers(0, 255, (240, 320, 3), dtype=np.uint8)
+        spool.append(ir, rgb, [43.0 + i * 1e-4, -80.0], time.time())
+    return spool
+
+
+def test_resume_registers_and_finishes_spools(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server, store = _standIn(monkeypatch)
+    try:
+        # a flight cut short before it registered its path
+        _spool(os.path.join(rpi_data_collection.SPOOL_DIR, "flight1")).close()
+
+        dc = _collector()
+        dc.resumeUploads()
+        assert len(store.records) == 4
+        assert len(store.paths) == 1
+        spool_dir = tmp_path / rpi_data_collection.SPOOL_DIR / "flight1"
+        assert (spool_dir / rpi_data_collection.PATH_ID_FILE).exists()
+        assert (spool_dir / rpi_data_collection.UPLOAD_DONE_FILE).exists()
+
+        # a finished spool isn't read again on the next start
+        requests = store.requests
+        dc.resumeUploads()
+        assert store.requests == requests
+    finally:
+        server.shutdown()
+
+
+def _sendFlight(tmp_path, monkeypatch, hot):
+    monkeypatch.setattr(rpi_data_collection, "ROI_UPLOAD", "on")
+    server, store = _standIn(monkeypatch)
+    try:
+        with _spool(tmp_path / "spool", hot) as spool:
+            dc = _collector()
+            stats = dc.sendData(spool, dc.registerPath(spool))
+    finally:
+        server.shutdown()
+    return stats, store.records
+
+
+def test_roi_upload_without_fire(tmp_path, monkeypatch):
+    assert roi_boxes([], (240, 320, 3)) == []
+    stats, records = _sendFlight(tmp_path, monkeypatch, hot=())
+    assert stats["complete"]
+    assert len(records) == 4
+    assert not any(r["rois"] or r["rgb_preview"] for r in records)
+
+
+def test_roi_upload_with_fire(tmp_path, monkeypatch):
+    stats, records = _sendFlight(tmp_path, monkeypatch, hot=(1,))
+    assert stats["complete"]
+    assert len(records) == 4
+    # the fire goes first, as crops, and its full picture afterwards
+    assert records[0]["rois"] > 0
+    assert stats["full_images"]["sent"] == 1
+    assert not any(r["rgb_preview"] for r in records)
+    assert sum(r["rois"] > 0 for r in records) == 1
@@ -0,0 +1,80 @@
+import socket
+
+import numpy as np
+
+from image_codecs import get_codec
+from testing.stand_in_server import serve
+from upload_engine import UploadEngine, UploadJournal
+
+IMAGE = get_codec("png").encode(np.zeros((24, 32), dtype=np.uint8)).data
+
+
+def _encode(i):
+    data = {"lon": -80.0, "lat": 43.0 + i, "path_id": 1, "date": "2023-03-01T12:00:00Z"}
+    return data, {"image_ir": ("image_ir.png", IMAGE), "image_rgb": ("image_rgb.png", IMAGE)}
+
+
+def _records(n):
+    return ((i, i) for i in range(n))
+
+
+def _closedPort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_journal_reopen(tmp_path):
+    journal = UploadJournal(str(tmp_path / "uploaded.log"))
+    journal.mark(0, server_id=7)
+    journal.mark("0.full")
+    journal.mark(1, "rejected-400")
+    journal.close()
+
+    journal = UploadJournal(str(tmp_path / "uploaded.log"))
+    try:
+        assert 0 in journal and "0.full" in journal and 1 in journal
+        assert 2 not in journal
+        assert journal.serverId(0) == "7"
+        assert journal.serverId(1) is None
+    finally:
+        journal.close()
+
+
+def test_resume_after_dropped_link(tmp_path):
+    journal_path = str(tmp_path / "uploaded.log")
+    failed_log = str(tmp_path / "failed.log")
+
+    # the link is down: nothing is journaled
+    url = f"http://127.0.0.1:{_closedPort()}/api/server/"
+    engine = UploadEngine(url + "add_record/", journal_path, max_attempts=1, failed_log=failed_log,
+                          batch_url=url + "add_records/", batch_size=2)
+    try:
+        stats = engine.run(_records(5), _encode)
+    finally:
+        engine.close()
+    assert stats["sent"] == 0 and stats["failed"] == 5
+
+    server, store = serve(0)
+    store.addPath("field")
+    url = f"http://127.0.0.1:{server.server_port}/api/server/"
+    try:
+        # partly through when the link came back, then finished
+        engine = UploadEngine(url + "add_record/", journal_path, failed_log=failed_log,
+                              batch_url=url + "add_records/", batch_size=2)
+        try:
+            stats = engine.run(_records(3), _encode)
+        finally:
+            engine.close()
+        assert stats["sent"] == 3
+
+        engine = UploadEngine(url + "add_record/", journal_path, failed_log=failed_log,
+                              batch_url=url + "add_records/", batch_size=2)
+        try:
+            stats = engine.run(_records(5), _encode)
+        finally:
+            engine.close()
+    finally:
+        server.shutdown()
+    assert stats["sent"] == 2 and stats["skipped"] == 3
+    assert sorted(float(r["lat"]) for r in store.records) == [43.0 + i for i in range(5)]
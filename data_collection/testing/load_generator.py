@@ -0,0 +1,275 @@
+##########################################
+# Replay captures as a fleet of drones, for server load testing
+##########################################
+#
+# Every simulated drone flies the server/test_data captures (or a synthetic
+# flight of --frames captures), each drone at its own GPS offset, either
+#
+#   socket  over the frame protocol to DataUploader (uploadNewData.py)
+#   http    as multipart add_record POSTs (add_records with --batch-size)
+#
+#   python load_generator.py socket --drones 8 --rate 2 --host 127.0.0.1
+#   python load_generator.py http --drones 8 --frames 200 --url http://127.0.0.1:8000
+#
+# --rate paces each drone's captures (0 sends as fast as the server takes
+# them), --rgb-res sets the picture size and --latency adds a delay before
+# every send to mimic the link.
+#
+# Latency per record is, for http, the request round trip (a batch's for
+# each record in it) and, for socket, how long the capture took to send:
+# the frame protocol has no acknowledgements, so it only grows once the
+# server stops keeping up. end_to_close is from FRAME_END to the server
+# closing the connection (the asyncio server does once the flight is
+# written; the blocking one doesn't, which shows up as null).
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server"))
+from benchmark import load_test_data, synthesize
+from frame_protocol import send_capture, send_end
+from image_codecs import get_codec
+from record_batch import batch_files
+from rpi_data_collection import DataCollector
+
+# spread the drones out so the server sees distinct locations
+BASE_COORD = (43.4738, -80.5531)  # lat, lon
+DRONE_SPACING = 0.01  # degrees of latitude between drones
+CAPTURE_SPACING = 0.0001  # degrees of longitude between waypoints
+
+PATHS_URL = "/api/server/paths/"
+ADD_RECORD_URL = "/api/server/add_record/"
+ADD_RECORDS_URL = "/api/server/add_records/"
+
+
+def load_flight(args):
+    """(ir frames, rgb frames) every drone replays."""
+    ir, rgb = load_test_data(camera_res=tuple(args.rgb_res))
+    if args.frames:
+        ir, rgb = synthesize(ir, rgb, args.frames)
+    return ir, rgb
+
+
+def coord(drone, i):
+    return [BASE_COORD[0] + drone * DRONE_SPACING, BASE_COORD[1] + i * CAPTURE_SPACING]
+
+
+def pace(start, i, args):
+    if args.rate:
+        delay = start + i / args.rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    if args.latency:
+        time.sleep(args.latency / 1000)
+
+
+class Results:
+    """Latencies and byte counts from every drone thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.end_to_close = []
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, latency, n_bytes, records=1):
+        with self.lock:
+            self.latencies.extend([latency] * records)
+            self.bytes += n_bytes
+
+    def error(self, err):
+        print(f"Error: '{err}'", file=sys.stderr)
+        with self.lock:
+            self.errors += 1
+
+
+########## socket ##########
+
+
+def fly_socket(drone, flight, args, results):
+    ir, rgb = flight
+    try:
+        sock = socket.create_connection((args.host, args.port))
+    except OSError as err:
+        results.error(err)
+        return
+    with sock:
+        start = time.monotonic()
+        for i in range(len(ir)):
+            pace(start, i, args)
+            # processCapture reads the gps frame as (lon, lat)
+            lat, lon = coord(drone, i)
+            sent = time.monotonic()
+            try:
+                send_capture(sock, ir[i], rgb[i], np.array([lon, lat]), np.array([datetime.now()]))
+            except OSError as err:
+                results.error(err)
+                return
+            results.add(time.monotonic() - sent, ir[i].nbytes + rgb[i].nbytes)
+
+        ended = time.monotonic()
+        send_end(sock)
+        sock.settimeout(args.end_timeout)
+        try:
+            while sock.recv(4096):
+                pass
+            with results.lock:
+                results.end_to_close.append(time.monotonic() - ended)
+        except OSError:
+            pass
+
+
+########## http ##########
+
+
+def encode_flight(flight, args):
+    """files for every capture, encoded once and shared by all drones."""
+    dc = DataCollector.__new__(DataCollector)
+    dc.mlx_shape = (24, 32)
+    dc.calibration = None
+    dc.irCodec = get_codec("png")
+    dc.rgbCodec = get_codec(args.rgb_codec)
+
+    ir, rgb = flight
+    rgb_files = {}
+    encoded = []
+    for frame_ir, frame_rgb in zip(ir, rgb):
+        # synthetic flights share rgb frames, so only encode each once
+        if id(frame_rgb) not in rgb_files:
+            img = dc.rgbCodec.encode(frame_rgb)
+            rgb_files[id(frame_rgb)] = (f"image_rgb.{img.ext}", img.data)
+        img = dc.irCodec.encode(dc.temps_to_rescaled_uints(frame_ir))
+        encoded.append({"image_ir": (f"image_ir.{img.ext}", img.data), "image_rgb": rgb_files[id(frame_rgb)]})
+    return encoded
+
+
+def fly_http(drone, encoded, args, results):
+    with requests.Session() as session:
+        try:
+            if args.path_id is not None:
+                path_id = args.path_id
+            else:
+                res = session.post(args.url + PATHS_URL, {"name": f"loadgen-{drone}"}, timeout=args.timeout)
+                path_id = res.json()["id"]
+        except (requests.RequestException, ValueError, KeyError) as err:
+            results.error(err)
+            return
+
+        start = time.monotonic()
+        for first in range(0, len(encoded), args.batch_size):
+            pace(start, first, args)
+            payloads = []
+            for i in range(first, min(first + args.batch_size, len(encoded))):
+                lat, lon = coord(drone, i)
+                data = {
+                    "lon": lon,
+                    "lat": lat,
+                    "path_id": path_id,
+                    "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                }
+                payloads.append((data, encoded[i]))
+            n_bytes = sum(len(content) for _, files in payloads for _, content in files.values())
+
+            sent = time.monotonic()
+            try:
+                if args.batch_size > 1:
+                    res = session.post(args.url + ADD_RECORDS_URL, files=batch_files(payloads), timeout=args.timeout)
+                else:
+                    data, files = payloads[0]
+                    res = session.post(args.url + ADD_RECORD_URL, data=data, files=files, timeout=args.timeout)
+            except requests.RequestException as err:
+                results.error(err)
+                continue
+            if res.status_code >= 400:
+                results.error(f"{res.status_code} {res.text[:200]}")
+                continue
+            results.add(time.monotonic() - sent, n_bytes, len(payloads))
+
+
+########## report ##########
+
+
+def percentiles(seconds):
+    if not seconds:
+        return None
+    ms = np.array(seconds) * 1000
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+def run(args):
+    flight = load_flight(args)
+    results = Results()
+    if args.mode == "http":
+        encoded = encode_flight(flight, args)
+        target, work = fly_http, encoded
+    else:
+        target, work = fly_socket, flight
+
+    drones = [threading.Thread(target=target, args=(d, work, args, results)) for d in range(args.drones)]
+    start = time.monotonic()
+    for drone in drones:
+        drone.start()
+    for drone in drones:
+        drone.join()
+    seconds = time.monotonic() - start
+
+    records = len(results.latencies)
+    return {
+        "mode": args.mode,
+        "drones": args.drones,
+        "frames_per_drone": len(flight[0]),
+        "rate": args.rate,
+        "latency_added_ms": args.latency,
+        "records": records,
+        "errors": results.errors,
+        "seconds": seconds,
+        "records_per_s": records / seconds,
+        "mb_per_s": results.bytes / seconds / 1e6,
+        "kb_per_record": results.bytes / records / 1e3 if records else None,
+        "latency_ms": percentiles(results.latencies),
+        "end_to_close_ms": percentiles(results.end_to_close),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captures as many drones against the server")
+    parser.add_argument("mode", choices=("socket", "http"))
+    parser.add_argument("--drones", type=int, default=4)
+    parser.add_argument("--frames", type=int, help="synthetic flight length (default: the test_data captures)")
+    parser.add_argument("--rate", type=float, default=0.0, help="captures per second per drone, 0 for no limit")
+    parser.add_argument("--latency", type=float, default=0.0, help="ms of link delay before every send")
+    parser.add_argument("--rgb-res", type=int, nargs=2, default=[1280, 720], metavar=("W", "H"))
+    parser.add_argument("--output", help="also write the JSON report here")
+    socket_args = parser.add_argument_group("socket")
+    socket_args.add_argument("--host", default=socket.gethostname())
+    socket_args.add_argument("--port", type=int, default=2022)
+    socket_args.add_argument("--end-timeout", type=float, default=30.0, help="seconds to wait for the server to close")
+    http_args = parser.add_argument_group("http")
+    http_args.add_argument("--url", default="http://127.0.0.1:8000")
+    http_args.add_argument("--path-id", type=int, help="post to this path instead of registering one per drone")
+    http_args.add_argument("--batch-size", type=int, default=1, help="records per add_records request, 1 for add_record")
+    http_args.add_argument("--rgb-codec", default="png", help="rgb tier, see image_codecs")
+    http_args.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,122 @@
+##########################################
+# Trigger-to-capture latency and missed triggers, without a Pi
+##########################################
+#
+# Pulses a FakeGPIO pin like the Pixhawk would and runs
+# DataCollector.collectPhotos itself (fake MLX and camera, spool write,
+# background encode) with each trigger mode, then matches captures to the
+# real edges:
+#
+#   python measure_triggers.py --interval 1.5 --count 40 --camera-ms 300
+#
+# latency is edge -> capture started; missed are edges nothing was
+# captured for.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server"))
+from capture_spool import CaptureSpool
+from capture_trigger import PolledTrigger, TriggerQueue
+from fake_hardware import FakeCamera, FakeGPIO, FakeMLX
+from image_codecs import get_codec
+from preencoder import BackgroundEncoder, PayloadStore
+from rpi_data_collection import TRIGGER_BOUNCE_MS, TRIGGER_PIN, DataCollector
+
+CAMERA_SHAPE = (720, 1280, 3)
+
+
+class RecordedTriggers:
+    """A trigger source that notes (edge time, capture started) for every trigger."""
+
+    def __init__(self, triggers):
+        self.triggers = triggers
+        self.stats = triggers.stats
+        self.starts = []
+
+    def next(self, timeout=None):
+        trigger = self.triggers.next(timeout=timeout)
+        if trigger is not None:
+            self.starts.append((trigger.t, time.monotonic()))
+        return trigger
+
+    def done(self):
+        self.triggers.done()
+
+    def close(self):
+        self.triggers.close()
+
+
+def run(mode, args):
+    gpio = FakeGPIO()
+    stamp = lambda: [0.0, 0.0]
+    if mode == "poll":
+        triggers = PolledTrigger(gpio, TRIGGER_PIN, stamp=stamp)
+    else:
+        triggers = TriggerQueue(gpio, TRIGGER_PIN, bouncetime_ms=args.bounce_ms, stamp=stamp)
+    triggers = RecordedTriggers(triggers)
+
+    dc = DataCollector.__new__(DataCollector)
+    dc.gpio = gpio
+    dc.mlx = FakeMLX(args.mlx_ms / 1000)
+    dc.camera = FakeCamera(args.camera_ms / 1000)
+    dc.mlx_shape = (24, 32)
+    dc.camera_shape = CAMERA_SHAPE
+    dc.num_pics = args.count
+    dc.irCodec = get_codec("png")
+    dc.rgbCodec = get_codec(args.rgb_codec)
+    dc.calibration = None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = CaptureSpool(tmp, fsync=False)
+        encoder = BackgroundEncoder(PayloadStore(os.path.join(tmp, "encoded")), dc.encodeImages)
+        pulser = gpio.startPulses(TRIGGER_PIN, args.interval, args.count, args.width, args.jitter)
+        # stops once the pulses are over and nothing is left queued
+        dc.collectPhotos(spool, encoder, triggers=triggers, stop=lambda: not pulser.is_alive())
+        encoder.close()
+        spool.close()
+    starts = triggers.starts
+
+    # each capture belongs to the last edge at or before its trigger time
+    edges = np.array(gpio.edges)
+    latencies = {}
+    for t, started in starts:
+        edge = int(np.searchsorted(edges, t + 1e-3, side="right")) - 1
+        latencies.setdefault(edge, started - edges[edge])
+    latency_ms = np.array(list(latencies.values())) * 1000
+    return {
+        "mode": mode,
+        "edges": len(edges),
+        "captured": len(starts),
+        "missed": len(edges) - len(latencies),
+        "latency_ms": {
+            "p50": float(np.percentile(latency_ms, 50)),
+            "p95": float(np.percentile(latency_ms, 95)),
+            "max": float(latency_ms.max()),
+        } if len(latency_ms) else None,
+        "capture_ms": triggers.stats.summary().get("capture_ms"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure waypoint trigger handling with fake hardware")
+    parser.add_argument("--modes", nargs="*", choices=("edge", "poll"), default=["edge", "poll"])
+    parser.add_argument("--count", type=int, default=20, help="waypoints to pulse")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between waypoints")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+- seconds on the interval")
+    parser.add_argument("--width", type=float, default=0.2, help="seconds the pin stays high")
+    parser.add_argument("--camera-ms", type=float, default=150)
+    parser.add_argument("--mlx-ms", type=float, default=50)
+    parser.add_argument("--bounce-ms", type=int, default=TRIGGER_BOUNCE_MS)
+    parser.add_argument("--rgb-codec", default="png")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        print(json.dumps(run(mode, args)))
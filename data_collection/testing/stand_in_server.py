@@ -0,0 +1,208 @@
+##########################################
+# Local stand-in for the upload endpoints
+##########################################
+#
+# Implements just enough of the web server for the drone client to be
+# tested offline:
+#
+#   POST /api/server/paths/        name=<path name>          -> {"id", "name"}
+#   POST /api/server/add_record/   lon, lat, path_id, date,
+#                                  image_ir, image_rgb       -> {"id"}
+#   POST /api/server/add_records/  batch (see record_batch)  -> {"ids"}
+#   POST /api/server/record_images/ id, image_ir and/or
+#                                  image_rgb                 -> {"id"}
+#
+# add_record(s) take an optional rgb_preview=1 for a record whose rgb is a
+# preview; record_images later replaces that record's images. Records can
+# also carry hotspot crops: roi_<k> images and a rois JSON list of
+# {"field", "box"} (see roi).
+#
+# Every image is checked to decode. --no-batch makes the batch endpoint
+# 404 like a server without it, --latency adds a delay to every request to
+# mimic the drone's link. Run with
+#   python stand_in_server.py --port 8000
+# and point the *_LOCALHOST URLs at it.
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zipfile
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from record_batch import BATCH_FIELD, unpack_batch
+
+RECORD_FIELDS = ("lon", "lat", "path_id", "date")
+IMAGE_FIELDS = ("image_ir", "image_rgb")
+
+
+class BadRequest(Exception):
+    pass
+
+
+def parse_multipart(content_type, body):
+    """({field: str}, {field: (filename, bytes)}) of a multipart/form-data body."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    if not message.is_multipart():
+        raise BadRequest("expected multipart/form-data")
+    data, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        content = part.get_payload(decode=True)
+        if filename is None:
+            data[name] = content.decode()
+        else:
+            files[name] = (filename, content)
+    return data, files
+
+
+class RecordStore:
+    """What the server would have written to the DB."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = {}
+        self.records = []
+        self.requests = 0
+        self.bytes = 0
+
+    def addPath(self, name):
+        with self.lock:
+            path_id = len(self.paths) + 1
+            self.paths[path_id] = name
+            return path_id
+
+    def validate(self, data, files):
+        missing = [f for f in RECORD_FIELDS if f not in data] + [f for f in IMAGE_FIELDS if f not in files]
+        if missing:
+            raise BadRequest(f"missing {', '.join(missing)}")
+        if int(data["path_id"]) not in self.paths:
+            raise BadRequest(f"unknown path {data['path_id']}")
+        rois = json.loads(data.get("rois", "[]"))
+        for roi in rois:
+            if roi["field"] not in files or len(roi["box"]) != 4:
+                raise BadRequest(f"bad roi {roi}")
+        for field in IMAGE_FIELDS + tuple(roi["field"] for roi in rois):
+            try:
+                Image.open(io.BytesIO(files[field][1])).verify()
+            except Exception as err:
+                raise BadRequest(f"{field} doesn't decode: {err}")
+
+    def addRecords(self, payloads):
+        # all or nothing, like the single transaction a batch should be
+        for data, files in payloads:
+            self.validate(data, files)
+        with self.lock:
+            start = len(self.records)
+            self.records.extend(
+                {
+                    **{f: data[f] for f in RECORD_FIELDS},
+                    **{f: len(files[f][1]) for f in IMAGE_FIELDS},
+                    "rgb_preview": str(data.get("rgb_preview", "0")) == "1",
+                    "rois": len(json.loads(data.get("rois", "[]"))),
+                }
+                for data, files in payloads
+            )
+            return list(range(start + 1, len(self.records) + 1))
+
+    def replaceImages(self, record_id, files):
+        if not 1 <= record_id <= len(self.records):
+            raise BadRequest(f"unknown record {record_id}")
+        images = {f: files[f] for f in IMAGE_FIELDS if f in files}
+        if not images:
+            raise BadRequest("no images")
+        for field, (_, content) in images.items():
+            try:
+                Image.open(io.BytesIO(content)).verify()
+            except Exception as err:
+                raise BadRequest(f"{field} doesn't decode: {err}")
+        with self.lock:
+            record = self.records[record_id - 1]
+            record.update({f: len(content) for f, (_, content) in images.items()})
+            if "image_rgb" in images:
+                record["rgb_preview"] = False
+            return record_id
+
+
+def make_handler(store, batch=True, latency=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with store.lock:
+                store.requests += 1
+                store.bytes += len(body)
+            if latency:
+                time.sleep(latency)
+
+            try:
+                if self.path == "/api/server/paths/":
+                    name = parse_qs(body.decode()).get("name", [""])[0]
+                    self.reply(201, {"id": store.addPath(name), "name": name})
+                elif self.path == "/api/server/add_record/":
+                    data, files = parse_multipart(self.headers["Content-Type"], body)
+                    self.reply(201, {"id": store.addRecords([(data, files)])[0]})
+                elif self.path == "/api/server/add_records/" and batch:
+                    _, files = parse_multipart(self.headers["Content-Type"], body)
+                    if BATCH_FIELD not in files:
+                        raise BadRequest(f"missing {BATCH_FIELD}")
+                    payloads = unpack_batch(files[BATCH_FIELD][1])
+                    self.reply(201, {"ids": store.addRecords(payloads)})
+                elif self.path == "/api/server/record_images/":
+                    data, files = parse_multipart(self.headers["Content-Type"], body)
+                    self.reply(200, {"id": store.replaceImages(int(data["id"]), files)})
+                else:
+                    self.reply(404, {"error": "not found"})
+            except (BadRequest, ValueError, KeyError, zipfile.BadZipFile) as err:
+                self.reply(400, {"error": str(err)})
+
+        def reply(self, status, obj):
+            out = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=8000, batch=True, latency=0.0):
+    """Start a stand-in server on a background thread; returns (server, store)."""
+    store = RecordStore()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(store, batch, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--no-batch", action="store_true", help="answer 404 on the batch endpoint")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    args = parser.parse_args()
+
+    server, store = serve(args.port, not args.no_batch, args.latency)
+    print(f"serving on 127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"{store.requests} requests, {store.bytes / 1e6:.1f} MB, {len(store.records)} records")
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -4,6 +4,13 @@ import numpy as np
 from PIL import Image
 import tempfile
 import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server"))
+from record_batch import batch_files
+from upload_engine import BATCH_UNSUPPORTED
 
 SERVER_URL = 'http://ec2-3-219-240-142.compute-1.amazonaws.com'
 
@@ -12,8 +19,14 @@ REGISTER_PATH_URL_PROD = SERVER_URL+'/api/server/paths/'
 ADD_RECORD_URL_LOCALHOST = 'http://127.0.0.1:8000/api/server/add_record/'
 ADD_RECORD_URL_PROD = SERVER_URL+'/api/server/add_record/'
 
-def registerPath(pathname='zimbabwe'):
-    res = requests.post(REGISTER_PATH_URL_PROD, {'name':pathname})
+# stand_in_server.py serves these locally
+REGISTER_PATH_URL_LOCALHOST = 'http://127.0.0.1:8000/api/server/paths/'
+ADD_RECORDS_URL_LOCALHOST = 'http://127.0.0.1:8000/api/server/add_records/'
+ADD_RECORDS_URL_PROD = SERVER_URL+'/api/server/add_records/'
+
+def registerPath(pathname='zimbabwe', url=REGISTER_PATH_URL_PROD):
+    res = requests.post(url, {'name':pathname})
+    return res.json()['id']
 
 def sendDataPost(path_id):
     date = datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -75,7 +88,7 @@ def sendDataPostNoSave(path_id):
     res = requests.post(ADD_RECORD_URL_LOCALHOST, data=data, files=files)
     print(res)
     
-def sendDataPost2image(lat, lon, path_id, ir_image_data, rgb_image_data):
+def makePayload(lat, lon, path_id, ir_image_data, rgb_image_data):
     date = datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
 
     img_ir = Image.fromarray(ir_image_data, mode="L")
@@ -101,9 +114,13 @@ def sendDataPost2image(lat, lon, path_id, ir_image_data, rgb_image_data):
         "image_ir": ir_image_file,
         "image_rgb": rgb_image_file,
     }
+    return data, files
+
+def sendDataPost2image(lat, lon, path_id, ir_image_data, rgb_image_data, url=ADD_RECORD_URL_PROD):
+    data, files = makePayload(lat, lon, path_id, ir_image_data, rgb_image_data)
 
     # make the POST request with the payload
-    res = requests.post(ADD_RECORD_URL_PROD, data=data, files=files)
+    res = requests.post(url, data=data, files=files)
     print(res.json()['id'])
     print(res.status_code)
     if True:
@@ -112,6 +129,20 @@ def sendDataPost2image(lat, lon, path_id, ir_image_data, rgb_image_data):
             f.write(entry + "\n")
             f.close()
 
+def sendDataBatch(path_id, captures, batch_url=ADD_RECORDS_URL_PROD, record_url=ADD_RECORD_URL_PROD):
+    # captures: [(lat, lon, ir_image_data, rgb_image_data)], all in one request
+    payloads = [makePayload(lat, lon, path_id, ir, rgb) for lat, lon, ir, rgb in captures]
+    res = requests.post(batch_url, files=batch_files(payloads))
+    if res.status_code in BATCH_UNSUPPORTED:
+        # server without the batch endpoint, one request per record
+        print("no batch endpoint, posting records one at a time")
+        with requests.Session() as session:
+            ids = [session.post(record_url, data=data, files=files).json()['id'] for data, files in payloads]
+    else:
+        ids = res.json()['ids']
+    print(ids)
+    return ids
+
 
 # make image
 mlx_shape = (24,32)
@@ -125,5 +156,9 @@ ir_data = np.reshape(ir, mlx_shape)
 # path_id = registerPath('umars crib')
 # sendDataPost(path_id)
 # sendDataPostNoSave(path_id)
+# against stand_in_server.py:
+# path_id = registerPath('umars crib', REGISTER_PATH_URL_LOCALHOST)
+# sendDataBatch(path_id, [(1.1, 2.2, ir_data.astype(np.uint8), rgb_data.astype(np.uint8))] * 10,
+#               ADD_RECORDS_URL_LOCALHOST, ADD_RECORD_URL_LOCALHOST)
 path_id = 1
 sendDataPost2image(888, 901, path_id, ir_data, rgb_data)
\ No newline at end of file
@@ -0,0 +1,55 @@
+##########################################
+# Onboard fire triage
+##########################################
+#
+# Runs the server's threshold detection on the drone so captures with
+# something hot are uploaded first:
+#
+#   PRIORITY_FIRE  interpolated pixels over the threshold (detect_fires > 0)
+#   PRIORITY_WARM  no fire, but within WARM_MARGIN degrees of the threshold
+#   PRIORITY_COLD  everything else
+#
+# Within a priority, captures with more hot pixels go first, then waypoint
+# order.
+
+from collections import namedtuple
+
+import numpy as np
+
+from threshold_detect import TEMPERATURE_THRESHOLD, detect_fires_batch
+from thermal_preprocess import preprocess
+
+PRIORITY_FIRE = 0
+PRIORITY_WARM = 1
+PRIORITY_COLD = 2
+PRIORITY_NAMES = {PRIORITY_FIRE: "fire", PRIORITY_WARM: "warm", PRIORITY_COLD: "cold"}
+
+WARM_MARGIN = 10.0
+
+# per capture: priority, over-threshold pixel count and hottest reading
+Triage = namedtuple("Triage", ["priority", "hot_pixels", "max_temp"])
+
+
+def triage_frames(ir_frames, temperature_threshold=TEMPERATURE_THRESHOLD, warm_margin=WARM_MARGIN, calibration=None):
+    """Triage for each of a stack of IR frames (anything reshapeable to (N, 24, 32))."""
+    frames = np.asarray(ir_frames, dtype=np.float64).reshape(-1, 24 * 32)
+    if len(frames) == 0:
+        return []
+    hot_pixels = detect_fires_batch(frames, temperature_threshold, calibration)
+    max_temp = preprocess(frames, calibration).max(axis=(1, 2))
+    priority = np.where(
+        hot_pixels > 0,
+        PRIORITY_FIRE,
+        np.where(max_temp >= temperature_threshold - warm_margin, PRIORITY_WARM, PRIORITY_COLD),
+    )
+    return [Triage(int(p), int(h), float(t)) for p, h, t in zip(priority, hot_pixels, max_temp)]
+
+
+def triage_spool(spool, **kwargs):
+    """Triage for every capture in a CaptureSpool, reading only the IR frames."""
+    return triage_frames([spool.readIR(i) for i in range(len(spool))], **kwargs)
+
+
+def upload_order(triages):
+    """Capture indices, most urgent first."""
+    return sorted(range(len(triages)), key=lambda i: (triages[i].priority, -triages[i].hot_pixels, i))
@@ -0,0 +1,239 @@
+##########################################
+# Concurrent, resumable record uploader
+##########################################
+#
+# One encoder thread turns captures into request payloads ahead of a small
+# pool of sender threads sharing a keep-alive requests.Session. Failed sends
+# are retried with exponential backoff and every finished record is appended
+# (and fsynced) to a journal, so after a dropped link the next run only
+# sends what is left.
+#
+# Given a batch_url, records are packed batch_size at a time into one
+# request (see record_batch). If the server doesn't know the batch endpoint
+# the engine falls back to one add_record POST per record.
+
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from record_batch import batch_files
+
+import metrics
+
+# statuses meaning the server has no batch endpoint
+BATCH_UNSUPPORTED = (404, 405, 501)
+
+
+class UploadJournal:
+    """Append-only "<record id> <status> [<server id>]" log of finished records."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        self.server_ids = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 2:
+                        self.done[parts[0]] = parts[1]
+                    if len(parts) >= 3:
+                        self.server_ids[parts[0]] = parts[2]
+        self.file = open(path, "a")
+
+    def __contains__(self, record_id):
+        return str(record_id) in self.done
+
+    def serverId(self, record_id):
+        """ID the server gave the record, if it said."""
+        return self.server_ids.get(str(record_id))
+
+    def mark(self, record_id, status="ok", server_id=None):
+        with self.lock:
+            line = f"{record_id} {status}" if server_id is None else f"{record_id} {status} {server_id}"
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.done[str(record_id)] = status
+            if server_id is not None:
+                self.server_ids[str(record_id)] = str(server_id)
+
+    def close(self):
+        self.file.close()
+
+
+class UploadEngine:
+    def __init__(self, url, journal_path, workers=3, max_attempts=8, backoff=1.0,
+                 max_backoff=60.0, timeout=30, failed_log="failed_images_log.txt",
+                 batch_url=None, batch_size=8):
+        self.url = url
+        self.batch_url = batch_url
+        self.batch_size = batch_size
+        self.journal = UploadJournal(journal_path)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.failed_log = failed_log
+
+        # one keep-alive connection per sender
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.stats_lock = threading.Lock()
+        self.stats = {"sent": 0, "skipped": 0, "failed": 0, "retries": 0, "batches": 0}
+
+    def _count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def _sent(self, n):
+        with self.stats_lock:
+            self.stats["sent"] += n
+            # how long the most urgent records waited
+            self.stats.setdefault("first_sent_seconds", time.time() - self.start)
+
+    def _post(self, url, data, files):
+        """POST with retries; returns the final response, or None if the link never came back."""
+        res = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self._count("retries")
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+            try:
+                with metrics.timed("http_upload"):
+                    res = self.session.post(url, data=data, files=files, timeout=self.timeout)
+            except requests.exceptions.RequestException as err:
+                metrics.count("http_requests", stage="http_upload", status="error")
+                print(f"upload failed ({err}), retrying")
+                continue
+            metrics.count("http_requests", stage="http_upload", status=res.status_code)
+            metrics.count("bytes", sum(len(f[1]) for f in files.values()), stage="http_upload")
+            if res.status_code < 500:
+                return res
+            print(f"server error {res.status_code}, retrying")
+        return res
+
+    @staticmethod
+    def _responseJson(res):
+        try:
+            body = res.json()
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _logFailure(self, res):
+        try:
+            entry = str(res.json())
+        except ValueError:
+            entry = res.text
+        with open(self.failed_log, "a") as f:
+            f.write(entry + "\n")
+
+    def _encodeLoop(self, records, encode, work):
+        batch = []
+        try:
+            for record_id, item in records:
+                if record_id in self.journal:
+                    self._count("skipped")
+                    continue
+                batch.append((record_id, encode(item)))
+                if not self.batch_url or len(batch) >= self.batch_size:
+                    work.put(batch)
+                    batch = []
+            if batch:
+                work.put(batch)
+        except Exception as err:
+            # raised again by run() once the senders have finished
+            self.encode_error = err
+        finally:
+            for _ in range(self.workers):
+                work.put(None)
+
+    def _sendLoop(self, work):
+        while True:
+            batch = work.get()
+            if batch is None:
+                return
+            if len(batch) > 1 and self.batch_url and self._sendBatch(batch):
+                continue
+            for record_id, (data, files) in batch:
+                self._sendOne(record_id, data, files)
+
+    def _sendBatch(self, batch):
+        """POST a whole batch; False if it should be resent record by record."""
+        res = self._post(self.batch_url, None, batch_files([payload for _, payload in batch]))
+        if res is None or res.status_code >= 500:
+            # not journaled, the next run picks it up again
+            self._count("failed", len(batch))
+            return True
+        if res.ok:
+            ids = self._responseJson(res).get("ids")
+            if not isinstance(ids, list) or len(ids) != len(batch):
+                # can't tell which records were stored; each one is sent
+                # again on its own so every record gets journaled
+                print(f"batch of {len(batch)} wasn't answered with as many ids, resending one at a time")
+                self._logFailure(res)
+                return False
+            for (record_id, _), server_id in zip(batch, ids):
+                self.journal.mark(record_id, server_id=server_id)
+            self._sent(len(batch))
+            self._count("batches")
+            return True
+        if res.status_code in BATCH_UNSUPPORTED and self.batch_url:
+            print("server doesn't take batches, sending records one at a time")
+            self.batch_url = None
+        # otherwise some record in it was rejected, find out which
+        return False
+
+    def _sendOne(self, record_id, data, files):
+        res = self._post(self.url, data, files)
+        if res is None:
+            # not journaled, the next run picks it up again
+            self._count("failed")
+        elif res.ok:
+            self.journal.mark(record_id, server_id=self._responseJson(res).get("id"))
+            self._sent(1)
+        else:
+            self._logFailure(res)
+            if res.status_code < 500:
+                # the server rejected it, resending won't help
+                self.journal.mark(record_id, f"rejected-{res.status_code}")
+            self._count("failed")
+
+    def run(self, records, encode):
+        """Upload (record_id, item) pairs; encode(item) returns (data, files) for add_record.
+
+        Records already in the journal are skipped. Returns the upload stats.
+        """
+        self.start = time.time()
+        self.encode_error = None
+        # encode at most one request ahead per sender, batches are big
+        work = queue.Queue(maxsize=self.workers)
+        encoder = threading.Thread(target=self._encodeLoop, args=(records, encode, work))
+        senders = [threading.Thread(target=self._sendLoop, args=(work,)) for _ in range(self.workers)]
+        encoder.start()
+        for sender in senders:
+            sender.start()
+        encoder.join()
+        for sender in senders:
+            sender.join()
+        if self.encode_error is not None:
+            raise self.encode_error
+
+        self.stats["seconds"] = time.time() - self.start
+        return dict(self.stats)
+
+    def close(self):
+        self.session.close()
+        self.journal.close()
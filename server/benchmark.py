@@ -0,0 +1,356 @@
+##########################################
+# Benchmarks for the drone/server hot paths
+##########################################
+#
+# python benchmark.py                          # the 30 captures in test_data
+# python benchmark.py --frames 10 1000 10000   # synthetic flights of each length
+# python benchmark.py --output bench.json --compare previous.json
+#
+# Results are printed (and optionally written) as JSON so runs from two
+# commits can be diffed with --compare.
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+SERVER_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SERVER_DIR.parent / "data_collection"))
+
+import frame_protocol
+from frame_protocol import FRAME_GPS, FRAME_IR, FRAME_RGB, FRAME_TIME, FrameReceiver
+from threshold_detect import detect_fires, detect_fires_batch, extract_hotspots
+from thermal_preprocess import MLX_SHAPE, rescale_to_uint8
+from hotspot_history import HotspotHistory
+from metrics import FlightProfiler
+from uploadNewData import DataUploader
+from rpi_data_collection import DataCollector
+from image_codecs import get_codec
+
+TEST_DATA_DIR = SERVER_DIR / "test_data"
+TEST_DATA_SETS = ("stove_data", "match_data", "pi_data1")
+CAMERA_RES = (1280, 720)
+# image_codecs tiers timed on both streams
+CODEC_TIERS = ("png:1", "png", "jpeg:95", "jpeg:85", "preview:320")
+
+
+def load_test_data(data_dir=TEST_DATA_DIR, camera_res=CAMERA_RES):
+    """Load every (ir, rgb) capture pair in test_data.
+
+    Captures without a picture reuse the previous picture of the set.
+    """
+    ir_frames = []
+    rgb_frames = []
+    for name in TEST_DATA_SETS:
+        folder = Path(data_dir) / name
+        csvs = sorted(folder.glob("data*.csv"), key=lambda p: int(p.stem[4:]))
+        rgb = None
+        for csv in csvs:
+            ir_frames.append(np.loadtxt(csv, delimiter=","))
+            picture = folder / f"picture{csv.stem[4:]}.png"
+            if picture.exists() or rgb is None:
+                im = Image.open(picture).convert("RGB")
+                if camera_res:
+                    im = im.resize(camera_res)
+                rgb = np.asarray(im)
+            rgb_frames.append(rgb)
+    return np.array(ir_frames), rgb_frames
+
+
+def synthesize(ir_frames, rgb_frames, n_frames, seed=0):
+    """Scale the test captures up to an n_frames long flight.
+
+    IR frames get sensor-like noise so each one is distinct; RGB frames are
+    shared references so a 10k frame flight doesn't need 27 GB of pictures.
+    """
+    rng = np.random.default_rng(seed)
+    idx = np.arange(n_frames) % len(ir_frames)
+    ir = ir_frames[idx] + rng.normal(0, 0.5, (n_frames,) + ir_frames.shape[1:])
+    rgb = [rgb_frames[i] for i in idx]
+    return ir, rgb
+
+
+@contextlib.contextmanager
+def quiet():
+    # the code under test prints on every frame
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def collector():
+    dc = DataCollector.__new__(DataCollector)
+    dc.mlx_shape = (24, 32)
+    dc.camera_shape = (720, 1280, 3)
+    dc.irCodec = get_codec("png")
+    dc.rgbCodec = get_codec("png")
+    dc.calibration = None
+    return dc
+
+
+class NoPipeline:
+    # stands in for CapturePipeline where saveFrame is stubbed out, so
+    # nothing is ever submitted
+    def drain(self):
+        pass
+
+
+def uploader(client_conn=None):
+    du = DataUploader.__new__(DataUploader)
+    du.client_conn = client_conn
+    du.receiver = FrameReceiver(client_conn) if client_conn else None
+    du.capture = {}
+    du.frameCount = 1
+    du.allData = []
+    du.flightNum = 1
+    # end of flight reporting, with profiling and metrics files off
+    du.history = HotspotHistory()
+    du.profiler = FlightProfiler()
+    du.metricsFile = None
+    du.pipeline = NoPipeline()
+    du.flushDB = lambda: None
+    return du
+
+
+########## hot paths ##########
+# each bench_* takes the flight and returns the number of bytes it handled
+
+
+def bench_detect_fires(ir, rgb):
+    for frame in ir:
+        detect_fires(frame)
+    return ir.nbytes
+
+
+def bench_detect_fires_batch(ir, rgb):
+    detect_fires_batch(ir)
+    return ir.nbytes
+
+
+def bench_extract_hotspots(ir, rgb):
+    extract_hotspots(ir)
+    return ir.nbytes
+
+
+def bench_temps_to_rescaled_uints(ir, rgb):
+    dc = collector()
+    for frame in ir:
+        dc.temps_to_rescaled_uints(frame.copy())
+    return ir.nbytes
+
+
+def bench_rescale_batch(ir, rgb):
+    # the whole flight in one call, into reused buffers
+    out = np.empty(ir.shape[:1] + MLX_SHAPE, dtype=np.uint8)
+    work = np.empty(out.shape)
+    rescale_to_uint8(ir, out=out, work=work)
+    return ir.nbytes
+
+
+def bench_png_encode_drone(ir, rgb):
+    # as done in DataCollector.sendData with the default tiers
+    dc = collector()
+    total = 0
+    for frame_ir, frame_rgb in zip(ir, rgb):
+        _, files = dc.encodeRecord((frame_ir.copy(), frame_rgb, (0.0, 0.0)), path_id=1)
+        total += sum(len(content) for _, content in files.values())
+    return total
+
+
+def bench_png_encode_server(ir, rgb):
+    # as done in DataUploader.saveArrToPNG, which writes under ../server_hd
+    du = uploader()
+    dc = collector()
+    total = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for folder in ("work", "server_hd/ir_images", "server_hd/rgb_images"):
+            Path(tmp, folder).mkdir(parents=True)
+        cwd = os.getcwd()
+        os.chdir(Path(tmp) / "work")
+        try:
+            for i, (frame_ir, frame_rgb) in enumerate(zip(ir, rgb)):
+                ir_norm = dc.temps_to_rescaled_uints(frame_ir.copy())
+                ir_path = du.saveArrToPNG(ir_norm, str(i), type="ir")
+                rgb_path = du.saveArrToPNG(frame_rgb, str(i), type="rgb")
+                total += os.path.getsize(ir_path) + os.path.getsize(rgb_path)
+        finally:
+            os.chdir(cwd)
+    return total
+
+
+def bench_receive_frame(ir, rgb):
+    # as done in DataUploader.receiveFrame, over a local socket pair
+    from datetime import datetime
+
+    when = frame_protocol.encode_frame(FRAME_TIME, np.array([datetime(2023, 3, 1, 12, 0, 0)]))
+    gps = frame_protocol.encode_frame(FRAME_GPS, np.array([43.4738, -80.5531]))
+    messages = [
+        (
+            frame_protocol.encode_frame(FRAME_IR, frame_ir),
+            frame_protocol.encode_frame(FRAME_RGB, frame_rgb),
+            gps,
+            when,
+        )
+        for frame_ir, frame_rgb in zip(ir, rgb)
+    ]
+    total = sum(len(header) + len(payload) for m in messages for header, payload in m)
+
+    server_conn, client_conn = socket.socketpair()
+    du = uploader(server_conn)
+    du.saveFrame = lambda frame_type, frame: None
+
+    def send():
+        for m in messages:
+            for header, payload in m:
+                client_conn.sendall(header)
+                client_conn.sendall(payload)
+        frame_protocol.send_end(client_conn)
+        client_conn.close()
+
+    # a daemon, and both ends closed on the way out, so a failing
+    # receiveFrame can't leave it blocked in sendall
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    try:
+        while True:
+            du.receiveFrame()
+            if du.closeSocketFlag:
+                break
+        sender.join()
+    finally:
+        server_conn.close()
+        client_conn.close()
+    return total
+
+
+def codec_bench(spec):
+    # one image_codecs tier on the rescaled ir and the rgb frame; returns
+    # the encoded size, so kb_per_frame is what the tier would upload
+    def bench(ir, rgb):
+        dc = collector()
+        codec = get_codec(spec)
+        total = 0
+        for frame_ir, frame_rgb in zip(ir, rgb):
+            total += len(codec.encode(dc.temps_to_rescaled_uints(frame_ir.copy())).data)
+            total += len(codec.encode(frame_rgb).data)
+        return total
+
+    return bench
+
+
+for _spec in CODEC_TIERS:
+    globals()["bench_encode_" + _spec.replace(":", "_")] = codec_bench(_spec)
+
+
+BENCHMARKS = {
+    name[len("bench_") :]: fn
+    for name, fn in list(globals().items())
+    if name.startswith("bench_")
+}
+
+
+########## harness ##########
+
+
+def run_one(fn, ir, rgb, repeat):
+    times = []
+    with quiet():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            n_bytes = fn(ir, rgb)
+            times.append(time.perf_counter() - start)
+
+        # separate pass so tracing doesn't skew the timings
+        tracemalloc.start()
+        fn(ir, rgb)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    best = min(times)
+    return {
+        "frames": len(ir),
+        "seconds": best,
+        "ms_per_frame": 1000 * best / len(ir),
+        "frames_per_s": len(ir) / best,
+        "mb_per_s": n_bytes / best / 1e6,
+        "kb_per_frame": n_bytes / len(ir) / 1e3,
+        "peak_mem_mb": peak / 1e6,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    print("\nbenchmark              frames    before ms/frame   after ms/frame   speedup", file=sys.stderr)
+    before = {(r["name"], r["frames"]): r for r in previous["results"]}
+    for r in results:
+        old = before.get((r["name"], r["frames"]))
+        if old is None:
+            continue
+        print(
+            f"{r['name']:<22} {r['frames']:>6} {old['ms_per_frame']:>17.3f}"
+            f" {r['ms_per_frame']:>16.3f} {old['ms_per_frame'] / r['ms_per_frame']:>8.2f}x",
+            file=sys.stderr,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the drone/server hot paths")
+    parser.add_argument(
+        "--frames", type=int, nargs="*", default=[],
+        help="synthetic flight lengths to run (default: the test_data captures as-is)",
+    )
+    parser.add_argument("--paths", nargs="*", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    ir_frames, rgb_frames = load_test_data()
+    flights = [(ir_frames, rgb_frames)]
+    if args.frames:
+        flights = [synthesize(ir_frames, rgb_frames, n) for n in args.frames]
+
+    results = []
+    for ir, rgb in flights:
+        for name in args.paths:
+            result = {"name": name, **run_one(BENCHMARKS[name], ir, rgb, args.repeat)}
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+##########################################
+# Recognising captures the server has already received
+##########################################
+#
+# A drone retrying after a bad link can send a capture again. Each capture
+# is identified by a hash of its IR, RGB, GPS and TIME frames:
+#
+#   IngestLedger  hashes whose records are committed to the DB, kept in an
+#                 append-only file so they survive restarts
+#   ResultCache   bounded LRU of hash -> Future of this session's captures,
+#                 resolving to the persisted record, so a retry of a capture
+#                 still being processed or already processed reuses it
+#
+# A retry then costs a hash and a lookup instead of encoding, detection and
+# a duplicate image_records row.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DIGEST_SIZE = 16
+
+
+def capture_hash(dataList):
+    """Hex digest of a capture's frames (ir, rgb, gps, time arrays)."""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for arr in dataList:
+        arr = np.ascontiguousarray(arr)
+        # shape and dtype too, so differently shaped frames never collide
+        h.update(f"{arr.dtype.str}{arr.shape}".encode())
+        h.update(arr.reshape(-1).view(np.uint8))
+    return h.hexdigest()
+
+
+class IngestLedger:
+    """Append-only "<hash> <flightNum>" log of captures committed to the DB."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.digests = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if parts:
+                        self.digests.add(parts[0])
+        self.file = open(path, "a")
+
+    def __contains__(self, digest):
+        with self.lock:
+            return digest in self.digests
+
+    def __len__(self):
+        return len(self.digests)
+
+    def add(self, entries):
+        """Record [(digest, flightNum)], one fsync for all of them."""
+        entries = [(d, f) for d, f in entries if d]
+        if not entries:
+            return
+        with self.lock:
+            self.file.write("".join(f"{digest} {flightNum}\n" for digest, flightNum in entries))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.digests.update(d for d, _ in entries)
+
+    def close(self):
+        self.file.close()
+
+
+class ResultCache:
+    """Bounded LRU of capture hash -> Future of its persisted record."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, digest):
+        """The capture's Future, or None if unknown or its processing failed."""
+        with self.lock:
+            future = self.entries.get(digest)
+            if future is None:
+                return None
+            if future.done() and future.exception() is not None:
+                # let the retry process it again
+                del self.entries[digest]
+                return None
+            self.entries.move_to_end(digest)
+            return future
+
+    def put(self, digest, future):
+        with self.lock:
+            self.entries[digest] = future
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
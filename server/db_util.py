@@ -2,6 +2,9 @@ import mysql.connector
 from mysql.connector import Error
 import io
 import json
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import date, datetime
 
 
@@ -18,6 +21,134 @@ def create_db_connection(host_name, user_name, user_password, db_name):
     return connection
 
 
+class ConnectionPool:
+    """Fixed size pool of MySQL connections shared between threads.
+
+    Connections are opened lazily, checked with a ping when borrowed and
+    reconnected if MySQL dropped them while idle (e.g. between flights).
+    Each connection keeps its prepared statements, so the fixed queries are
+    only prepared once per connection.
+    """
+
+    def __init__(self, host_name, user_name, user_password, db_name, size=4, timeout=30,
+                 reconnect_attempts=3, reconnect_delay=1):
+        self.connect_args = dict(host=host_name, user=user_name, passwd=user_password, database=db_name)
+        self.size = size
+        self.timeout = timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.prepared = {}  # id(connection) -> {query: prepared cursor}
+
+    def _open(self):
+        connection = mysql.connector.connect(**self.connect_args)
+        self.prepared[id(connection)] = {}
+        print("MySQL Database connection successful")
+        return connection
+
+    def _discard(self, connection):
+        for cursor in self.prepared.pop(id(connection), {}).values():
+            try:
+                cursor.close()
+            except Error:
+                pass
+        try:
+            connection.close()
+        except Error:
+            pass
+        with self.lock:
+            self.opened -= 1
+
+    def acquire(self):
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                grow = self.opened < self.size
+                if grow:
+                    self.opened += 1
+            if grow:
+                try:
+                    return self._open()
+                except Error:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            try:
+                connection = self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise Error(f"no database connection free after {self.timeout}s")
+
+        # health check on borrow, reconnecting a connection dropped while idle
+        if not connection.is_connected():
+            print("MySQL connection lost, reconnecting")
+            for cursor in self.prepared.get(id(connection), {}).values():
+                try:
+                    cursor.close()
+                except Error:
+                    pass
+            self.prepared[id(connection)] = {}
+            try:
+                connection.reconnect(attempts=self.reconnect_attempts, delay=self.reconnect_delay)
+            except Error:
+                self._discard(connection)
+                raise
+        return connection
+
+    def release(self, connection):
+        try:
+            # don't hand the next borrower a half finished transaction
+            if connection.in_transaction:
+                connection.rollback()
+        except Error:
+            self._discard(connection)
+            return
+        self.idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    @contextmanager
+    def cursor(self, commit=False):
+        """Borrowed connection's cursor, closed (and optionally committed) on exit."""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                if commit:
+                    connection.commit()
+            finally:
+                cursor.close()
+
+    def prepare(self, connection, query):
+        """Prepared cursor for query on connection, reused across calls."""
+        statements = self.prepared.setdefault(id(connection), {})
+        if query not in statements:
+            statements[query] = connection.cursor(prepared=True)
+        return statements[query]
+
+    def read_prepared(self, query, params=()):
+        with self.connection() as connection:
+            cursor = self.prepare(connection, query)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+
 def execute_query(connection, query, params=()):
     cursor = connection.cursor()
     try:
@@ -26,6 +157,8 @@ def execute_query(connection, query, params=()):
         print("Query successful")
     except Error as err:
         print(f"Error: '{err}'")
+    finally:
+        cursor.close()
 
 
 def read_query(connection, query, params=(), as_json=False):
@@ -41,6 +174,8 @@ def read_query(connection, query, params=(), as_json=False):
         return result
     except Error as err:
         print(f"Error: '{err}'")
+    finally:
+        cursor.close()
 
 
 def getJson(cursor):
@@ -60,10 +195,16 @@ def json_serial(obj):
     raise TypeError("Type %s not serializable" % type(obj))
 
 
-def getFlightNum(connection):
-    query = "SELECT max(flightNum) from image_records;"
-    res = read_query(connection, query)
-    if len(res) == 0:
-        return res[0][0]
+QUERY_MAX_FLIGHT = "SELECT max(flightNum) from image_records;"
+
+
+def getFlightNum(db):
+    """Number for the next flight; db is a ConnectionPool or a connection."""
+    if isinstance(db, ConnectionPool):
+        res = db.read_prepared(QUERY_MAX_FLIGHT)
+    else:
+        res = read_query(db, QUERY_MAX_FLIGHT)
+    if res and res[0][0] is not None:
+        return res[0][0] + 1
     else:
-        return 1
\ No newline at end of file
+        return 1
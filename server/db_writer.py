@@ -0,0 +1,208 @@
+import threading
+
+from mysql.connector import Error
+
+import metrics
+from location_index import DEFAULT_RADIUS_M, LocationIndex, bounding_box
+
+QUERY_CHECK_LOC = "SELECT locID FROM locations WHERE lon = %s and lat = %s;"
+QUERY_LOCS_IN_BOX = (
+    "SELECT locID, lon, lat FROM locations WHERE lat BETWEEN %s AND %s AND lon BETWEEN %s AND %s;"
+)
+
+
+class BatchedWriter:
+    """Write-behind writer for image_records and hotspots.
+
+    Records are buffered and written with executemany in one transaction per
+    batch, so a flight costs a handful of round-trips instead of several per
+    frame. Call flush() at the end of a flight and on shutdown.
+
+    Each capture is snapped to the nearest known location within
+    snap_radius_m using a LocationIndex loaded once from the locations
+    table, so repeated flights over a field reuse its locIDs. Captures that
+    miss are checked against the DB with one bounding box query per batch
+    (locations added by someone else) before new locations are inserted in
+    bulk.
+
+    A HotspotHistory, if given, is updated with every committed batch, and
+    an IngestLedger gets the committed captures' hashes. before_commit, if
+    given, is called just before every commit (including the automatic
+    ones when a batch fills), e.g. to make the batch's images durable
+    first; if it raises, the batch isn't committed.
+    """
+
+    def __init__(self, pool, batch_size=500, snap_radius_m=DEFAULT_RADIUS_M, history=None, ledger=None,
+                 before_commit=None):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.history = history
+        self.ledger = ledger
+        self.before_commit = before_commit
+        self.locations = LocationIndex(snap_radius_m)
+        self.pending = []
+        # the persistence thread and end-of-flight flushes share the batch
+        self.lock = threading.RLock()
+        self.loadLocations()
+
+    def loadLocations(self):
+        with self.lock:
+            try:
+                with self.pool.cursor() as cursor:
+                    cursor.execute("SELECT locID, lon, lat FROM locations;")
+                    for locID, lon, lat in cursor.fetchall():
+                        self.locations.add(locID, lon, lat)
+            except Error as err:
+                print(f"Error: '{err}'")
+
+    def seedLocations(self, coords):
+        """Make sure every (lon, lat), e.g. planned waypoints, has a location.
+
+        Captures near a waypoint then snap to it rather than to wherever the
+        first fix happened to land.
+        """
+        coords = [(float(lon), float(lat)) for lon, lat in coords]
+        with self.lock:
+            try:
+                with self.pool.connection() as connection:
+                    cursor = connection.cursor()
+                    try:
+                        _, new = self._resolveLocations(connection, cursor, coords)
+                        connection.commit()
+                        self._addLocations(new)
+                    finally:
+                        cursor.close()
+            except Error as err:
+                print(f"Error: '{err}'")
+
+    def add(self, lon, lat, date, ir_path, rgb_path, sizes, flightNum, digest=None):
+        with self.lock:
+            self.pending.append((float(lon), float(lat), date, ir_path, rgb_path, list(sizes), flightNum, digest))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write everything pending in one transaction.
+
+        On failure the transaction is rolled back and the batch stays pending
+        so the next flush retries it.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            batch = self.pending
+            try:
+                with metrics.timed("db_write"), self.pool.connection() as connection:
+                    self._write(connection, batch)
+                metrics.count("records", len(batch), stage="db_write")
+            except (Error, OSError) as err:
+                # the pool rolls back the unfinished transaction
+                metrics.count("errors", stage="db_write")
+                print(f"Error: '{err}'")
+
+    def _write(self, connection, batch):
+        cursor = connection.cursor()
+        try:
+            locIDs, new = self._resolveLocations(connection, cursor, [(r[0], r[1]) for r in batch])
+
+            image_records = []
+            hotspots = []
+            for locID, (lon, lat, date, ir_path, rgb_path, sizes, flightNum, _) in zip(locIDs, batch):
+                image_records.append((locID, flightNum, date, ir_path, rgb_path))
+                hotspots.extend((locID, flightNum, size, 0) for size in sizes)
+
+            cursor.executemany(
+                "INSERT INTO image_records (locID, flightNum, date_time, irImagePath, rgbImagePath) VALUES (%s, %s, %s, %s, %s);",
+                image_records,
+            )
+            if hotspots:
+                cursor.executemany(
+                    "INSERT INTO hotspots (locID, flightNum, size, hotspot_status) VALUES (%s, %s, %s, %s);",
+                    hotspots,
+                )
+            if self.before_commit is not None:
+                self.before_commit()
+            connection.commit()
+            # only indexed once committed, a rollback would orphan new IDs
+            self._addLocations(new)
+            self.pending = []
+            if self.history is not None:
+                for locID, r in zip(locIDs, batch):
+                    self.history.record(locID, r[6], r[5])
+            if self.ledger is not None:
+                self.ledger.add([(r[7], r[6]) for r in batch])
+            print(f"wrote {len(image_records)} image records and {len(hotspots)} hotspots")
+        finally:
+            cursor.close()
+
+    def _resolveLocations(self, connection, cursor, coords):
+        """(locID for every (lon, lat), [(locID, lon, lat)] inserted), inserting new locations.
+
+        Called with the lock held. Resolves against self.locations as is;
+        the inserted locations are for the caller to add once committed.
+        """
+        misses = [(lon, lat) for lon, lat in coords if self.locations.snap(lon, lat) is None]
+        if misses:
+            # catch locations other writers added since ours were loaded;
+            # they're committed already, so go straight into the index
+            lon_min, _, lat_min, _ = bounding_box(
+                min(m[0] for m in misses), min(m[1] for m in misses), self.locations.radius_m
+            )
+            _, lon_max, _, lat_max = bounding_box(
+                max(m[0] for m in misses), max(m[1] for m in misses), self.locations.radius_m
+            )
+            cursor.execute(QUERY_LOCS_IN_BOX, (lat_min, lat_max, lon_min, lon_max))
+            for locID, lon, lat in cursor.fetchall():
+                if locID not in self.locations:
+                    self.locations.add(locID, lon, lat)
+
+        # fixes that match nothing get a placeholder (negative) ID, in an
+        # index of this batch's new locations, so nearby fixes in the same
+        # batch share one new location
+        batch = LocationIndex(self.locations.radius_m)
+        new = []
+        locIDs = []
+        for lon, lat in coords:
+            hits = [hit for hit in (self.locations.nearest(lon, lat), batch.nearest(lon, lat)) if hit]
+            if hits:
+                locID = min(hits, key=lambda hit: hit[1])[0]
+            else:
+                locID = -(len(new) + 1)
+                batch.add(locID, lon, lat)
+                new.append((lon, lat))
+            locIDs.append(locID)
+
+        if not new:
+            return locIDs, []
+        real = self._insertLocations(connection, cursor, new)
+        locIDs = [real.get(locID, locID) for locID in locIDs]
+        return locIDs, [(real[-(i + 1)], lon, lat) for i, (lon, lat) in enumerate(new)]
+
+    def _addLocations(self, new):
+        for locID, lon, lat in new:
+            self.locations.add(locID, lon, lat)
+
+    def _insertLocations(self, connection, cursor, new):
+        """Insert the new (lon, lat)s; returns {placeholder ID: locID}."""
+        cursor.executemany("INSERT INTO locations (lon, lat) VALUES (%s, %s);", new)
+        placeholders = ", ".join(["(%s, %s)"] * len(new))
+        cursor.execute(
+            f"SELECT locID, lon, lat FROM locations WHERE (lon, lat) IN ({placeholders});",
+            [v for loc in new for v in loc],
+        )
+        byValue = {(lon, lat): locID for locID, lon, lat in cursor.fetchall()}
+
+        # fall back to the exact lookup for anything whose stored value
+        # didn't compare equal in python
+        lookup = self.pool.prepare(connection, QUERY_CHECK_LOC)
+        real = {}
+        for i, (lon, lat) in enumerate(new):
+            if (lon, lat) not in byValue:
+                lookup.execute(QUERY_CHECK_LOC, (lon, lat))
+                rows = lookup.fetchall()
+                if not rows:
+                    # an Error, so flush rolls back and keeps the batch pending
+                    raise Error(f"location ({lon}, {lat}) wasn't found after inserting it")
+                byValue[(lon, lat)] = rows[0][0]
+            real[-(i + 1)] = byValue[(lon, lat)]
+        return real
@@ -0,0 +1,174 @@
+##########################################
+# Binary flight archive for thermal frames
+##########################################
+#
+# Layout (little endian):
+#   header   64 bytes, see HEADER_FORMAT
+#   frames   n_frames * rows * cols values of the header dtype (f4 or f2)
+#   index    n_frames INDEX_DTYPE records (time, lat, lon), 8 byte aligned
+#
+# Opening an archive only maps it, so slicing frame k of a 100k frame
+# flight reads just that frame from disk.
+#
+# python flight_archive.py convert test_data/stove_data stove.flight
+# python flight_archive.py info stove.flight
+
+import argparse
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from threshold_detect import detect_fires_batch
+
+MAGIC = b"FFLYARC\0"
+VERSION = 1
+HEADER_FORMAT = "<8sH4sHHQQQ"  # magic, version, dtype, rows, cols, n_frames, frames/index offsets
+HEADER_SIZE = 64
+MLX_SHAPE = (24, 32)
+FRAME_DTYPES = ("<f4", "<f2")
+
+# time is seconds since the epoch; missing values are NaN
+INDEX_DTYPE = np.dtype([("time", "<f8"), ("lat", "<f8"), ("lon", "<f8")])
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def write_archive(path, frames, index=None, dtype="<f4"):
+    """Write (N, 24, 32) frames and their INDEX_DTYPE index to path."""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    if dtype.str not in FRAME_DTYPES:
+        raise ValueError(f"frames must be stored as one of {FRAME_DTYPES}, not {dtype.str}")
+
+    frames = np.asarray(frames).reshape((-1,) + MLX_SHAPE)
+    n_frames = len(frames)
+    if index is None:
+        index = np.full(n_frames, np.nan, dtype=INDEX_DTYPE)
+    index = np.asarray(index, dtype=INDEX_DTYPE)
+    if len(index) != n_frames:
+        raise ValueError(f"{n_frames} frames but {len(index)} index records")
+
+    frames_offset = HEADER_SIZE
+    frames_nbytes = n_frames * MLX_SHAPE[0] * MLX_SHAPE[1] * dtype.itemsize
+    index_offset = _align(frames_offset + frames_nbytes)
+
+    header = struct.pack(
+        HEADER_FORMAT,
+        MAGIC,
+        VERSION,
+        dtype.str.encode(),
+        MLX_SHAPE[0],
+        MLX_SHAPE[1],
+        n_frames,
+        frames_offset,
+        index_offset,
+    )
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(frames, dtype=dtype).tobytes())
+        f.write(b"\0" * (index_offset - frames_offset - frames_nbytes))
+        f.write(index.tobytes())
+
+
+class FlightArchive:
+    """Memory mapped view of an archive written by write_archive.
+
+    `frames` is an (N, 24, 32) memmap and can be passed straight to
+    detect_fires_batch / extract_hotspots; `index` holds time, lat and lon.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+        if len(raw) < HEADER_SIZE or raw[:8] != MAGIC:
+            raise ValueError(f"{self.path} is not a flight archive")
+
+        (_, version, dtype, rows, cols, n_frames, frames_offset, index_offset) = struct.unpack_from(
+            HEADER_FORMAT, raw
+        )
+        if version != VERSION:
+            raise ValueError(f"{self.path}: unsupported archive version {version}")
+
+        self.dtype = np.dtype(dtype.rstrip(b"\0").decode())
+        self.shape = (rows, cols)
+        if n_frames == 0:
+            # mmap can't map a zero length region
+            self.frames = np.empty((0, rows, cols), dtype=self.dtype)
+            self.index = np.empty(0, dtype=INDEX_DTYPE)
+            return
+        self.frames = np.memmap(
+            self.path, dtype=self.dtype, mode="r", offset=frames_offset, shape=(n_frames, rows, cols)
+        )
+        self.index = np.memmap(
+            self.path, dtype=INDEX_DTYPE, mode="r", offset=index_offset, shape=(n_frames,)
+        )
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, k):
+        return self.frames[k]
+
+    def chunks(self, size=4096):
+        """Yield (start, frames) slices so huge archives can be processed piecewise."""
+        for start in range(0, len(self), size):
+            yield start, self.frames[start : start + size]
+
+    def close(self):
+        # memmaps are closed when their last reference goes away
+        self.frames = self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_archive(path):
+    return FlightArchive(path)
+
+
+def convert_csv_folder(folder, out_path, dtype="<f4"):
+    """Convert a folder of dataN.csv frames (as in test_data) to an archive.
+
+    The CSV folders carry no timestamps or GPS, so the index is left NaN.
+    Returns the number of frames written.
+    """
+    csvs = sorted(Path(folder).glob("data*.csv"), key=lambda p: int(p.stem[4:]))
+    if not csvs:
+        raise FileNotFoundError(f"no dataN.csv files in {folder}")
+    frames = np.stack([np.loadtxt(csv, delimiter=",") for csv in csvs])
+    write_archive(out_path, frames, dtype=dtype)
+    return len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flight archive tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert = sub.add_parser("convert", help="convert a folder of dataN.csv frames")
+    convert.add_argument("folder")
+    convert.add_argument("out_path")
+    convert.add_argument("--float16", action="store_true", help="store frames as float16")
+
+    info = sub.add_parser("info", help="describe an archive")
+    info.add_argument("path")
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        n = convert_csv_folder(args.folder, args.out_path, "<f2" if args.float16 else "<f4")
+        print(f"wrote {n} frames to {args.out_path}")
+    else:
+        with open_archive(args.path) as archive:
+            print(f"{archive.path}: {len(archive)} frames of {archive.shape} {archive.dtype}")
+            with_fire = sum(np.count_nonzero(detect_fires_batch(f)) for _, f in archive.chunks())
+            print(f"frames with fire: {with_fire}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
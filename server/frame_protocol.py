@@ -0,0 +1,184 @@
+##########################################
+# Drone -> server wire protocol
+##########################################
+#
+# Every frame is a fixed 32 byte header followed by the raw array bytes:
+#
+#   magic     2s   b"FF"
+#   version   B
+#   type      B    FRAME_IR / FRAME_RGB / FRAME_GPS / FRAME_TIME / FRAME_END
+#   dtype     B    key into DTYPES
+#   ndim      B    number of used entries in shape
+#   (pad)     2x
+#   shape     4I
+#   length    Q    payload bytes, always prod(shape) * itemsize
+#
+# A capture is one IR, RGB, GPS and TIME frame in any order; FRAME_END (no
+# payload) ends the flight. Payloads are read straight into the array that is
+# handed on, so there is no pickle and no intermediate copy.
+
+import asyncio
+import struct
+
+import numpy as np
+
+import metrics
+
+MAGIC = b"FF"
+VERSION = 1
+HEADER = struct.Struct("<2sBBBBxx4IQ")
+HEADER_SIZE = HEADER.size  # 32
+
+FRAME_IR = 0
+FRAME_RGB = 1
+FRAME_GPS = 2
+FRAME_TIME = 3
+FRAME_END = 255
+CAPTURE_TYPES = (FRAME_IR, FRAME_RGB, FRAME_GPS, FRAME_TIME)
+FRAME_NAMES = {FRAME_IR: "ir", FRAME_RGB: "rgb", FRAME_GPS: "gps", FRAME_TIME: "time", FRAME_END: "end"}
+
+DTYPES = {
+    1: np.dtype("|u1"),
+    2: np.dtype("<u2"),
+    3: np.dtype("<i2"),
+    4: np.dtype("<i4"),
+    5: np.dtype("<i8"),
+    6: np.dtype("<f2"),
+    7: np.dtype("<f4"),
+    8: np.dtype("<f8"),
+    9: np.dtype("<M8[us]"),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+# refuse anything bigger than a few uncompressed camera frames
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _wire_array(frame_type, arr):
+    arr = np.asarray(arr)
+    if frame_type == FRAME_TIME or arr.dtype == object:
+        # datetime objects travel as microseconds since the epoch
+        arr = arr.astype("M8[us]")
+    dtype = arr.dtype.newbyteorder("<") if arr.dtype.byteorder == ">" else arr.dtype
+    if dtype not in DTYPE_CODES:
+        raise ProtocolError(f"can't send arrays of dtype {arr.dtype}")
+    if arr.ndim > 4:
+        raise ProtocolError(f"can't send arrays with {arr.ndim} dimensions")
+    return np.ascontiguousarray(arr, dtype=dtype)
+
+
+def encode_header(frame_type, arr=None):
+    if arr is None:
+        return HEADER.pack(MAGIC, VERSION, frame_type, 0, 0, 0, 0, 0, 0, 0)
+    shape = arr.shape + (0,) * (4 - arr.ndim)
+    return HEADER.pack(MAGIC, VERSION, frame_type, DTYPE_CODES[arr.dtype], arr.ndim, *shape, arr.nbytes)
+
+
+def encode_frame(frame_type, arr):
+    """Header and payload buffers for one frame, ready for sendall."""
+    arr = _wire_array(frame_type, arr)
+    return encode_header(frame_type, arr), memoryview(arr.reshape(-1).view(np.uint8))
+
+
+def send_frame(sock, frame_type, arr):
+    header, payload = encode_frame(frame_type, arr)
+    sock.sendall(header)
+    sock.sendall(payload)
+
+
+def send_capture(sock, ir, rgb, gps, when):
+    for frame_type, arr in zip(CAPTURE_TYPES, (ir, rgb, gps, when)):
+        send_frame(sock, frame_type, arr)
+
+
+def send_end(sock):
+    sock.sendall(encode_header(FRAME_END))
+
+
+def decode_header(header):
+    """(frame_type, dtype, shape, length) from a HEADER_SIZE buffer."""
+    magic, version, frame_type, dtype_code, ndim, *shape, length = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ProtocolError(f"bad frame header {bytes(header[:4])!r}")
+    if frame_type == FRAME_END:
+        return frame_type, None, None, 0
+    if frame_type not in CAPTURE_TYPES or dtype_code not in DTYPES or ndim > 4:
+        raise ProtocolError(f"bad frame header {bytes(header)!r}")
+
+    dtype = DTYPES[dtype_code]
+    shape = tuple(shape[:ndim])
+    if length != int(np.prod(shape)) * dtype.itemsize or length > MAX_PAYLOAD:
+        raise ProtocolError(f"bad payload length {length} for {shape} {dtype}")
+    return frame_type, dtype, shape, length
+
+
+class FrameReceiver:
+    """Reads frames from a blocking socket with recv_into.
+
+    The header buffer is reused for every frame and each payload is read
+    directly into the numpy array that recv_frame returns.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.header = bytearray(HEADER_SIZE)
+        self.header_view = memoryview(self.header)
+
+    def _recv_exactly(self, view):
+        received = 0
+        while received < len(view):
+            n = self.sock.recv_into(view[received:])
+            if n == 0:
+                return received
+            received += n
+        return received
+
+    def recv_frame(self):
+        """(frame_type, array); (FRAME_END, None) at the end of the flight.
+
+        A drone that disconnects between frames is treated as having ended
+        the flight; disconnecting mid-frame raises ConnectionError.
+        """
+        got = self._recv_exactly(self.header_view)
+        if got == 0:
+            return FRAME_END, None
+        if got < HEADER_SIZE:
+            raise ConnectionError("connection closed inside a frame header")
+
+        with metrics.timed("decode"):
+            frame_type, dtype, shape, length = decode_header(self.header)
+            if frame_type == FRAME_END:
+                return FRAME_END, None
+            frame = np.empty(shape, dtype=dtype)
+        if length and self._recv_exactly(memoryview(frame.reshape(-1).view(np.uint8))) < length:
+            raise ConnectionError("connection closed inside a frame payload")
+        return frame_type, frame
+
+
+async def read_frame_async(reader):
+    """asyncio counterpart of FrameReceiver.recv_frame for a StreamReader."""
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+    except asyncio.IncompleteReadError as err:
+        if not err.partial:
+            return FRAME_END, None
+        raise ConnectionError("connection closed inside a frame header") from err
+
+    frame_type, dtype, shape, length = decode_header(header)
+    if frame_type == FRAME_END:
+        return FRAME_END, None
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as err:
+        raise ConnectionError("connection closed inside a frame payload") from err
+    with metrics.timed("decode"):
+        return frame_type, np.frombuffer(payload, dtype=dtype).reshape(shape)
+
+
+def to_datetime(when):
+    """datetime from a TIME frame (or the legacy object array of datetimes)."""
+    return np.asarray(when).astype("M8[us]").reshape(-1)[0].item()
@@ -0,0 +1,113 @@
+##########################################
+# Per-location hotspot history across flights
+##########################################
+#
+# For every location seen, the total hotspot size (interpolated pixels) and
+# hotspot count of each of its last `flights_kept` flights, by flightNum.
+# A flight over a location that found nothing counts as size 0, so fires
+# that went out show up as shrinking. Records can arrive in any flight
+# order (the asyncio server writes concurrent flights in one batch); each
+# is added to its own flight's entry and growth is always the newest
+# flight against the one before it.
+#
+# The BatchedWriter feeds it every committed batch and load() rebuilds it
+# from the DB at startup, so "latest sizes for locID" and "which locations
+# are growing" never have to aggregate the hotspots table. At most
+# `max_locations` are kept; the least recently updated are evicted.
+
+import threading
+import heapq
+from collections import OrderedDict, namedtuple
+
+from mysql.connector import Error
+
+QUERY_HOTSPOT_TOTALS = (
+    "SELECT locID, flightNum, SUM(size), COUNT(*) FROM hotspots GROUP BY locID, flightNum;"
+)
+QUERY_VISITS = "SELECT DISTINCT locID, flightNum FROM image_records;"
+
+FlightHotspots = namedtuple("FlightHotspots", ["flightNum", "total_size", "count"])
+
+
+class HotspotHistory:
+    def __init__(self, flights_kept=10, max_locations=100000, min_growth=0):
+        self.flights_kept = flights_kept
+        self.max_locations = max_locations
+        self.min_growth = min_growth
+        self.lock = threading.Lock()
+        self.locations = OrderedDict()  # locID -> {flightNum: FlightHotspots}, LRU order
+        self.growing = {}  # locID -> growth since its previous flight
+
+    def __len__(self):
+        return len(self.locations)
+
+    def load(self, pool):
+        """Rebuild from the hotspots and image_records tables."""
+        try:
+            with pool.cursor() as cursor:
+                cursor.execute(QUERY_VISITS)
+                visits = {(locID, flightNum): (0, 0) for locID, flightNum in cursor.fetchall()}
+                cursor.execute(QUERY_HOTSPOT_TOTALS)
+                for locID, flightNum, total, count in cursor.fetchall():
+                    visits[(locID, flightNum)] = (int(total), int(count))
+        except Error as err:
+            print(f"Error: '{err}'")
+            return
+
+        with self.lock:
+            self.locations.clear()
+            self.growing.clear()
+        # oldest flights first, so the LRU order ends up by latest flight
+        for (locID, flightNum), (total, count) in sorted(visits.items(), key=lambda v: v[0][1]):
+            self._add(locID, flightNum, total, count)
+        print(f"loaded hotspot history for {len(self)} locations")
+
+    def record(self, locID, flightNum, sizes):
+        """One image record's hotspot sizes (possibly none) at locID."""
+        self._add(locID, flightNum, sum(sizes), len(sizes))
+
+    def _add(self, locID, flightNum, total, count):
+        with self.lock:
+            history = self.locations.get(locID)
+            if history is None:
+                history = self.locations[locID] = {}
+                if len(self.locations) > self.max_locations:
+                    evicted, _ = self.locations.popitem(last=False)
+                    self.growing.pop(evicted, None)
+            else:
+                self.locations.move_to_end(locID)
+
+            last = history.get(flightNum)
+            if last is not None:
+                # more captures of the same location in the same flight
+                history[flightNum] = FlightHotspots(flightNum, last.total_size + total, last.count + count)
+            else:
+                history[flightNum] = FlightHotspots(flightNum, total, count)
+                if len(history) > self.flights_kept:
+                    # possibly the one just added, if it's older than the rest
+                    del history[min(history)]
+
+            flights = sorted(history)
+            growth = history[flights[-1]].total_size - history[flights[-2]].total_size if len(flights) > 1 else 0
+            if len(flights) > 1 and growth > self.min_growth:
+                self.growing[locID] = growth
+            else:
+                self.growing.pop(locID, None)
+
+    def latest(self, locID, n=None):
+        """Up to n FlightHotspots for locID, newest first."""
+        with self.lock:
+            history = self.locations.get(locID, {})
+            return [history[f] for f in sorted(history, reverse=True)[:n]]
+
+    def growingLocations(self, limit=None):
+        """[(locID, growth)] of locations whose hotspots grew since their previous flight, fastest first.
+
+        Ranked on every call: O(g log limit) for g growing locations, which
+        is fine for the end-of-flight report it's used for.
+        """
+        with self.lock:
+            items = list(self.growing.items())
+        if limit is None:
+            return sorted(items, key=lambda item: -item[1])
+        return heapq.nlargest(limit, items, key=lambda item: item[1])
@@ -0,0 +1,129 @@
+##########################################
+# Image encoding tiers for uploads and storage
+##########################################
+#
+# A tier is picked with a short spec string so it can come from the command
+# line or the environment:
+#
+#   png[:<compress_level 0-9>]            lossless, default level 6
+#   jpeg[:<quality 1-95>]                 default quality 85
+#   preview[:<longest side>[:<quality>]]  downscaled JPEG, default 320 px, 70
+#
+# Arrays are (h, w) greyscale (IR) or (h, w, 3) RGB uint8. Every encode
+# reports its time and size, CodecStats adds them up per stream.
+
+import io
+import threading
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+EncodedImage = namedtuple("EncodedImage", ["data", "format", "ext", "seconds"])
+
+
+class Codec:
+    format = None
+    ext = None
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def _prepare(self, im):
+        return im
+
+    def _save(self, im, buffer):
+        raise NotImplementedError
+
+    def encode(self, arr):
+        start = time.perf_counter()
+        im = Image.fromarray(arr, "L" if arr.ndim == 2 else "RGB")
+        buffer = io.BytesIO()
+        self._save(self._prepare(im), buffer)
+        return EncodedImage(buffer.getvalue(), self.format, self.ext, time.perf_counter() - start)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.spec}>"
+
+
+class PngCodec(Codec):
+    format = "png"
+    ext = "png"
+
+    def __init__(self, spec, compress_level=6):
+        super().__init__(spec)
+        self.compress_level = int(compress_level)
+
+    def _save(self, im, buffer):
+        im.save(buffer, format="PNG", compress_level=self.compress_level)
+
+
+class JpegCodec(Codec):
+    format = "jpeg"
+    ext = "jpg"
+
+    def __init__(self, spec, quality=85):
+        super().__init__(spec)
+        self.quality = int(quality)
+
+    def _save(self, im, buffer):
+        im.save(buffer, format="JPEG", quality=self.quality)
+
+
+class PreviewCodec(JpegCodec):
+    def __init__(self, spec, max_side=320, quality=70):
+        super().__init__(spec, quality)
+        self.max_side = int(max_side)
+
+    def _prepare(self, im):
+        scale = self.max_side / max(im.size)
+        if scale >= 1:
+            return im
+        size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+        # reducing_gap does most of the shrink on the cheap box filter
+        return im.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+TIERS = {"png": PngCodec, "jpeg": JpegCodec, "preview": PreviewCodec}
+
+
+def get_codec(spec):
+    """Codec for a tier spec such as "png", "jpeg:90" or "preview:480:75"."""
+    name, *params = spec.strip().lower().split(":")
+    if name not in TIERS:
+        raise ValueError(f"unknown codec '{name}', expected one of {', '.join(TIERS)}")
+    try:
+        return TIERS[name](spec, *params)
+    except (TypeError, ValueError):
+        raise ValueError(f"bad codec spec '{spec}'") from None
+
+
+class CodecStats:
+    """Running encode time and size per stream (e.g. "ir", "rgb")."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = {}
+
+    def add(self, stream, codec, encoded):
+        with self.lock:
+            entry = self.streams.setdefault(stream, {"codec": codec.spec, "images": 0, "bytes": 0, "seconds": 0.0})
+            entry["images"] += 1
+            entry["bytes"] += len(encoded.data)
+            entry["seconds"] += encoded.seconds
+
+    def summary(self):
+        with self.lock:
+            return {
+                stream: dict(
+                    entry,
+                    kb_per_image=entry["bytes"] / entry["images"] / 1e3,
+                    ms_per_image=1000 * entry["seconds"] / entry["images"],
+                )
+                for stream, entry in self.streams.items()
+            }
+
+    def report(self):
+        for stream, s in self.summary().items():
+            print(f"{stream}: {s['codec']}, {s['images']} images, "
+                  f"{s['kb_per_image']:.1f} KB and {s['ms_per_image']:.1f} ms per image")
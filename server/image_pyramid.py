@@ -0,0 +1,204 @@
+##########################################
+# Derived images (thumbnails, mid-size, colourised IR) of stored captures
+##########################################
+#
+#   cache = DerivedImageCache("../server_hd/derived")
+#   path = cache.get(rgb_path, "thumb")     # made on first request
+#   cache.prefetch(ir_path, ("thumb", "ir_color"))   # or in the background
+#
+# Tiers:
+#   thumb     longest side THUMB_SIDE, JPEG
+#   mid       longest side MID_SIDE, JPEG
+#   ir_color  the IR image upscaled IR_COLOR_SCALE times, min..max mapped
+#             through a false-colour palette, JPEG
+#
+# A derived file is named by a hash of its source's path, size and mtime,
+# so a source that changes is simply derived again; the stale file is
+# removed as soon as that's noticed, or evicted later. The cache is
+# bounded to max_bytes, evicting the least recently used files, and
+# rebuilds its accounting from the directory on startup.
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from image_codecs import get_codec
+from threshold_detect import MLX_INTERP_VAL
+
+THUMB_SIDE = 160
+MID_SIDE = 640
+IR_COLOR_SCALE = MLX_INTERP_VAL
+
+TIERS = {
+    "thumb": "preview:%d:75" % THUMB_SIDE,
+    "mid": "preview:%d:80" % MID_SIDE,
+    "ir_color": "jpeg:90",
+}
+
+# cold to hot: black, blue, magenta, orange, yellow, white
+_PALETTE_STOPS = np.array(
+    [[0, 0, 0], [32, 0, 140], [180, 0, 160], [255, 100, 0], [255, 220, 0], [255, 255, 255]], dtype=np.float64
+)
+PALETTE = np.stack(
+    [np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(_PALETTE_STOPS)), _PALETTE_STOPS[:, c]) for c in range(3)],
+    axis=1,
+).astype(np.uint8)
+
+
+def colourise_ir(gray, scale=IR_COLOR_SCALE):
+    """(h * scale, w * scale, 3) false-colour view of a greyscale IR image."""
+    im = Image.fromarray(gray, "L")
+    im = im.resize((im.width * scale, im.height * scale), Image.BICUBIC)
+    arr = np.asarray(im, dtype=np.float64)
+    lo, hi = arr.min(), arr.max()
+    index = np.zeros(arr.shape, dtype=np.uint8) if hi <= lo else ((arr - lo) * (255 / (hi - lo))).astype(np.uint8)
+    return PALETTE[index]
+
+
+def _load(path, tier):
+    im = Image.open(path)
+    if tier == "ir_color":
+        return np.asarray(im.convert("L"))
+    side = THUMB_SIDE if tier == "thumb" else MID_SIDE
+    # JPEG sources decode at a reduced scale straight away
+    im.draft(im.mode, (side, side))
+    return np.asarray(im.convert("L" if im.mode in ("L", "I", "F", "I;16") else "RGB"))
+
+
+def derive(source, tier):
+    """Encoded bytes of source's tier image."""
+    arr = _load(source, tier)
+    if tier == "ir_color":
+        arr = colourise_ir(arr)
+    return get_codec(TIERS[tier]).encode(arr).data
+
+
+class DerivedImageCache:
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, workers=1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.files = OrderedDict()  # cache path -> size, least recently used first
+        self.bytes = 0
+        self.current = {}  # (source, tier) -> cache path last derived this run
+        self.hits = 0
+        self.misses = 0
+        self.background = ThreadPoolExecutor(workers)
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                st = os.stat(path)
+                found.append((st.st_atime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self.files[path] = size
+            self.bytes += size
+        self._evict()
+
+    def _cachePath(self, source, tier):
+        st = os.stat(source)
+        key = hashlib.sha1(f"{os.path.abspath(source)}|{st.st_size}|{st.st_mtime_ns}|{tier}".encode()).hexdigest()
+        return os.path.join(self.directory, tier, key[:2], f"{key}.jpg")
+
+    def get(self, source, tier):
+        """Path of source's tier image, deriving it if needed."""
+        if tier not in TIERS:
+            raise ValueError(f"unknown tier {tier!r}, expected one of {sorted(TIERS)}")
+        path = self._cachePath(source, tier)
+        with self.lock:
+            stale = self.current.get((source, tier))
+            self.current[(source, tier)] = path
+            if stale is not None and stale != path:
+                self._remove(stale)
+            if path in self.files:
+                self.files.move_to_end(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+
+        with metrics.timed("derive"):
+            data = derive(source, tier)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self.lock:
+            if path not in self.files:
+                self.files[path] = len(data)
+                self.bytes += len(data)
+            self._evict(keep=path)
+        return path
+
+    def prefetch(self, source, tiers=tuple(TIERS)):
+        """Derive source's tiers on the background thread; returns the futures."""
+        return [self.background.submit(self._prefetchOne, source, tier) for tier in tiers]
+
+    def _prefetchOne(self, source, tier):
+        try:
+            return self.get(source, tier)
+        except (OSError, ValueError) as err:
+            print(f"Error: couldn't derive {tier} of {source}: '{err}'")
+
+    def invalidate(self, source):
+        """Drop every derived image of source."""
+        with self.lock:
+            for tier in TIERS:
+                path = self.current.pop((source, tier), None)
+                if path is not None:
+                    self._remove(path)
+
+    def _remove(self, path):
+        size = self.files.pop(path, None)
+        if size is not None:
+            self.bytes -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep=None):
+        while self.bytes > self.max_bytes and self.files:
+            path = next(iter(self.files))
+            if path == keep:
+                if len(self.files) == 1:
+                    return
+                self.files.move_to_end(path)
+                continue
+            self._remove(path)
+
+    def close(self):
+        self.background.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive thumbnails and IR views of stored images")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--cache-dir", default=os.path.join("..", "server_hd", "derived"))
+    parser.add_argument("--tiers", nargs="*", choices=sorted(TIERS), default=sorted(TIERS))
+    parser.add_argument("--max-mb", type=float, default=512)
+    args = parser.parse_args()
+
+    cache = DerivedImageCache(args.cache_dir, int(args.max_mb * 1e6))
+    start = time.perf_counter()
+    for image in args.images:
+        for tier in args.tiers:
+            print(f"{image} {tier}: {cache.get(image, tier)}")
+    print(f"{cache.misses} derived, {cache.hits} cached in {time.perf_counter() - start:.2f} s, {cache.bytes / 1e6:.1f} MB")
+    cache.close()
@@ -0,0 +1,162 @@
+##########################################
+# Content-addressed image store
+##########################################
+#
+#   <root>/ab/cd/abcd...ef.png     blobs, named by a hash of their bytes
+#   <root>/index.sqlite            image_records path -> blob
+#
+# Every image is written once under its hash, two levels of 256 shard
+# directories deep, so directories stay small however many images the
+# archive holds and identical images are stored once. Blobs are written to
+# a temp file and renamed into place; BlobStore.sync() fsyncs a DB batch's
+# worth of them in one go.
+#
+# BlobStore only touches files, so the capture pipeline's worker processes
+# use it directly. ImageIndex is owned by the receiving process: it gives
+# each image a unique image_records path (what used to be the flat
+# server_hd/{type}_images file name) and maps it to the blob, so two
+# captures with the same coordinates and date no longer overwrite each
+# other.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+INDEX_NAME = "index.sqlite"
+DIGEST_SIZE = 20
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, blob):
+        return os.path.join(self.root, blob)
+
+    def put(self, data, ext):
+        """Store data unless already there; returns its blob name ("ab/cd/<hash>.<ext>")."""
+        digest = hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+        blob = f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+        path = self.path(blob)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return blob
+
+    def sync(self, blobs):
+        """fsync the blobs and the directories holding them."""
+        dirs = set()
+        for blob in set(blobs):
+            path = self.path(blob)
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            shard = os.path.dirname(path)
+            dirs.update((shard, os.path.dirname(shard)))
+        if dirs:
+            dirs.add(self.root)
+        for d in dirs:
+            fd = os.open(d, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+class ImageIndex:
+    """sqlite map of image_records path -> blob, shared between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, blob TEXT NOT NULL, added REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def add(self, name, blob):
+        """Map name to blob; returns the name used, suffixed if name is taken by another blob."""
+        stem, dot, ext = name.rpartition(".")
+        if not dot:
+            stem, ext = name, ""
+        candidate = name
+        n = 1
+        with self.lock:
+            while True:
+                row = self.db.execute("SELECT blob FROM images WHERE name = ?", (candidate,)).fetchone()
+                if row is None:
+                    self.db.execute("INSERT INTO images VALUES (?, ?, ?)", (candidate, blob, time.time()))
+                    return candidate
+                if row[0] == blob:
+                    return candidate
+                candidate = f"{stem}-{n}{dot}{ext}"
+                n += 1
+
+    def resolve(self, name):
+        """Blob of an image_records path, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT blob FROM images WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class ImageStore:
+    """BlobStore and ImageIndex under one root, for the receiving process."""
+
+    def __init__(self, root):
+        self.blobs = BlobStore(root)
+        self.index = ImageIndex(os.path.join(root, INDEX_NAME))
+        self.unsynced = []
+        self.lock = threading.Lock()
+
+    def add(self, name, blob):
+        """Record a blob a worker wrote under name; returns its image_records path."""
+        with self.lock:
+            self.unsynced.append(blob)
+        return self.index.add(name, blob)
+
+    def open(self, name):
+        """File object of an image_records path."""
+        blob = self.index.resolve(name)
+        if blob is None:
+            raise FileNotFoundError(name)
+        return open(self.blobs.path(blob), "rb")
+
+    def sync(self):
+        """Make everything added so far durable: one fsync pass and index commit."""
+        with self.lock:
+            blobs, self.unsynced = self.unsynced, []
+        try:
+            self.blobs.sync(blobs)
+            self.index.commit()
+        except BaseException:
+            # still unsynced, the next sync tries them again
+            with self.lock:
+                self.unsynced = blobs + self.unsynced
+            raise
+
+    def close(self):
+        self.sync()
+        self.index.close()
@@ -0,0 +1,86 @@
+##########################################
+# Grid index for snapping GPS fixes to known locations
+##########################################
+#
+# Fixes are hashed into lat/lon cells one snap radius tall and wide (in
+# degrees of latitude), so the nearest location within the radius is always
+# in the block of cells around a fix: 3 cells of latitude by
+# 2 * ceil(1 / cos(lat)) + 1 of longitude. Lookups and inserts are O(1)
+# however many locations there are.
+#
+# The DB side of the lookup is a bounding box query; give it an index with
+#   CREATE INDEX locations_lat_lon ON locations (lat, lon);
+
+import math
+
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEG = math.pi * EARTH_RADIUS_M / 180
+DEFAULT_RADIUS_M = 5.0
+
+
+def distance_m(lon1, lat1, lon2, lat2):
+    """Haversine distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lon, lat, radius_m):
+    """(lon_min, lon_max, lat_min, lat_max) containing the radius around a fix."""
+    dlat = radius_m / METRES_PER_DEG
+    dlon = radius_m / (METRES_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+    return lon - dlon, lon + dlon, lat - dlat, lat + dlat
+
+
+class LocationIndex:
+    def __init__(self, radius_m=DEFAULT_RADIUS_M):
+        self.radius_m = radius_m
+        self.cell_deg = radius_m / METRES_PER_DEG
+        self.cells = {}  # (cx, cy) -> [(locID, lon, lat)]
+        self.ids = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, locID):
+        return locID in self.ids
+
+    def copy(self):
+        index = LocationIndex(self.radius_m)
+        index.cells = {cell: list(bucket) for cell, bucket in self.cells.items()}
+        index.ids = set(self.ids)
+        return index
+
+    def relabel(self, mapping):
+        """Replace locIDs in place, e.g. placeholders with inserted IDs."""
+        for bucket in self.cells.values():
+            bucket[:] = [(mapping.get(i, i), lon, lat) for i, lon, lat in bucket]
+        self.ids = {mapping.get(i, i) for i in self.ids}
+
+    def _cell(self, lon, lat):
+        return math.floor(lon / self.cell_deg), math.floor(lat / self.cell_deg)
+
+    def add(self, locID, lon, lat):
+        self.cells.setdefault(self._cell(lon, lat), []).append((locID, lon, lat))
+        self.ids.add(locID)
+
+    def nearest(self, lon, lat):
+        """(locID, distance_m) of the closest location within the radius, or None."""
+        cx, cy = self._cell(lon, lat)
+        # a degree of longitude is cos(lat) times shorter than one of latitude
+        reach = math.ceil(1 / max(math.cos(math.radians(abs(lat) + self.cell_deg)), 1e-6))
+        best = None
+        for dx in range(-reach, reach + 1):
+            for dy in (-1, 0, 1):
+                for locID, other_lon, other_lat in self.cells.get((cx + dx, cy + dy), ()):
+                    d = distance_m(lon, lat, other_lon, other_lat)
+                    if d <= self.radius_m and (best is None or d < best[1]):
+                        best = (locID, d)
+        return best
+
+    def snap(self, lon, lat):
+        """locID of the closest location within the radius, or None."""
+        hit = self.nearest(lon, lat)
+        return hit[0] if hit else None
@@ -0,0 +1,270 @@
+##########################################
+# Per-stage latency histograms and counters
+##########################################
+#
+#   with metrics.timed("detect"):
+#       hotspots = extract_hotspots(ir)
+#   metrics.count("bytes", frame.nbytes, stage="receive")
+#
+# Stage timings go into the firefly_stage_seconds histogram, labelled by
+# stage (receive, decode, detect, encode, disk_write, db_write,
+# http_upload, ...). The registry renders as JSON or Prometheus text, can be
+# written to a file or served over HTTP (serve_metrics).
+#
+# Worker processes have their own memory, so code running in one records
+# into a fresh registry with `with metrics.recording() as local:` and hands
+# local.snapshot() back to the parent, which merge()s it.
+#
+# FlightProfiler is the opt-in cProfile mode: one .prof file per flight.
+
+import contextlib
+import cProfile
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "firefly"
+STAGE_SECONDS = "stage_seconds"
+
+# 0.25 ms to ~65 s, doubling
+DEFAULT_BUCKETS = tuple(0.00025 * 2**i for i in range(19))
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return None
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for bound, n in zip(self.buckets + (math.inf,), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    def merge(self, snapshot):
+        if tuple(snapshot["buckets"]) != self.buckets:
+            raise ValueError("histogram buckets differ")
+        self.counts = [a + b for a, b in zip(self.counts, snapshot["counts"])]
+        self.sum += snapshot["sum"]
+        self.count += snapshot["count"]
+
+
+class Registry:
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, n=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(STAGE_SECONDS, time.perf_counter() - start, stage=stage)
+
+    def snapshot(self):
+        """Plain dict of everything recorded, see merge()."""
+        with self.lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **h.snapshot()}
+                    for (name, labels), h in sorted(self.histograms.items())
+                ],
+            }
+
+    def merge(self, snapshot):
+        """Add another registry's snapshot (e.g. from a worker process) into this one."""
+        for c in snapshot["counters"]:
+            self.count(c["name"], c["value"], **c["labels"])
+        with self.lock:
+            for h in snapshot["histograms"]:
+                key = _key(h["name"], h["labels"])
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(h["buckets"])
+                self.histograms[key].merge(h)
+
+    def summary(self):
+        """Snapshot with count/mean/p50/p95 per histogram instead of buckets, for people."""
+        snapshot = self.snapshot()
+        with self.lock:
+            for h in snapshot["histograms"]:
+                hist = self.histograms[_key(h["name"], h["labels"])]
+                for field in ("buckets", "counts"):
+                    del h[field]
+                h["mean"] = h["sum"] / h["count"] if h["count"] else None
+                h["p50"] = hist.quantile(0.5)
+                h["p95"] = hist.quantile(0.95)
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self):
+        lines = []
+
+        def labels_text(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                full = f"{self.prefix}_{name}_total"
+                if full not in typed:
+                    lines.append(f"# TYPE {full} counter")
+                    typed.add(full)
+                lines.append(f"{full}{labels_text(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                full = f"{self.prefix}_{name}"
+                if full not in typed:
+                    lines.append(f"# TYPE {full} histogram")
+                    typed.add(full)
+                cumulative = 0
+                for bound, n in zip(h.buckets + (math.inf,), h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f"{full}_bucket{labels_text(labels, le=le)} {cumulative}")
+                lines.append(f"{full}_sum{labels_text(labels)} {h.sum}")
+                lines.append(f"{full}_count{labels_text(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write to path, Prometheus text for a .prom file and JSON otherwise."""
+        text = self.to_prometheus() if str(path).endswith(".prom") else self.to_json()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+_local = threading.local()
+
+
+def current():
+    """The registry recording on this thread: a recording() one, or REGISTRY."""
+    return getattr(_local, "registry", None) or REGISTRY
+
+
+@contextlib.contextmanager
+def recording():
+    """Record into a fresh registry on this thread for the duration."""
+    previous = getattr(_local, "registry", None)
+    _local.registry = Registry()
+    try:
+        yield _local.registry
+    finally:
+        _local.registry = previous
+
+
+def timed(stage):
+    return current().timed(stage)
+
+
+def count(name, n=1, **labels):
+    current().count(name, n, **labels)
+
+
+def observe(name, value, **labels):
+    current().observe(name, value, **labels)
+
+
+def serve_metrics(port, registry=REGISTRY, host="0.0.0.0"):
+    """Serve /metrics (Prometheus text) and /metrics.json on a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = registry.to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FlightProfiler:
+    """cProfile of the calling thread, one <directory>/flight_<n>.prof per flight.
+
+    Disabled (every call a no-op) when directory is None.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.profile = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self.directory and self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self, flight):
+        if self.profile is None:
+            return None
+        self.profile.disable()
+        path = os.path.join(self.directory, f"flight_{flight}.prof")
+        self.profile.dump_stats(path)
+        self.profile = None
+        print(f"profile of flight {flight} written to {path}")
+        return path
@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+class CapturePipeline:
+    """Receive -> worker processes -> single persistence stage.
+
+    The receive loop calls submit() with each completed capture. `process`
+    (a picklable, module level function) runs in a pool of worker processes
+    and its result is passed to `persist` on one dedicated thread, in the
+    order the captures were submitted, so the DB connection is never shared.
+
+    At most `max_pending` captures are in flight; submit() blocks once the
+    workers fall that far behind, which in turn stops the socket being read.
+
+    Workers are started by a forkserver rather than forked from the server:
+    the pool starts them lazily, by which time the server holds drone
+    sockets, and a forked worker would keep its copies of those open after
+    the server closes them.
+    """
+
+    def __init__(self, process, persist, workers=None, max_pending=None, mp_context=None):
+        self.process = process
+        self.persist = persist
+        workers = workers or os.cpu_count() or 1
+        mp_context = mp_context or multiprocessing.get_context("forkserver")
+        self.pool = ProcessPoolExecutor(workers, mp_context=mp_context)
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * workers)
+        self.results = queue.Queue()
+
+        self.persister = threading.Thread(target=self._persistLoop, daemon=True)
+        self.persister.start()
+
+    def submit(self, capture, context=None):
+        """Queue a capture; returns a Future that resolves once it is persisted.
+
+        `context` (e.g. the flight number) is handed to persist with the result.
+        """
+        self.slots.acquire()
+        try:
+            processed = self.pool.submit(self.process, capture)
+        except BaseException:
+            self.slots.release()
+            raise
+        persisted = Future()
+        self.results.put((processed, context, persisted))
+        return persisted
+
+    def _persistLoop(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                self.results.task_done()
+                return
+
+            processed, context, persisted = item
+            try:
+                persisted.set_result(self.persist(processed.result(), context))
+            except Exception as err:
+                print(f"Error: failed to process capture: '{err}'")
+                traceback.print_exc()
+                persisted.set_exception(err)
+            finally:
+                self.slots.release()
+                self.results.task_done()
+
+    def drain(self):
+        """Block until every submitted capture has been persisted."""
+        self.results.join()
+
+    def close(self):
+        self.drain()
+        self.results.put(None)
+        self.persister.join()
+        self.pool.shutdown()
@@ -0,0 +1,11 @@
+import benchmark
+
+
+def test_benchmarks_run():
+    # every benchmark on a few small captures, so one can't break unnoticed
+    ir, rgb = benchmark.load_test_data(camera_res=(64, 48))
+    ir, rgb = ir[:3], rgb[:3]
+    for name, fn in benchmark.BENCHMARKS.items():
+        result = benchmark.run_one(fn, ir, rgb, repeat=1)
+        assert result["frames"] == 3, name
+        assert result["kb_per_frame"] > 0, name
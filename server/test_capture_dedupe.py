@@ -0,0 +1,42 @@
+from concurrent.futures import Future
+
+import numpy as np
+
+from capture_dedupe import IngestLedger, ResultCache, capture_hash
+
+
+def test_capture_hash():
+    ir = np.arange(24 * 32, dtype=np.float64).reshape(24, 32)
+    capture = [ir, np.zeros((4, 4, 3), dtype=np.uint8), np.array([-80.5, 43.4])]
+    assert capture_hash(capture) == capture_hash([a.copy() for a in capture])
+    # same bytes, different shape
+    assert capture_hash(capture) != capture_hash([ir.reshape(32, 24)] + capture[1:])
+
+
+def test_ledger_reopen(tmp_path):
+    ledger = IngestLedger(str(tmp_path / "ingested.log"))
+    ledger.add([("a" * 32, 1), (None, 1), ("b" * 32, 2)])
+    ledger.close()
+
+    ledger = IngestLedger(str(tmp_path / "ingested.log"))
+    try:
+        assert len(ledger) == 2
+        assert "a" * 32 in ledger and "c" * 32 not in ledger
+    finally:
+        ledger.close()
+
+
+def test_result_cache_forgets_failures():
+    cache = ResultCache(max_entries=2)
+    failed = Future()
+    failed.set_exception(OSError("disk full"))
+    cache.put("failed", failed)
+    assert cache.get("failed") is None
+    assert len(cache) == 0
+
+    futures = [Future() for _ in range(3)]
+    for i, future in enumerate(futures):
+        cache.put(i, future)
+    # the least recently used is evicted
+    assert cache.get(0) is None
+    assert cache.get(2) is futures[2]
@@ -0,0 +1,137 @@
+import contextlib
+
+from db_writer import BatchedWriter
+
+
+class FakeDB:
+    # just enough of the locations table for BatchedWriter; found=False
+    # makes inserted locations invisible to the lookups that follow
+    def __init__(self, found=True):
+        self.found = found
+        self.locations = []  # [(locID, lon, lat)]
+        self.records = []
+        self.commits = 0
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, args=()):
+        rows = self.db.locations if self.db.found else []
+        if "IN (" in query:
+            wanted = set(zip(args[::2], args[1::2]))
+            self.rows = [row for row in rows if (row[1], row[2]) in wanted]
+        elif "BETWEEN" in query:
+            lat_min, lat_max, lon_min, lon_max = args
+            self.rows = [row for row in rows if lat_min <= row[2] <= lat_max and lon_min <= row[1] <= lon_max]
+        elif query.startswith("SELECT locID FROM"):
+            self.rows = [(row[0],) for row in rows if (row[1], row[2]) == tuple(args)]
+        else:
+            self.rows = list(rows)
+
+    def executemany(self, query, rows):
+        if "INTO locations" in query:
+            for lon, lat in rows:
+                self.db.locations.append((len(self.db.locations) + 1, lon, lat))
+        elif "INTO image_records" in query:
+            self.db.records.extend(rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.commits += 1
+
+
+class FakePool:
+    def __init__(self, db):
+        self.db = db
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield FakeConnection(self.db)
+
+    @contextlib.contextmanager
+    def cursor(self):
+        yield FakeCursor(self.db)
+
+    def prepare(self, connection, query):
+        return FakeCursor(self.db)
+
+
+def test_missing_inserted_location_keeps_batch_pending():
+    db = FakeDB(found=False)
+    writer = BatchedWriter(FakePool(db))
+    writer.add(-80.5, 43.4, None, "ir.png", "rgb.png", [10], 1)
+    writer.flush()
+    assert db.commits == 0
+    assert len(writer.pending) == 1
+    assert len(writer.locations) == 0
+
+    # the retry succeeds once the location can be read back
+    db.found = True
+    writer.flush()
+    assert db.commits == 1
+    assert not writer.pending
+    assert db.records[0][0] in writer.locations
+
+
+def test_locations_resolved_and_indexed_after_commit():
+    db = FakeDB()
+    db.locations.append((1, -80.5, 43.4))
+    failing = [True]
+
+    def before_commit():
+        if failing[0]:
+            raise OSError("image store unavailable")
+
+    writer = BatchedWriter(FakePool(db), before_commit=before_commit)
+    assert len(writer.locations) == 1
+    # a metre from the known location, then two fixes a metre apart
+    # and far from it, which share one new location
+    writer.add(-80.50001, 43.4, None, "0.png", "0.png", [], 1)
+    writer.add(-80.6, 43.5, None, "1.png", "1.png", [], 1)
+    writer.add(-80.60001, 43.5, None, "2.png", "2.png", [], 1)
+    writer.flush()
+    # nothing committed, so the new location isn't indexed
+    assert len(writer.locations) == 1
+    assert len(writer.pending) == 3
+
+    failing[0] = False
+    writer.flush()
+    assert not writer.pending
+    locIDs = [record[0] for record in db.records]
+    assert locIDs[0] == 1
+    assert locIDs[1] == locIDs[2] != 1
+    assert locIDs[1] in writer.locations
+    assert len(writer.locations) == 2
+
+
+def test_waypoints_and_other_writers_locations():
+    db = FakeDB()
+    writer = BatchedWriter(FakePool(db))
+    writer.seedLocations([(-80.5, 43.4)])
+    assert db.commits == 1
+    assert len(writer.locations) == 1
+    # added by another writer after this one loaded its locations
+    db.locations.append((len(db.locations) + 1, -80.6, 43.5))
+
+    writer.add(-80.50002, 43.40001, None, "0.png", "0.png", [], 1)
+    writer.add(-80.60002, 43.5, None, "1.png", "1.png", [], 1)
+    writer.flush()
+    assert [record[0] for record in db.records] == [1, 2]
+    assert len(db.locations) == 2
+    assert len(writer.locations) == 2
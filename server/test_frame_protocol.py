@@ -0,0 +1,109 @@
+import asyncio
+import socket
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from frame_protocol import (
+    CAPTURE_TYPES,
+    FRAME_END,
+    FRAME_IR,
+    FRAME_RGB,
+    HEADER_SIZE,
+    FrameReceiver,
+    ProtocolError,
+    encode_frame,
+    encode_header,
+    read_frame_async,
+    send_capture,
+    send_end,
+    to_datetime,
+)
+
+WHEN = datetime(2023, 3, 1, 12, 0, 0, 250)
+
+
+def _capture():
+    rng = np.random.default_rng(0)
+    ir = rng.normal(25, 5, (24, 32))
+    # small enough for a whole flight to sit in a socketpair's buffer
+    rgb = rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)
+    gps = np.array([-80.5531, 43.4738])
+    return ir, rgb, gps, np.array([WHEN])
+
+
+def _check(frames):
+    ir, rgb, gps, _ = _capture()
+    assert [frame_type for frame_type, _ in frames] == [*CAPTURE_TYPES, FRAME_END]
+    np.testing.assert_array_equal(frames[0][1], ir)
+    np.testing.assert_array_equal(frames[1][1], rgb)
+    assert frames[1][1].dtype == np.uint8
+    np.testing.assert_array_equal(frames[2][1], gps)
+    assert to_datetime(frames[3][1]) == WHEN
+
+
+def _recvAll(receiver):
+    frames = []
+    while not frames or frames[-1][0] != FRAME_END:
+        frames.append(receiver.recv_frame())
+    return frames
+
+
+async def _readAll(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    frames = []
+    while not frames or frames[-1][0] != FRAME_END:
+        frames.append(await read_frame_async(reader))
+    return frames
+
+
+def _wire(*frames):
+    return b"".join(bytes(header) + bytes(payload) for header, payload in frames)
+
+
+def test_round_trip():
+    server, drone = socket.socketpair()
+    with server, drone:
+        send_capture(drone, *_capture())
+        send_end(drone)
+        _check(_recvAll(FrameReceiver(server)))
+
+
+def test_round_trip_async():
+    frames = [encode_frame(t, arr) for t, arr in zip(CAPTURE_TYPES, _capture())]
+    _check(asyncio.run(_readAll(_wire(*frames) + encode_header(FRAME_END))))
+
+
+def test_disconnect_between_frames_ends_flight():
+    server, drone = socket.socketpair()
+    with server:
+        with drone:
+            send_capture(drone, *_capture())
+        frames = _recvAll(FrameReceiver(server))
+    assert len(frames) == 5
+    assert len(asyncio.run(_readAll(_wire(encode_frame(FRAME_IR, _capture()[0]))))) == 2
+
+
+@pytest.mark.parametrize("cut", [HEADER_SIZE // 2, HEADER_SIZE + 100])
+def test_disconnect_mid_frame(cut):
+    data = _wire(encode_frame(FRAME_RGB, _capture()[1]))[:cut]
+    server, drone = socket.socketpair()
+    with server:
+        with drone:
+            drone.sendall(data)
+        with pytest.raises(ConnectionError):
+            FrameReceiver(server).recv_frame()
+    with pytest.raises(ConnectionError):
+        asyncio.run(_readAll(data))
+
+
+def test_bad_header():
+    header, _ = encode_frame(FRAME_IR, _capture()[0])
+    server, drone = socket.socketpair()
+    with server, drone:
+        drone.sendall(b"XX" + bytes(header[2:]))
+        with pytest.raises(ProtocolError):
+            FrameReceiver(server).recv_frame()
@@ -0,0 +1,31 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_codecs import get_codec
+
+
+def _decode(encoded):
+    return np.asarray(Image.open(io.BytesIO(encoded.data)))
+
+
+def test_png_is_lossless():
+    rng = np.random.default_rng(0)
+    for arr in (rng.integers(0, 255, (24, 32), dtype=np.uint8), rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)):
+        encoded = get_codec("png:1").encode(arr)
+        assert encoded.ext == "png"
+        np.testing.assert_array_equal(_decode(encoded), arr)
+
+
+def test_preview_is_downscaled():
+    arr = np.zeros((720, 1280, 3), dtype=np.uint8)
+    encoded = get_codec("preview:320").encode(arr)
+    assert encoded.ext == "jpg"
+    assert _decode(encoded).shape == (180, 320, 3)
+
+
+def test_bad_spec():
+    with pytest.raises(ValueError):
+        get_codec("gif")
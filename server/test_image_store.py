@@ -0,0 +1,37 @@
+import pytest
+
+from image_store import ImageStore
+
+
+def test_store_and_reopen(tmp_path):
+    store = ImageStore(str(tmp_path))
+    blob = store.blobs.put(b"ir image", "png")
+    assert store.blobs.put(b"ir image", "png") == blob  # stored once
+    other = store.blobs.put(b"another ir image", "png")
+
+    assert store.add("1_2.png", blob) == "1_2.png"
+    assert store.add("1_2.png", blob) == "1_2.png"
+    # same name, different image: kept under its own name
+    assert store.add("1_2.png", other) == "1_2-1.png"
+    store.close()
+
+    store = ImageStore(str(tmp_path))
+    try:
+        with store.open("1_2-1.png") as f:
+            assert f.read() == b"another ir image"
+        with pytest.raises(FileNotFoundError):
+            store.open("3_4.png")
+    finally:
+        store.close()
+
+
+def test_failed_sync_is_retried(tmp_path):
+    store = ImageStore(str(tmp_path))
+    try:
+        store.add("1_2.png", "ab/cd/missing.png")
+        with pytest.raises(FileNotFoundError):
+            store.sync()
+        assert store.unsynced == ["ab/cd/missing.png"]
+    finally:
+        store.unsynced = []
+        store.close()
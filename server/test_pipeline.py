@@ -0,0 +1,91 @@
+import asyncio
+import os
+import socket
+from datetime import datetime
+
+import numpy as np
+
+import uploadNewData
+from capture_dedupe import IngestLedger, ResultCache
+from frame_protocol import FRAME_IR, encode_frame, send_capture, send_end
+from hotspot_history import HotspotHistory
+from metrics import FlightProfiler
+from pipeline import CapturePipeline
+from uploadNewData import DataUploader, processCapture
+
+
+def _uploader(tmp_path):
+    # the parts of DataUploader handleDrone uses, without a db or listening socket
+    uploader = DataUploader.__new__(DataUploader)
+    uploader.flightNum = 1
+    uploader.ledger = IngestLedger(str(tmp_path / "ingested.log"))
+    uploader.results = ResultCache()
+    uploader.imageStore = None
+    uploader.derived = None
+    uploader.history = HotspotHistory()
+    uploader.profiler = FlightProfiler()
+    uploader.metricsFile = None
+    uploader.pipeline = CapturePipeline(processCapture, uploader.persistRecord, workers=2)
+    return uploader
+
+
+def _fly(port, cut_off=False):
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        ir = np.full((24, 32), 25.0)
+        rgb = np.zeros((240, 320, 3), dtype=np.uint8)
+        send_capture(sock, ir, rgb, np.array([-80.5, 43.4]), np.array([datetime.now()]))
+        if cut_off:
+            # the link drops halfway through the next capture's ir frame
+            header, payload = encode_frame(FRAME_IR, ir)
+            sock.sendall(header)
+            sock.sendall(payload[:len(payload) // 2])
+            sock.shutdown(socket.SHUT_WR)
+        else:
+            send_end(sock)
+        sock.settimeout(10)
+        return sock.recv(1)
+
+
+async def _serve(uploader, cut_off=False):
+    server = await asyncio.start_server(uploader.handleDrone, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return await asyncio.to_thread(_fly, port, cut_off)
+
+
+def _serverDirs(tmp_path, monkeypatch):
+    # images are saved under ../server_hd relative to the working directory
+    for kind in ("ir", "rgb"):
+        os.makedirs(tmp_path / "server_hd" / f"{kind}_images")
+    os.makedirs(tmp_path / "cwd")
+    monkeypatch.chdir(tmp_path / "cwd")
+    monkeypatch.setattr(uploadNewData, "DEBUG", 1)
+
+
+def test_drone_sees_eof_after_frame_end(tmp_path, monkeypatch):
+    _serverDirs(tmp_path, monkeypatch)
+
+    uploader = _uploader(tmp_path)
+    try:
+        # the worker processes start on the first capture, while the drone's
+        # connection is open; they must not hold it open after the server closes it
+        assert asyncio.run(_serve(uploader)) == b""
+    finally:
+        uploader.pipeline.close()
+        uploader.ledger.close()
+
+
+def test_partial_capture_dropped_on_disconnect(tmp_path, monkeypatch):
+    _serverDirs(tmp_path, monkeypatch)
+
+    uploader = _uploader(tmp_path)
+    ended = []
+    uploader.reportGrowth = lambda: ended.append(True)
+    try:
+        assert asyncio.run(_serve(uploader, cut_off=True)) == b""
+    finally:
+        uploader.pipeline.close()
+        uploader.ledger.close()
+    # the flight still ends normally and its complete capture is kept
+    assert ended
+    assert len(os.listdir(tmp_path / "server_hd" / "ir_images")) == 1
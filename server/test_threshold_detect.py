@@ -0,0 +1,72 @@
+import numpy as np
+
+from thermal_preprocess import MLX_SHAPE, preprocess, rescale_to_uint8
+from threshold_detect import HOTSPOT_DTYPE, detect_fires_batch, extract_hotspots
+
+
+def test_empty_batch():
+    # e.g. triage of a flight with no captures
+    frames = np.empty((0,) + MLX_SHAPE)
+    assert preprocess(frames).shape == (0,) + MLX_SHAPE
+    assert rescale_to_uint8(frames).shape == (0,) + MLX_SHAPE
+    assert len(detect_fires_batch(frames)) == 0
+    hotspots = extract_hotspots(frames)
+    assert len(hotspots) == 0
+    assert hotspots.dtype == HOTSPOT_DTYPE
+
+
+def _frames():
+    frames = np.full((3,) + MLX_SHAPE, 22.0)
+    # frame 0: two separate spots, one in the corner
+    frames[0, 10:13, 10:14] = 80
+    frames[0, 0:2, 30:32] = 60
+    # frame 1: diagonal neighbours are one spot
+    frames[1, 5, 5] = frames[1, 6, 6] = 90
+    # frame 2: nothing over the threshold
+    frames[2, 12, 12] = 49
+    return frames
+
+
+def test_preprocess_repairs_nan_and_dead_pixel():
+    frames = _frames()
+    frames[0, 3, 3] = np.nan
+    frames[1, 7, 0] = 40
+    before = frames.copy()
+    temps = preprocess(frames)
+    np.testing.assert_array_equal(frames, before)  # inputs are never modified
+    assert not np.isnan(temps).any()
+    # a NaN takes the mean of the rest of its frame
+    valid = np.delete(before[0].ravel(), 3 * 32 + 3)
+    assert np.isclose(temps[0, 3, 3], valid.mean())
+    # the dead pixel (6, 0) takes the mean of its live neighbours
+    assert np.isclose(temps[1, 6, 0], (22 + 40 + 22) / 3)
+
+
+def test_rescale_flat_frame_is_black():
+    out = rescale_to_uint8(np.full((1,) + MLX_SHAPE, 30.0))
+    assert out.dtype == np.uint8
+    assert not out.any()
+
+
+def test_hotspots():
+    frames = _frames()
+    hotspots = extract_hotspots(frames)
+    assert list(hotspots["frame"]) == [0, 0, 1]
+    corner, spot, diagonal = hotspots
+    assert corner["area"] == 4
+    assert (corner["row_min"], corner["row_max"], corner["col_min"], corner["col_max"]) == (0, 1, 30, 31)
+    assert spot["area"] == 12
+    assert (spot["centroid_row"], spot["centroid_col"]) == (11, 11.5)
+    assert spot["peak_temp"] == spot["mean_temp"] == 80
+    assert diagonal["area"] == 2
+
+
+def test_interp_areas_add_up_to_detect_fires():
+    frames = _frames()
+    hotspots = extract_hotspots(frames)
+    counts = detect_fires_batch(frames)
+    assert counts[2] == 0
+    for f, count in enumerate(counts):
+        assert hotspots["interp_area"][hotspots["frame"] == f].sum() == count
+    # the interpolated count is in interpolated pixels, not sensor cells
+    assert (hotspots["interp_area"] > hotspots["area"]).all()
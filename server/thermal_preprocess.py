@@ -0,0 +1,161 @@
+##########################################
+# MLX90640 frame preprocessing, shared by the drone and the server
+##########################################
+#
+#   temps = preprocess(frames, calibration)            # (N, 24, 32) float64
+#   ir_uint8 = rescale_to_uint8(frames, calibration)   # (N, 24, 32) uint8
+#
+# Every frame of a batch gets, in one vectorized pass:
+#   1. the sensor's per-pixel gain/offset correction
+#   2. NaN readings replaced by the frame's mean
+#   3. dead pixels replaced by the mean of their live 4-neighbours
+# and rescale_to_uint8 then stretches each frame's min..max to 0..255.
+#
+# Inputs are never modified. Pass out= (and work= for rescale_to_uint8) to
+# reuse buffers across calls instead of allocating per batch.
+#
+# A Calibration is computed once per sensor from reference captures
+# (Calibration.from_reference) and saved as .npz. Without one, the known
+# dead pixel at (6, 0) is the only correction.
+
+import numpy as np
+
+MLX_SHAPE = (24, 32)  # mlx90640 shape
+DEAD_PIXEL = (6, 0)
+
+# a pixel is dead if it never changes across the reference frames, or its
+# mean sits this many robust standard deviations from the others
+DEAD_SIGMA = 6.0
+
+
+def as_frames(thermal_data):
+    """Anything reshapeable to (N, 24, 32), as a float64 array view or copy."""
+    return np.asarray(thermal_data, dtype=np.float64).reshape((-1,) + MLX_SHAPE)
+
+
+class Calibration:
+    """Per-pixel correction for one sensor: corrected = raw * gain + offset.
+
+    dead_mask, gain and offset are (24, 32) arrays; pixels in dead_mask are
+    interpolated from their neighbours rather than corrected.
+    """
+
+    def __init__(self, dead_mask=None, gain=None, offset=None):
+        if dead_mask is None:
+            dead_mask = np.zeros(MLX_SHAPE, dtype=bool)
+            dead_mask[DEAD_PIXEL] = True
+        self.dead_mask = np.asarray(dead_mask, dtype=bool).reshape(MLX_SHAPE)
+        self.gain = None if gain is None else np.asarray(gain, dtype=np.float64).reshape(MLX_SHAPE)
+        self.offset = None if offset is None else np.asarray(offset, dtype=np.float64).reshape(MLX_SHAPE)
+        self._repairPlan()
+
+    def _repairPlan(self):
+        # for every dead pixel, up to 4 live neighbours (flat indices) and
+        # their weights; padding entries have weight 0
+        rows, cols = np.nonzero(self.dead_mask)
+        self.dead = np.ravel_multi_index((rows, cols), MLX_SHAPE)
+        self.neighbours = np.zeros((len(self.dead), 4), dtype=np.intp)
+        self.weights = np.zeros((len(self.dead), 4))
+        for k, (r, c) in enumerate(zip(rows, cols)):
+            live = [
+                (nr, nc)
+                for nr, nc in ((r, c + 1), (r, c - 1), (r - 1, c), (r + 1, c))
+                if 0 <= nr < MLX_SHAPE[0] and 0 <= nc < MLX_SHAPE[1] and not self.dead_mask[nr, nc]
+            ]
+            for j, (nr, nc) in enumerate(live):
+                self.neighbours[k, j] = nr * MLX_SHAPE[1] + nc
+                self.weights[k, j] = 1 / len(live)
+
+    @classmethod
+    def from_reference(cls, frames, scene_temp=None, hot_frames=None, hot_temp=None, dead_sigma=DEAD_SIGMA):
+        """Calibrate from captures of a uniform scene at scene_temp.
+
+        scene_temp defaults to the median reading, so a single reference
+        flattens the per-pixel offsets without shifting the absolute scale.
+        Captures of a second uniform scene (hot_frames at hot_temp) also fit
+        a per-pixel gain.
+        """
+        frames = as_frames(frames)
+        mean = np.nanmean(frames, axis=0)
+        spread = np.nanstd(frames, axis=0)
+
+        # stuck pixels, and pixels far from the rest (median/MAD so the dead
+        # ones don't skew the estimate)
+        median = np.nanmedian(mean)
+        mad = 1.4826 * np.nanmedian(np.abs(mean - median)) or 1e-9
+        dead = ~np.isfinite(mean) | (np.abs(mean - median) > dead_sigma * mad)
+        if len(frames) > 1:
+            dead |= spread == 0
+
+        if scene_temp is None:
+            scene_temp = float(np.median(mean[~dead]))
+        gain = np.ones(MLX_SHAPE)
+        if hot_frames is not None:
+            hot_mean = np.nanmean(as_frames(hot_frames), axis=0)
+            span = hot_mean - mean
+            dead |= ~np.isfinite(span) | (np.abs(span) < 1e-6)
+            gain = np.where(dead, 1.0, (hot_temp - scene_temp) / np.where(dead, 1.0, span))
+        offset = np.where(dead, 0.0, scene_temp - mean * gain)
+        return cls(dead, gain, offset)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["dead_mask"], data["gain"], data["offset"])
+
+    def save(self, path):
+        gain = np.ones(MLX_SHAPE) if self.gain is None else self.gain
+        offset = np.zeros(MLX_SHAPE) if self.offset is None else self.offset
+        np.savez(path, dead_mask=self.dead_mask, gain=gain, offset=offset)
+
+
+DEFAULT_CALIBRATION = Calibration()
+
+
+def preprocess(thermal_frames, calibration=None, out=None):
+    """Calibrated, NaN- and dead-pixel-repaired (N, 24, 32) float64 temperatures."""
+    calibration = calibration or DEFAULT_CALIBRATION
+    frames = as_frames(thermal_frames)
+    if out is None:
+        out = np.empty(frames.shape)
+    out = out.reshape(frames.shape)
+
+    if calibration.gain is not None:
+        np.multiply(frames, calibration.gain, out=out)
+    else:
+        np.copyto(out, frames)
+    if calibration.offset is not None:
+        out += calibration.offset
+
+    # sized explicitly: -1 can't be inferred for an empty batch
+    flat = out.reshape(len(out), MLX_SHAPE[0] * MLX_SHAPE[1])
+    nan = np.isnan(flat)
+    if nan.any():
+        bad = nan.any(axis=1)
+        valid = np.maximum((~nan[bad]).sum(axis=1), 1)
+        fill = np.where(nan[bad], 0.0, flat[bad]).sum(axis=1) / valid
+        flat[bad] = np.where(nan[bad], fill[:, None], flat[bad])
+
+    if len(calibration.dead):
+        flat[:, calibration.dead] = (flat[:, calibration.neighbours] * calibration.weights).sum(axis=2)
+    return out
+
+
+def rescale_to_uint8(thermal_frames, calibration=None, out=None, work=None):
+    """preprocess(), then each frame's min..max stretched to 0..255 as uint8.
+
+    work is an optional float64 buffer of the batch's size for the
+    intermediate temperatures.
+    """
+    temps = preprocess(thermal_frames, calibration, out=work)
+    if out is None:
+        out = np.empty(temps.shape, dtype=np.uint8)
+    out = out.reshape(temps.shape)
+
+    lo = temps.min(axis=(1, 2), keepdims=True)
+    span = temps.max(axis=(1, 2), keepdims=True) - lo
+    temps -= lo
+    # a flat frame has nothing to stretch and comes out black
+    temps *= 255 / np.where(span > 0, span, np.inf)
+    np.copyto(out, temps, casting="unsafe")
+    return out
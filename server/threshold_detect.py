@@ -1,31 +1,87 @@
+from functools import lru_cache
+
 import numpy as np
-import pandas as pd
 from scipy import ndimage
-import matplotlib.pyplot as plt
 
+from thermal_preprocess import MLX_SHAPE, preprocess
+
+TEMPERATURE_THRESHOLD = 50
+MLX_INTERP_VAL = 10  # interpolate # on each dimension
+
+# max number of candidate rows pushed through the column operator at once
+ROW_CHUNK = 4096
+
+
+@lru_cache(maxsize=None)
+def _interp_operator(n, zoom):
+    """(n * zoom, n) matrix that performs ndimage.zoom along one axis.
+
+    ndimage.zoom's spline interpolation is linear and separable, so zooming a
+    (rows, cols) frame is exactly Ry @ frame @ Rx.T. Building the operators by
+    zooming the unit vectors keeps the counts identical to the original code.
+    """
+    op = np.stack([ndimage.zoom(np.eye(n)[k], zoom) for k in range(n)], axis=1)
+    op.setflags(write=False)
+    return op
+
+
+def detect_fires_batch(thermal_frames, temperature_threshold=TEMPERATURE_THRESHOLD, calibration=None):
+    """Count interpolated pixels over the threshold for a stack of frames.
+
+    Accepts anything reshapeable to (N, 24, 32), e.g. an (N, 768) array, and
+    returns an int64 array of N counts matching detect_fires on each frame.
+    The 240x320 interpolated image is never materialised: frames are first
+    interpolated along the row axis only, and an output row is pushed through
+    the column operator only if a bound on its maximum can reach the threshold.
+    Frames are first corrected with thermal_preprocess.preprocess.
+    """
+    frames = preprocess(thermal_frames, calibration)
+    n_frames = frames.shape[0]
+    counts = np.zeros(n_frames, dtype=np.int64)
+    if n_frames == 0:
+        return counts
+
+    for f, _, over in _over_threshold_rows(frames, temperature_threshold):
+        counts += np.bincount(f, weights=over.sum(axis=1), minlength=n_frames).astype(np.int64)
+    return counts
+
+
+def _over_threshold_rows(frames, temperature_threshold):
+    """Chunks of (frame, row, (chunk, 320) over-threshold mask) of the interpolated rows that can reach the threshold."""
+    ry = _interp_operator(MLX_SHAPE[0], MLX_INTERP_VAL)
+    rx = _interp_operator(MLX_SHAPE[1], MLX_INTERP_VAL)
+
+    # rows of rx sum to 1, so every value in an output row lies within
+    # mid +- gain * half_range of that row's inputs
+    gain = np.abs(rx).sum(axis=1).max()
+
+    rows = np.matmul(ry, frames)  # (N, 240, 32)
+    row_max = rows.max(axis=2)
+    row_min = rows.min(axis=2)
+    bound = (row_max + row_min) / 2 + gain * (row_max - row_min) / 2
+
+    frame_idx, row_idx = np.nonzero(bound > temperature_threshold)
+    for start in range(0, len(frame_idx), ROW_CHUNK):
+        f = frame_idx[start : start + ROW_CHUNK]
+        r = row_idx[start : start + ROW_CHUNK]
+        interp = rows[f, r] @ rx.T  # (chunk, 320)
+        yield f, r, interp > temperature_threshold
 
-def detect_fires(thermal_data):
-    temperature_threshold = 50
-    thermal_data[6][0] = (
-        thermal_data[6][1] + thermal_data[5][0] + thermal_data[7][0]
-    ) / 3
-    mlx_shape = (24, 32)  # mlx90640 shape
 
-    mlx_interp_val = 10  # interpolate # on each dimension
-    mlx_interp_shape = (
-        mlx_shape[0] * mlx_interp_val,
-        mlx_shape[1] * mlx_interp_val,
-    )  # new shape
+def interpolate_frame(thermal_data, calibration=None):
+    """Full 240x320 interpolated (and mirrored) frame, for plotting only."""
+    frame = preprocess(thermal_data, calibration)[0]
+    ry = _interp_operator(MLX_SHAPE[0], MLX_INTERP_VAL)
+    rx = _interp_operator(MLX_SHAPE[1], MLX_INTERP_VAL)
+    return np.flipud(ry @ frame @ rx.T)  # mirror image
 
-    data_array = np.reshape(thermal_data, mlx_shape)  # reshape
-    # data_array = np.fliplr()  # flip data
-    data_array = np.flipud(data_array)  # mirror image
-    data_array = ndimage.zoom(data_array, mlx_interp_val)  # interpolate
 
-    num_over_thresh = np.count_nonzero(data_array > temperature_threshold)
-    return num_over_thresh
+def detect_fires(thermal_data, calibration=None):
+    return int(detect_fires_batch(thermal_data, calibration=calibration)[0])
 
     # Uncomment if you want to plot IR data
+    # import matplotlib.pyplot as plt
+    # data_array = interpolate_frame(thermal_data)
     # plt.imshow(
     #     data_array,
     #     interpolation="none",
@@ -35,4 +91,97 @@ def detect_fires(thermal_data):
     # )
     # plt.colorbar()  # setup colorbar
     # # plt.set_label("Temperature [$^{\circ}$C]", fontsize=14)  # colorbar label
-    # plt.show()
\ No newline at end of file
+    # plt.show()
+
+
+HOTSPOT_DTYPE = np.dtype(
+    [
+        ("frame", np.int64),
+        ("area", np.int64),
+        ("centroid_row", np.float64),
+        ("centroid_col", np.float64),
+        ("row_min", np.int64),
+        ("row_max", np.int64),
+        ("col_min", np.int64),
+        ("col_max", np.int64),
+        ("peak_temp", np.float64),
+        ("mean_temp", np.float64),
+        ("interp_area", np.int64),
+    ]
+)
+
+# 8-connected within a frame, never connected across frames
+_HOTSPOT_STRUCTURE = np.zeros((3, 3, 3), dtype=bool)
+_HOTSPOT_STRUCTURE[1] = True
+
+
+def extract_hotspots(thermal_frames, temperature_threshold=TEMPERATURE_THRESHOLD, calibration=None):
+    """Label connected over-threshold regions on the 24x32 sensor grid.
+
+    Returns a HOTSPOT_DTYPE record array with one entry per region, sorted by
+    frame then label. Coordinates are sensor (row, col) indices, before the
+    vertical mirror applied for display. The whole batch is labelled in one
+    pass and the per-region statistics are reduced without a Python loop.
+
+    interp_area is the region's share of detect_fires' count: every
+    over-threshold pixel of the interpolated frame goes to the region
+    nearest its sensor cell, so a frame's interp_areas add up to
+    detect_fires on it (the size unit the hotspots table has always used).
+    """
+    frames = preprocess(thermal_frames, calibration)
+    labels, n_regions = ndimage.label(
+        frames > temperature_threshold, structure=_HOTSPOT_STRUCTURE
+    )
+    hotspots = np.zeros(n_regions, dtype=HOTSPOT_DTYPE)
+    if n_regions == 0:
+        return hotspots
+
+    # gather the labelled pixels grouped by region so every statistic is a
+    # single reduceat over contiguous runs
+    flat_labels = labels.ravel()
+    pixels = np.flatnonzero(flat_labels)
+    pixels = pixels[np.argsort(flat_labels[pixels], kind="stable")]
+    starts = np.searchsorted(flat_labels[pixels], np.arange(1, n_regions + 1))
+
+    frame_idx, row_idx, col_idx = np.unravel_index(pixels, frames.shape)
+    temps = frames.ravel()[pixels]
+    area = np.diff(np.append(starts, len(pixels)))
+
+    hotspots["frame"] = frame_idx[starts]
+    hotspots["area"] = area
+    hotspots["centroid_row"] = np.add.reduceat(row_idx, starts) / area
+    hotspots["centroid_col"] = np.add.reduceat(col_idx, starts) / area
+    hotspots["row_min"] = np.minimum.reduceat(row_idx, starts)
+    hotspots["row_max"] = np.maximum.reduceat(row_idx, starts)
+    hotspots["col_min"] = np.minimum.reduceat(col_idx, starts)
+    hotspots["col_max"] = np.maximum.reduceat(col_idx, starts)
+    hotspots["peak_temp"] = np.maximum.reduceat(temps, starts)
+    hotspots["mean_temp"] = np.add.reduceat(temps, starts) / area
+    hotspots["interp_area"] = _interp_areas(frames, labels, np.unique(hotspots["frame"]), temperature_threshold, n_regions)
+    return hotspots
+
+
+@lru_cache(maxsize=None)
+def _nearest_cell(n, zoom):
+    # sensor index each interpolated index is closest to, as ndimage.zoom
+    # lines them up (the ends of both grids coincide)
+    out = n * zoom
+    return np.rint(np.arange(out) * (n - 1) / (out - 1)).astype(np.intp)
+
+
+def _interp_areas(frames, labels, hot, temperature_threshold, n_regions):
+    """Over-threshold interpolated pixels per region label, for the frames in hot."""
+    # nearest labelled cell of every sensor cell, never across frames
+    hot_labels = labels[hot]
+    _, (f, r, c) = ndimage.distance_transform_edt(
+        hot_labels == 0, sampling=(1e6, 1, 1), return_indices=True
+    )
+    nearest = hot_labels[f, r, c]
+    rows = _nearest_cell(MLX_SHAPE[0], MLX_INTERP_VAL)
+    cols = _nearest_cell(MLX_SHAPE[1], MLX_INTERP_VAL)
+
+    areas = np.zeros(n_regions + 1, dtype=np.int64)
+    for f, r, over in _over_threshold_rows(frames[hot], temperature_threshold):
+        row_labels = nearest[f, rows[r]][:, cols]  # (chunk, 320)
+        areas += np.bincount(row_labels[over], minlength=n_regions + 1)
+    return areas[1:]
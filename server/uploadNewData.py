@@ -1,40 +1,65 @@
 import re
 from xml.sax.handler import property_encoding
 import pandas as pd
+import argparse
+import asyncio
 import socket
 import numpy as np
 from io import BytesIO
 import logging
-import io
-from PIL import Image
 import datetime
 import os
+from concurrent.futures import Future
+from functools import partial
 from pathlib import Path
 
-from db_util import create_db_connection, execute_query, read_query, getFlightNum
-from threshold_detect import detect_fires
+from db_util import ConnectionPool, getFlightNum
+from db_writer import BatchedWriter
+from hotspot_history import HotspotHistory
+from capture_dedupe import IngestLedger, ResultCache, capture_hash
+from image_pyramid import DerivedImageCache
+from image_store import BlobStore, ImageStore
+from location_index import DEFAULT_RADIUS_M
+from threshold_detect import extract_hotspots
+from thermal_preprocess import Calibration
+from pipeline import CapturePipeline
+import metrics
+from metrics import FlightProfiler
+from frame_protocol import (
+    CAPTURE_TYPES,
+    FRAME_END,
+    FRAME_NAMES,
+    FrameReceiver,
+    read_frame_async,
+    to_datetime,
+)
+
+from waypoints import load_gps
+from image_codecs import get_codec
 
 
 DEBUG = 0
 
+# hashes of captures committed to the db, under server_hd
+INGEST_LEDGER = "ingested.log"
+
 
 class DataUploader:
-    def __init__(self):
+    def __init__(self, serve_async=False, db_pool_size=4, waypoints=None, snap_radius=DEFAULT_RADIUS_M,
+                 ir_codec="png", rgb_codec="png", metrics_port=None, metrics_file=None, profile_dir=None,
+                 calibration=None, derived_dir=None, derived_max_mb=512, image_store=None):
         self.server_addr = "192.168.10.43"
         self.main_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_addr = 0
         self.client_conn = 0
-        self.socket_buffer_size = 1024
         self.mlx_shape = (32, 24)
         self.rgb_shape = (240, 320, 3)
         self.frameCount = 1
 
-        self.frameBuffer = bytearray()
-        self.states = ["ir", "rgb", "gps", "time"]
-        self.currState = 0
+        self.receiver = None
+        self.capture = {}
 
         self.allData = []
-        self.tempList = []
 
         self.rgb_folder_path = r"..\server_hd\rgb_images"
         self.ir_folder_path = r"..\server_hd\ir_images"
@@ -44,17 +69,101 @@ class DataUploader:
 
         self.flightNum = 1
 
+        # captures are recognised by content hash so a drone's retries are
+        # neither reprocessed nor written twice (see capture_dedupe); the
+        # cache outlasts a writer batch, so uncommitted captures stay in it
+        os.makedirs(os.path.join("..", "server_hd"), exist_ok=True)
+        self.ledger = IngestLedger(os.path.join("..", "server_hd", INGEST_LEDGER))
+        self.results = ResultCache()
+
+        # with image_store, images go to a content-addressed store (see
+        # image_store) instead of the flat server_hd/{type}_images folders
+        self.imageStore = ImageStore(image_store) if image_store else None
+
+        # thumbnails and the colourised ir view are made in the background
+        # as captures are stored, for pages browsing flights
+        self.derived = None
+        if derived_dir:
+            self.derived = DerivedImageCache(derived_dir, int(derived_max_mb * 1e6))
+
         self.pw = "superwoofer123"
+        # hotspot sizes per location over recent flights, kept current by
+        # the writer so growth checks don't query the hotspots table
+        self.history = HotspotHistory()
         if not DEBUG:
-            self.sqlConn = create_db_connection(
-                "localhost", "root", self.pw, "firefly_db"
+            # shared by the persistence thread and end-of-flight flushes;
+            # connections are health checked and reconnected when borrowed
+            self.sqlPool = ConnectionPool(
+                "localhost", "root", self.pw, "firefly_db", size=db_pool_size
+            )
+            self.flightNum = getFlightNum(self.sqlPool)
+            self.history.load(self.sqlPool)
+            # captures snap to known locations (and planned waypoints)
+            # within snap_radius metres instead of needing an exact match
+            # every batch's images are made durable (and indexed) before the
+            # records pointing at them commit, mid-flight batches included
+            self.dbWriter = BatchedWriter(
+                self.sqlPool, snap_radius_m=snap_radius, history=self.history, ledger=self.ledger,
+                before_commit=self.imageStore.sync if self.imageStore else None,
             )
-            self.flightNum = getFlightNum(self.sqlConn)
+            if waypoints:
+                # waypoint files list (lat, lon)
+                self.dbWriter.seedLocations([(lon, lat) for lat, lon in load_gps(waypoints)])
 
         print(f"flight num: {self.flightNum}")
 
-        self.startServer()
-        self.acceptDroneConnections()
+        # per-stage timings and counters (see metrics), served and/or
+        # written after every flight; cProfile per flight when profile_dir
+        self.metricsFile = metrics_file
+        if metrics_port:
+            metrics.serve_metrics(metrics_port)
+        self.profiler = FlightProfiler(profile_dir)
+
+        # png encoding and detection run in worker processes while the
+        # socket keeps being read; results are written to the db in order
+        # images are stored with the ir/rgb codec tiers (see image_codecs)
+        # and detection uses the drone's sensor calibration, if given
+        get_codec(ir_codec), get_codec(rgb_codec)  # fail on a bad spec before serving
+        calibration = Calibration.load(calibration) if calibration else None
+        self.pipeline = CapturePipeline(
+            partial(processCapture, ir_codec=ir_codec, rgb_codec=rgb_codec, calibration=calibration, blob_root=image_store),
+            self.persistRecord,
+        )
+
+        try:
+            if serve_async:
+                asyncio.run(self.serveAsync())
+            else:
+                self.startServer()
+                self.acceptDroneConnections()
+        finally:
+            # don't lose the last partial batch on shutdown
+            self.pipeline.close()
+            self.flushDB()
+            if not DEBUG:
+                self.sqlPool.close()
+            self.ledger.close()
+            if self.imageStore:
+                self.imageStore.close()
+            if self.derived:
+                self.derived.close()
+            self.writeMetrics()
+
+    def flushDB(self):
+        # the writer syncs the image store before committing
+        if not DEBUG:
+            self.dbWriter.flush()
+        elif self.imageStore:
+            self.imageStore.sync()
+
+    def reportGrowth(self, limit=10):
+        for locID, growth in self.history.growingLocations(limit):
+            sizes = [h.total_size for h in self.history.latest(locID, 3)]
+            print(f"hotspots growing at location {locID}: +{growth} px (latest flights: {sizes})")
+
+    def writeMetrics(self):
+        if self.metricsFile:
+            metrics.REGISTRY.write(self.metricsFile)
 
     def startServer(self):
         host=socket.gethostname()
@@ -73,11 +182,12 @@ class DataUploader:
             print("waiting for a connection")
             self.client_conn, self.client_addr = self.main_socket.accept()
             print(f"connected to: {self.client_addr[0]}")
+            self.receiver = FrameReceiver(self.client_conn)
 
             while True:
                 self.receiveFrame()
                 if self.closeSocketFlag:
-                    self.frameBuffer = bytearray()
+                    self.capture = {}
                     break
 
             acceptedCount += 1
@@ -87,134 +197,294 @@ class DataUploader:
                 break
 
     def receiveFrame(self):
-        bufferToProcess = None
-        length = None
         self.closeSocketFlag = False
 
-        while True:
-            data = self.client_conn.recv(self.socket_buffer_size)
-            if self.frameBuffer == b"e":
-                self.closeSocketFlag = True
-                self.flightNum += 1
-                return
-
-            self.frameBuffer += data
-
-            if length and len(self.frameBuffer) >= length:
-                # if full frame received truncate and proceed to processing
-                bufferToProcess = self.frameBuffer[:length]
-                self.frameBuffer = self.frameBuffer[length:]
-                # print("received full frame... breaking out")
-                break
-
-            if length is None:
-                # havent gotten a packet yet
-                if b":" in self.frameBuffer:
-                    # this packet is the first one in the msg
-                    # remove the length bytes from the front of frameBuffer
-                    # leave any remaining bytes in the frameBuffer!
-                    length_str, _, self.frameBuffer = self.frameBuffer.partition(b":")
-                    length = int(length_str)
-                    print(f"length of {self.states[self.currState]}: {length}")
-
-                    # the message is entirely in this packet, therefore cut off remaining bytes
-                    if len(self.frameBuffer) > length:
-                        # split off the full message from the remaining bytes
-                        # leave any remaining bytes in the frameBuffer!
-                        bufferToProcess = self.frameBuffer[:length]
-                        self.frameBuffer = self.frameBuffer[length:]
-                        self.length = None
-                        # break out of receiving loop and start processing
-                        # print("frame smaller than buffer")
-                        break
-                else:
-                    # print(len(self.frameBuffer))
-                    continue
-
-        # print(f"final length of frameBuffer: {len(bufferToProcess)}")
-        frame = np.load(io.BytesIO(bufferToProcess), allow_pickle=True)["frame"]
-        self.saveFrame(frame)
-
-    def saveFrame(self, frame):
+        self.profiler.start()
+        with metrics.timed("receive"):
+            frame_type, frame = self.receiver.recv_frame()
+        if frame_type == FRAME_END:
+            print(f"end of flight {self.flightNum}, waiting for processing to finish")
+            self.pipeline.drain()
+            self.flushDB()
+            self.reportGrowth()
+            self.profiler.stop(self.flightNum)
+            self.writeMetrics()
+            self.closeSocketFlag = True
+            self.flightNum += 1
+            return
+
+        metrics.count("frames", stage="receive")
+        metrics.count("bytes", frame.nbytes, stage="receive")
+        print(f"length of {FRAME_NAMES[frame_type]}: {frame.nbytes}")
+        self.saveFrame(frame_type, frame)
+
+    def saveFrame(self, frame_type, frame):
         print(f"processed incoming frame #{self.frameCount}")
-        print(f"{self.states[self.currState]} frame received")
+        print(f"{FRAME_NAMES[frame_type]} frame received")
         print("")
 
-        self.tempList.append(frame)
+        self.capture[frame_type] = frame
 
-        if self.currState == 3:
-            self.processData(self.tempList)
-            self.allData.append(self.tempList)
-            self.tempList = []
+        if len(self.capture) == len(CAPTURE_TYPES):
+            dataList = [self.capture[t] for t in CAPTURE_TYPES]
+            self.processData(dataList)
+            self.allData.append(dataList)
+            self.capture = {}
             print(f"size of alldata : {len(self.allData)}")
             print("===============================================")
 
-        self.currState = (self.currState + 1) % 4
         self.frameCount += 1
 
     def processData(self, dataList):
         print(f"processing frame #{self.frameCount}")
-        irRaw, rgbRaw, gpsRaw, timeRaw = dataList
-        # ir_data = (np.reshape(irRaw, self.mlx_shape))
-        # rgb_data = (np.reshape(rgbRaw, self.rgb_shape))
-        lon = gpsRaw[0]
-        lat = gpsRaw[1]
-        datetime_object = timeRaw[0]
-        date = datetime_object.strftime("%d-%m-%Y")
-        gps_time_part = f"{lon}_{lat}__{date}"
-
-        # save ir and rgb images as PNGs
-        ir_file_path = self.saveArrToPNG(irRaw, gps_time_part, type="ir")
-        rgb_file_path = self.saveArrToPNG(rgbRaw, gps_time_part, type="rgb")
-
-        size = detect_fires(irRaw)
-
+        self.ingest(dataList, self.flightNum)
+
+    def ingest(self, dataList, flightNum):
+        """Submit a capture unless it was received before; returns a Future of its record.
+
+        The Future of a duplicate is the original's (None if that was
+        persisted by an earlier run).
+        """
+        with metrics.timed("hash"):
+            digest = capture_hash(dataList)
+        if digest in self.ledger:
+            metrics.count("duplicates", stage="ingest")
+            print(f"capture {digest} already stored, skipping")
+            done = Future()
+            done.set_result(None)
+            return done
+        persisted = self.results.get(digest)
+        if persisted is not None:
+            metrics.count("duplicates", stage="ingest")
+            print(f"capture {digest} already received, reusing its result")
+            return persisted
+
+        persisted = self.pipeline.submit(dataList, (flightNum, digest))
+        self.results.put(digest, persisted)
+        return persisted
+
+    def persistRecord(self, result, context):
+        # runs on the pipeline's persistence thread
+        flightNum, digest = context
+        record, stageMetrics, blobs = result
+        metrics.REGISTRY.merge(stageMetrics)
+        ir_file, rgb_file = record[3], record[4]
+        if blobs:
+            # the worker wrote blobs; give them unique image_records paths
+            (ir_name, ir_blob), (rgb_name, rgb_blob) = blobs
+            ir_path = self.imageStore.add(ir_name, ir_blob)
+            rgb_path = self.imageStore.add(rgb_name, rgb_blob)
+            record = record[:3] + (ir_path, rgb_path) + record[5:]
+            ir_file, rgb_file = self.imageStore.blobs.path(ir_blob), self.imageStore.blobs.path(rgb_blob)
         if not DEBUG:
-            self.appendEntryToDB(
-                lon.astype(float),
-                lat.astype(float),
-                datetime_object,
-                str(ir_file_path),
-                str(rgb_file_path),
-                size,
-            )
-
-    def saveArrToPNG(self, rawData, extension, type):
-        file_name = f"{type}_{extension}.png"
+            self.appendEntryToDB(*record, flightNum=flightNum, digest=digest)
+        if self.derived:
+            self.derived.prefetch(ir_file, ("thumb", "ir_color"))
+            self.derived.prefetch(rgb_file, ("thumb", "mid"))
+        return record
+
+    @staticmethod
+    def saveArrToPNG(rawData, extension, type):
+        return DataUploader.saveArr(rawData, extension, type)
+
+    @staticmethod
+    def encodeArr(rawData, codec="png"):
+        codec = get_codec(codec)
+        rawData = np.asarray(rawData)
+        if rawData.dtype != np.uint8:
+            # raw ir temperatures are stored as whole degrees, clipped to 0-255
+            rawData = np.clip(np.nan_to_num(rawData), 0, 255).astype(np.uint8)
+        with metrics.timed("encode"):
+            encoded = codec.encode(rawData)
+        metrics.count("bytes", len(encoded.data), stage="disk_write")
+        print(f"encoded as {codec.spec} ({len(encoded.data) / 1e3:.1f} KB, {1000 * encoded.seconds:.1f} ms)")
+        return encoded
+
+    @staticmethod
+    def saveArr(rawData, extension, type, codec="png"):
+        encoded = DataUploader.encodeArr(rawData, codec)
+        file_name = f"{type}_{extension}.{encoded.ext}"
         file_path = os.path.join("..", "server_hd", f"{type}_images", file_name)
-        im = Image.fromarray(rawData, "L" if type == "ir" else "RGB")
-        im.save(file_path)
-        print(f"saved {type} as png")
+        with metrics.timed("disk_write"):
+            with open(file_path, "wb") as f:
+                f.write(encoded.data)
         return file_path
 
-    def appendEntryToDB(self, lon, lat, date, ir_path, rgb_path, size=-1):
-        print("adding entry to db")
-
-        # check if location exists in locations table
-        query_checkLoc = "SELECT locID FROM locations WHERE lon = %s and lat = %s;"
-        params_checkLoc = (lon, lat)
-        result = read_query(self.sqlConn, query_checkLoc, params_checkLoc)
-
-        # if location does not exist
-        if not result:
-            # make a location record
-            query_addLoc = "INSERT INTO locations (lon, lat) VALUES (%s, %s);"
-            params_addLoc = (lon, lat)
-            execute_query(self.sqlConn, query_addLoc, params_addLoc)
-            result = read_query(self.sqlConn, query_checkLoc, params_checkLoc)
+    @staticmethod
+    def saveArrToStore(rawData, extension, type, store, codec="png"):
+        """(image_records path it asks for, blob) of the image saved in a BlobStore."""
+        encoded = DataUploader.encodeArr(rawData, codec)
+        with metrics.timed("disk_write"):
+            blob = store.put(encoded.data, encoded.ext)
+        return os.path.join(f"{type}_images", f"{type}_{extension}.{encoded.ext}"), blob
 
-        locID = result[0][0]
+    def appendEntryToDB(self, lon, lat, date, ir_path, rgb_path, sizes=(), flightNum=None, digest=None):
+        print("adding entry to db")
+        if flightNum is None:
+            flightNum = self.flightNum
+
+        # buffered, written in bulk when the batch fills or the flight ends
+        self.dbWriter.add(lon, lat, date, ir_path, rgb_path, sizes, flightNum, digest)
+
+    ########## asyncio server ##########
+
+    async def serveAsync(self, port=2022):
+        host = socket.gethostname()
+        server = await asyncio.start_server(self.handleDrone, host, port)
+        print(f"serving drones on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handleDrone(self, reader, writer):
+        session = DroneSession(writer.get_extra_info("peername"), self.flightNum)
+        self.flightNum += 1
+        print(f"connected to: {session.addr[0]} (flight {session.flightNum})")
+        loop = asyncio.get_running_loop()
+        # profiles the event loop thread, so overlapping flights share one
+        self.profiler.start()
+
+        try:
+            while True:
+                try:
+                    with metrics.timed("receive"):
+                        frame_type, frame = await read_frame_async(reader)
+                except ConnectionError as err:
+                    # the captures already complete are still stored
+                    dropped = len(session.capture) + 1
+                    print(f"Error: drone of flight {session.flightNum} disconnected mid-capture ({err}), "
+                          f"dropping its last {dropped} frames")
+                    metrics.count("dropped_frames", dropped, stage="receive")
+                    break
+                if frame_type == FRAME_END:
+                    break
+                metrics.count("frames", stage="receive")
+                metrics.count("bytes", frame.nbytes, stage="receive")
+
+                session.capture[frame_type] = frame
+                session.frameCount += 1
+                if len(session.capture) == len(CAPTURE_TYPES):
+                    dataList = [session.capture[t] for t in CAPTURE_TYPES]
+                    session.capture = {}
+                    # submit blocks while the pipeline is full, so keep it
+                    # off the event loop
+                    persisted = await loop.run_in_executor(
+                        None, self.ingest, dataList, session.flightNum
+                    )
+                    session.pending.append(asyncio.wrap_future(persisted))
+
+            results = await asyncio.gather(*session.pending, return_exceptions=True)
+            failed = [r for r in results if isinstance(r, BaseException)]
+            for err in failed:
+                print(f"Error: capture of flight {session.flightNum} was lost: '{err}'")
+            if failed:
+                metrics.count("capture_errors", len(failed), stage="persist")
+            await loop.run_in_executor(None, self.flushDB)
+            self.reportGrowth()
+            self.profiler.stop(session.flightNum)
+            self.writeMetrics()
+        finally:
+            writer.close()
+
+        print(f"flight {session.flightNum} from {session.addr[0]} done")
+
+
+class DroneSession:
+    """State of one drone connection in the asyncio server.
+
+    Takes the place of the capture attribute the blocking server keeps on
+    DataUploader, so drones don't share it.
+    """
+
+    def __init__(self, addr, flightNum):
+        self.addr = addr
+        self.flightNum = flightNum
+        self.frameCount = 1
+        self.capture = {}
+        self.pending = []
 
-        # add image record to db
-        query_addImageRecord = "INSERT INTO image_records (locID, flightNum, date_time, irImagePath, rgbImagePath) VALUES (%s, %s, %s, %s, %s);"
-        params_addImageRecord = (locID, self.flightNum, date, ir_path, rgb_path)
-        execute_query(self.sqlConn, query_addImageRecord, params_addImageRecord)
 
-        # if image contains a hotspot record a hotspot
-        if size > 0:
-            query_addHS = "INSERT INTO hotspots (locID, flightNum, size, hotspot_status) VALUES (%s, %s, %s, %s);"
-            params_addHS = (locID, self.flightNum, size, 0)
-            execute_query(self.sqlConn, query_addHS, params_addHS)
+def processCapture(dataList, ir_codec="png", rgb_codec="png", calibration=None, blob_root=None):
+    """Save one capture's images and find its hotspots.
 
+    Uses no DataUploader state so it can run in a worker process. Returns
+    the arguments for DataUploader.appendEntryToDB, a metrics snapshot of
+    the stages it ran, for the parent process to merge, and, when saving to
+    the BlobStore at blob_root, the [(path, blob)] of the ir and rgb images
+    for the parent to index.
+    """
+    with metrics.recording() as stageMetrics:
+        # frames arrive decoded (see frame_protocol, which times that)
+        irRaw, rgbRaw, gpsRaw, timeRaw = dataList
+        # ir_data = (np.reshape(irRaw, self.mlx_shape))
+        # rgb_data = (np.reshape(rgbRaw, self.rgb_shape))
+        lon = gpsRaw[0]
+        lat = gpsRaw[1]
+        datetime_object = to_datetime(timeRaw)
+        date = datetime_object.strftime("%d-%m-%Y")
+        gps_time_part = f"{lon}_{lat}__{date}"
 
-d1 = DataUploader()
\ No newline at end of file
+        blobs = []
+        if blob_root:
+            store = BlobStore(blob_root)
+            blobs.append(DataUploader.saveArrToStore(irRaw, gps_time_part, "ir", store, codec=ir_codec))
+            blobs.append(DataUploader.saveArrToStore(rgbRaw, gps_time_part, "rgb", store, codec=rgb_codec))
+            ir_file_path, rgb_file_path = blobs[0][0], blobs[1][0]
+        else:
+            ir_file_path = DataUploader.saveArr(irRaw, gps_time_part, type="ir", codec=ir_codec)
+            rgb_file_path = DataUploader.saveArr(rgbRaw, gps_time_part, type="rgb", codec=rgb_codec)
+
+        # one hotspot per connected region, sized in interpolated pixels: a
+        # capture's sizes add up to the detect_fires count stored before
+        with metrics.timed("detect"):
+            hotspots = extract_hotspots(irRaw, calibration=calibration)
+        sizes = [int(area) for area in hotspots["interp_area"]]
+        metrics.count("hotspots", len(sizes), stage="detect")
+        print(f"found {len(sizes)} hotspots")
+
+    record = (
+        lon.astype(float),
+        lat.astype(float),
+        datetime_object,
+        str(ir_file_path),
+        str(rgb_file_path),
+        sizes,
+    )
+    return record, stageMetrics.snapshot(), blobs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receive drone captures and store them")
+    parser.add_argument(
+        "--async", dest="serve_async", action="store_true",
+        help="serve many drones concurrently with asyncio",
+    )
+    parser.add_argument("--db-pool-size", type=int, default=4, help="max MySQL connections")
+    parser.add_argument("--waypoints", help="mission planner waypoint file to seed locations from")
+    parser.add_argument(
+        "--snap-radius", type=float, default=DEFAULT_RADIUS_M,
+        help="metres within which a capture reuses an existing location",
+    )
+    parser.add_argument("--ir-codec", default="png", help="ir image tier: png[:level], jpeg[:quality], preview[:px[:quality]]")
+    parser.add_argument("--rgb-codec", default="png", help="rgb image tier, as --ir-codec")
+    parser.add_argument("--metrics-port", type=int, help="serve /metrics and /metrics.json on this port")
+    parser.add_argument("--metrics-file", help="write metrics here after every flight (.prom for Prometheus text)")
+    parser.add_argument("--profile-dir", help="write a cProfile dump of every flight here")
+    parser.add_argument("--calibration", help="MLX90640 calibration .npz (see thermal_preprocess) for detection")
+    parser.add_argument("--derived-dir", help="make thumbnails and ir views of every capture here (see image_pyramid)")
+    parser.add_argument("--derived-max-mb", type=float, default=512, help="size bound of --derived-dir")
+    parser.add_argument("--image-store", help="keep images content-addressed under this directory (see image_store)")
+    args = parser.parse_args()
+    d1 = DataUploader(
+        serve_async=args.serve_async,
+        db_pool_size=args.db_pool_size,
+        waypoints=args.waypoints,
+        snap_radius=args.snap_radius,
+        ir_codec=args.ir_codec,
+        rgb_codec=args.rgb_codec,
+        metrics_port=args.metrics_port,
+        metrics_file=args.metrics_file,
+        profile_dir=args.profile_dir,
+        calibration=args.calibration,
+        derived_dir=args.derived_dir,
+        derived_max_mb=args.derived_max_mb,
+        image_store=args.image_store,
+    )
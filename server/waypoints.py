@@ -0,0 +1,26 @@
+##########################################
+# Waypoint files from the flight planner
+##########################################
+#
+# The drone flies and triggers captures at these; the server seeds its
+# locations with them so captures snap to the planned points.
+
+
+def load_gps(path):
+    ''' Waypoint file format for parsing
+        QGC WPL <VERSION>
+        <INDEX> <CURRENT WP> <COORD FRAME> <COMMAND> <PARAM1> <PARAM2> <PARAM3> <PARAM4> <PARAM5/X/LATITUDE> <PARAM6/Y/LONGITUDE> <PARAM7/Z/ALTITUDE> <AUTOCONTINUE>
+    '''
+    file = open(path, "r")
+    file.readline() # Read QGC, WPL <Version>
+    file.readline() # Read home location information (not a waypoint)
+    path_data = file.readlines() # path_data contains all the waypoints
+    gps_coord = []
+    
+    # Parse GPS coordinates for all the waypoints, skipping any 0.0 (non coordinate instructions)
+    for wayPoint in path_data:
+        wayPoint = wayPoint.split('\t')
+        if float(wayPoint[8]) != 0 or float(wayPoint[9]) != 0:
+            gps_coord.append((wayPoint[8], wayPoint[9]))
+
+    return gps_coord